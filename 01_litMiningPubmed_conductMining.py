@@ -4,22 +4,57 @@ __version__ = 'm.gruenstaeudl@fu-berlin.de|2022-08-04T22:09:36 CEST'
 #-----------------------------------------------------------------#
 ## IMPORTS
 import argparse
-import Bio
-from Bio import Entrez  # line is necessary, see: https://www.biostars.org/p/13099/
-import bs4
-import coloredlogs
+import bisect
 import collections
+import contextlib
 import copy
+import cProfile
 import datetime
-import ipdb
+import glob
+import hashlib
+import heapq
+import importlib
+import io
+import itertools
 import json
 import logging
-import lxml
-from lxml import etree  # line is necessary, see: https://stackoverflow.com/questions/41066480/lxml-error-on-windows-attributeerror-module-lxml-has-no-attribute-etree
+import os
+import pickle
 import pprint
+import pstats
+import queue
 import re
+import socket
+import sqlite3
+import sys
+import threading
 import time
-import urllib
+import zlib
+
+
+class LazyImport:
+
+    def __init__(self, name):
+        '''Stand in for `import <name>`, importing the module only when one of its attributes is first used'''
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attr):
+        if self.module is None:
+            importlib.import_module(self.name)
+            self.module = sys.modules[self.name.split('.')[0]]  # Like `import Bio.Entrez`, which binds `Bio`
+        return getattr(self.module, attr)
+
+## Third-party and slow modules are only imported by the subcommands that use them
+Bio = LazyImport('Bio.Entrez')  # Bio.Entrez must be imported explicitly, see: https://www.biostars.org/p/13099/
+bs4 = LazyImport('bs4')
+coloredlogs = LazyImport('coloredlogs')
+gzip = LazyImport('gzip')
+lxml = LazyImport('lxml.etree')  # lxml.etree must be imported explicitly, see: https://stackoverflow.com/questions/41066480/lxml-error-on-windows-attributeerror-module-lxml-has-no-attribute-etree
+multiprocessing = LazyImport('multiprocessing')
+numpy = LazyImport('numpy')
+tarfile = LazyImport('tarfile')
+urllib = LazyImport('urllib.request')
 
 
 #-----------------------------------------------------------------#
@@ -32,25 +67,70 @@ pp = pprint.PrettyPrinter(indent=4)
 #pp.pprint(my_dict)
 #print(json.dumps(masterDict, indent=4))
 
-#ipdb.set_trace()
+#import ipdb; ipdb.set_trace()
 
 #-----------------------------------------------------------------#
 # CLASSES AND FUNCTIONS
 class PubMedInteract:
 
-    def __init__(self, email):
+    def __init__(self, email, cache=None):
         self.email = email
+        self.cache = cache
+
+    max_retrievable = 10000  # PubMed returns at most this many uids of a search result set, however they are paged
 
-    def search_via_query(self, query):
-        '''Search PubMed via a query'''
+    def search_via_query(self, query, page_size=10000, mindate=None, maxdate=None, datetype='edat', cache_ttl=0):
+        '''Search PubMed via a query, optionally restricted to a date range, collecting the uids page by page; the uids of an earlier search are only reused within `cache_ttl` seconds'''
+        cache_key = query if not mindate else '%s|%s:%s-%s' % (query, datetype, mindate, maxdate)
+        if self.cache and cache_ttl > 0:
+            payload = self.cache.get('esearch', cache_key, cache_ttl)
+            if payload:
+                return json.loads(payload)
+        result, uids = None, []
+        for search, page_uids in self.iter_search_pages(query, page_size, mindate, maxdate, datetype):
+            if result is None:
+                result = {key: value for key, value in search.items() if key not in ('WebEnv', 'QueryKey')}
+            uids.extend(page_uids)
+        uids = list(dict.fromkeys(uids))  # Date windows may overlap at their boundaries
+        result.update(Count=str(len(uids)), RetMax=str(len(uids)), IdList=uids)
+        if self.cache:
+            self.cache.put('esearch', cache_key, json.dumps(result).encode('utf8'))
+        return result
+
+    def iter_search_pages(self, query, page_size, mindate=None, maxdate=None, datetype='edat'):
+        '''Yield (search result, page of uids) from the Entrez history server, splitting the date range where the result set is too large to page through'''
         Bio.Entrez.email = self.email
+        date_range = {'mindate': mindate, 'maxdate': maxdate, 'datetype': datetype} if mindate else {}
         handle = Bio.Entrez.esearch(db='pubmed', 
                                 sort='relevance', 
-                                retmax='100000',  # set to 20 by default
-                                #retmode='xml',  # set to xml by default
-                                term=query)
-        result = Bio.Entrez.read(handle)
-        return result
+                                retmax=0,  # uids are fetched from the history server below
+                                usehistory='y',
+                                term=query,
+                                **date_range)
+        search = Bio.Entrez.read(handle)
+        count = int(search['Count'])
+        if count > self.max_retrievable:
+            first = datetime.datetime.strptime(mindate, '%Y/%m/%d').date() if mindate else datetime.date(1800, 1, 1)
+            last = datetime.datetime.strptime(maxdate, '%Y/%m/%d').date() if maxdate else datetime.date.today()
+            if first < last:
+                middle = first + (last - first) // 2
+                yield from self.iter_search_pages(query, page_size, first.strftime('%Y/%m/%d'), middle.strftime('%Y/%m/%d'), datetype)
+                yield from self.iter_search_pages(query, page_size, (middle + datetime.timedelta(days=1)).strftime('%Y/%m/%d'), last.strftime('%Y/%m/%d'), datetype)
+                return
+            # Dates of Entrez searches have a resolution of one day, so this window cannot be split further
+            logging.getLogger(__name__).warning("search window %s to %s (%s) holds %s uids, of which only the first %s can be retrieved; %s uids are dropped"
+                                                % (first.strftime('%Y/%m/%d'), last.strftime('%Y/%m/%d'), datetype, count, self.max_retrievable, count - self.max_retrievable))
+        if count == 0:
+            yield search, []
+        for retstart in range(0, min(count, self.max_retrievable), page_size):
+            handle = Bio.Entrez.efetch(db='pubmed',
+                                   rettype='uilist',
+                                   retmode='text',
+                                   retstart=retstart,
+                                   retmax=page_size,
+                                   webenv=search['WebEnv'],
+                                   query_key=search['QueryKey'])
+            yield search, handle.read().split()
 
     def retrieve_metadata(self, uid):
         '''Fetch metadata on PubMed for a given uid'''
@@ -61,6 +141,26 @@ class PubMedInteract:
         result = Bio.Entrez.read(handle)
         return result
 
+    def retrieve_cached_metadata(self, uid):
+        '''Look up the metadata of a given uid in the cache; returns None if absent or expired'''
+        if self.cache:
+            payload = self.cache.get('efetch', uid)
+            if payload:
+                return json.loads(payload)
+        return None
+
+    def retrieve_metadata_batch(self, uids):
+        '''Fetch metadata on PubMed for a page of uids in a single request (Bio.Entrez posts long lists of uids); the records need not come in the order of the uids'''
+        Bio.Entrez.email = self.email
+        handle = Bio.Entrez.efetch(db='pubmed',
+                               retmode='xml',
+                               id=list(uids))
+        result = Bio.Entrez.read(handle)
+        if self.cache:
+            for article in result['PubmedArticle']:
+                self.cache.put('efetch', XMLparsing().article_pmid(article), json.dumps(article).encode('utf8'))
+        return result['PubmedArticle']
+
     def PMCID_to_PMID(self, pmid):
         '''Look up PubMedCentral ID from a PubMed ID'''
         Bio.Entrez.email = self.email
@@ -76,6 +176,27 @@ class PubMedInteract:
             pmcid = None
         return pmcid
 
+    def PMCID_to_PMID_batch(self, pmids):
+        '''Look up PubMedCentral IDs from a list of PubMed IDs in a single request'''
+        Bio.Entrez.email = self.email
+        handle = Bio.Entrez.elink(dbfrom='pubmed',
+                              db='pmc',
+                              linkname='pubmed_pmc',
+                              id=list(pmids),  # passing a list returns one LinkSet per PubMed ID
+                              retmode='text')
+        result = Bio.Entrez.read(handle)
+        pmcids = {}
+        for linkset in result:
+            try:
+                pmid = linkset['IdList'][0]
+            except:
+                continue
+            try:
+                pmcids[pmid] = 'PMC' + linkset['LinkSetDb'][0]['Link'][0]['Id']
+            except:
+                pmcids[pmid] = None
+        return pmcids
+
 class XMLparsing:
 
     def __init__(self):
@@ -130,6 +251,16 @@ class XMLparsing:
             raise Exception("ERROR: Cannot parse the obligatory article PubMed ID (PMID).")
         return article_pmid
 
+    def article_metadata(self, inputxml, article_dict):
+        '''Parse all relevant metadata of an article into its dictionary'''
+        article_dict['article_title'] = self.article_title(inputxml)
+        article_dict['article_publdate'] = self.article_publdate(inputxml)
+        article_dict['article_publdate_str'] = MiscOps().convert_to_date(article_dict['article_publdate'])
+        article_dict['article_keywords'] = self.article_keywords(inputxml)
+        article_dict['article_mesh'] = self.article_mesh(inputxml)
+        article_dict['article_pmid'] = self.article_pmid(inputxml)
+        return article_dict
+
 class PMCIDops:
 
     def __init__(self):
@@ -143,6 +274,26 @@ class PMCIDops:
             article_pmcid = None
         return article_pmcid
     
+    def article_pmcids(self, article_pmids, email, pmcid_cache, batch_size):
+        '''Parse the article PMCIDs for a list of PMIDs, resolving only those not yet in the mapping cache; PMIDs that could not be resolved are missing from the result'''
+        article_pmcids = {}
+        unresolved = []
+        for pmid in article_pmids:
+            if pmid in pmcid_cache:
+                article_pmcids[pmid] = pmcid_cache.lookup(pmid)
+            else:
+                unresolved.append(pmid)
+        for start in range(0, len(unresolved), batch_size):
+            batch = unresolved[start:start+batch_size]
+            try:
+                resolved = PubMedInteract(email).PMCID_to_PMID_batch(batch)
+            except:
+                continue  # The PMIDs of a failed batch are left out, so that they are not taken as having no PMCID
+            pmcid_cache.update(resolved)
+            for pmid in batch:
+                article_pmcids[pmid] = resolved.get(pmid)
+        return article_pmcids
+
     def get_pmcid_bioc_url(self, article_pcmid):
         '''Form URL to access the fulltext via the PubMedCentral BioC API'''
         BioC_PMCID_pre = 'https://www.ncbi.nlm.nih.gov/research/bionlp/RESTful/pmcoa.cgi/BioC_xml/'
@@ -155,9 +306,350 @@ class PMCIDops:
         PubReader_PMCID_post = '/?report=reader'
         return PubReader_PMCID_pre + article_pcmid + PubReader_PMCID_post
 
+class PMCIDcache:
+
+    def __init__(self, cache_fn, negative_ttl_days):
+        '''Open the on-disk mapping of PMIDs to PMCIDs; a PMCID of `None` records that no PubMedCentral copy exists (yet, e.g. under embargo) and expires after the TTL'''
+        os.makedirs(os.path.dirname(cache_fn) or '.', exist_ok=True)
+        self.negative_ttl = negative_ttl_days * 86400
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(cache_fn, timeout=60, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS pmcids (pmid TEXT PRIMARY KEY, pmcid TEXT, resolved REAL)')
+        self.conn.commit()
+        json_fn = re.sub(r'\.sqlite$', '.json', cache_fn)
+        if os.path.isfile(json_fn) and not self.conn.execute('SELECT 1 FROM pmcids LIMIT 1').fetchone():
+            ## Taking over the mapping of earlier versions, which was written as a whole to a JSON file
+            with open(json_fn, "r") as json_file:
+                self.update(json.load(json_file), os.path.getmtime(json_fn))
+
+    def __contains__(self, pmid):
+        with self.lock:
+            row = self.conn.execute('SELECT pmcid, resolved FROM pmcids WHERE pmid = ?', (pmid,)).fetchone()
+        return bool(row) and not (row[0] is None and self.negative_ttl > 0 and row[1] < time.time() - self.negative_ttl)
+
+    def lookup(self, pmid):
+        '''Look up the cached PMCID of a PMID'''
+        with self.lock:
+            return self.conn.execute('SELECT pmcid FROM pmcids WHERE pmid = ?', (pmid,)).fetchone()[0]
+
+    def update(self, pmcids, resolved=None):
+        '''Add resolved PMIDs to the mapping, in a single transaction'''
+        resolved = resolved or time.time()
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO pmcids VALUES (?, ?, ?)', [(pmid, pmcid, resolved) for pmid, pmcid in pmcids.items()])
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+class DeltaState:
+
+    def __init__(self, state_fn):
+        '''Load the on-disk record of the last delta run of each query: its date and its merged results file'''
+        self.state_fn = state_fn
+        self.runs = {}
+        if os.path.isfile(state_fn):
+            with open(state_fn, "r") as json_file:
+                self.runs = json.load(json_file)
+
+    def lookup(self, query_string):
+        '''Look up the last run of a query; returns None if the query has not been run in delta mode or its results are gone'''
+        last_run = self.runs.get(query_string)
+        if last_run and os.path.isfile(last_run['results']):
+            return last_run
+        return None
+
+    def update(self, query_string, run_date, results_fn):
+        self.runs[query_string] = {'last_run': run_date, 'results': results_fn}
+
+    def save(self):
+        '''Write the state to disk'''
+        os.makedirs(os.path.dirname(self.state_fn) or '.', exist_ok=True)
+        tmp_fn = self.state_fn + '.tmp'
+        with open(tmp_fn, "w") as json_file:
+            json.dump(self.runs, json_file)
+        os.replace(tmp_fn, self.state_fn)
+
+class FetchCache:
+
+    def __init__(self, cache_fn, ttl_days, max_size_mb):
+        '''Open the on-disk cache of fetched payloads, keyed by source and PMID/PMCID and stored zlib-compressed by content hash'''
+        os.makedirs(os.path.dirname(cache_fn) or '.', exist_ok=True)
+        self.ttl = ttl_days * 86400
+        self.max_size = max_size_mb * 1024**2
+        self.lock = threading.Lock()
+        self.accessed = {}  # (source, key) -> access time not yet written
+        self.conn = sqlite3.connect(cache_fn, timeout=60, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS entries (source TEXT, key TEXT, digest TEXT, fetched REAL, accessed REAL, PRIMARY KEY (source, key))')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, payload BLOB, size INTEGER)')
+        self.conn.commit()
+        self.size = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+
+    flush_every = 1000  # Access times are written in batches of this many reads
+
+    def get(self, source, key, ttl=None):
+        '''Return the cached payload, or None if it is absent or older than the TTL (by default that of the cache)'''
+        ttl = self.ttl if ttl is None else ttl
+        with self.lock:
+            row = self.conn.execute('SELECT entries.fetched, blobs.payload FROM entries JOIN blobs USING (digest) WHERE source = ? AND key = ?', (source, key)).fetchone()
+            if not row or (ttl > 0 and row[0] < time.time() - ttl):
+                return None
+            self.accessed[(source, key)] = time.time()
+            if len(self.accessed) >= self.flush_every:
+                self.flush()
+        return zlib.decompress(row[1])
+
+    def has(self, source, key):
+        '''Check whether a payload is cached and within the TTL, without reading it'''
+        with self.lock:
+            row = self.conn.execute('SELECT fetched FROM entries WHERE source = ? AND key = ?', (source, key)).fetchone()
+        return bool(row) and not (self.ttl > 0 and row[0] < time.time() - self.ttl)
+
+    def flush(self):
+        '''Write the pending access times and commit; called with the lock held'''
+        if self.accessed:
+            self.conn.executemany('UPDATE entries SET accessed = ? WHERE source = ? AND key = ?', [(accessed, source, key) for (source, key), accessed in self.accessed.items()])
+            self.accessed.clear()
+        self.conn.commit()
+
+    def put(self, source, key, payload):
+        '''Store a payload, evicting the least recently used entries if the cache exceeds its size limit'''
+        digest = hashlib.sha256(payload).hexdigest()
+        now = time.time()
+        with self.lock:
+            if not self.conn.execute('SELECT 1 FROM blobs WHERE digest = ?', (digest,)).fetchone():
+                compressed = zlib.compress(payload)
+                self.conn.execute('INSERT INTO blobs VALUES (?, ?, ?)', (digest, compressed, len(compressed)))
+                self.size += len(compressed)
+            self.conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)', (source, key, digest, now, now))
+            self.accessed.pop((source, key), None)
+            self.flush()
+            if self.size > self.max_size:
+                self.evict()
+
+    def discard(self, source, key):
+        '''Remove an entry, e.g. because the record was modified upstream'''
+        with self.lock:
+            self.conn.execute('DELETE FROM entries WHERE source = ? AND key = ?', (source, key))
+            self.conn.commit()
+
+    def evict(self):
+        '''Remove the least recently used entries until the cache is below 90% of its size limit'''
+        while self.size > 0.9 * self.max_size:
+            rows = self.conn.execute('SELECT source, key FROM entries ORDER BY accessed LIMIT 100').fetchall()
+            if not rows:
+                break
+            self.conn.executemany('DELETE FROM entries WHERE source = ? AND key = ?', rows)
+            self.conn.execute('DELETE FROM blobs WHERE digest NOT IN (SELECT digest FROM entries)')
+            self.size = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+        self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.flush()
+        self.conn.close()
+
+class RunMetrics:
+
+    buckets = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf')]  # Upper bounds of the timing histograms, in seconds
+    n_slowest = 10
+
+    def __init__(self, profile_timers=()):
+        '''Collect counters and timing histograms of a mining run from all threads'''
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = collections.Counter()
+        self.timings = {}
+        self.profile_timers = set(profile_timers)
+        self.profiles = {}  # timer name -> pstats.Stats
+
+    def count(self, name, value=1):
+        '''Increase a counter; returns its new value'''
+        with self.lock:
+            self.counters[name] += value
+            return self.counters[name]
+
+    def observe(self, name, seconds, uid=None):
+        '''Add a duration to the histogram of a timer, keeping the slowest uids'''
+        now = time.time()
+        with self.lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                timing = self.timings[name] = {'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0]*len(self.buckets), 'slowest': [], 'first': now-seconds, 'last': now}
+            timing['count'] += 1
+            timing['sum'] += seconds
+            timing['max'] = max(timing['max'], seconds)
+            timing['buckets'][bisect.bisect_left(self.buckets, seconds)] += 1
+            timing['first'] = min(timing['first'], now-seconds)
+            timing['last'] = max(timing['last'], now)
+            if uid is not None:
+                heapq.heappush(timing['slowest'], (seconds, uid))
+                if len(timing['slowest']) > self.n_slowest:
+                    heapq.heappop(timing['slowest'])
+
+    @contextlib.contextmanager
+    def timer(self, name, uid=None):
+        '''Time a block of code, under cProfile if profiling of this timer was requested'''
+        profile = None
+        if name in self.profile_timers:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:  # Another profiler is active in this thread
+                profile = None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if profile:
+                profile.disable()
+                with self.lock:
+                    if name in self.profiles:
+                        self.profiles[name].add(profile)
+                    else:
+                        self.profiles[name] = pstats.Stats(profile)
+            self.observe(name, seconds, uid)
+
+    def summary(self):
+        '''Return the counters and, for every timer, its count, total, mean, maximum, histogram and slowest uids'''
+        with self.lock:
+            timings = {}
+            for name, timing in sorted(self.timings.items()):
+                timings[name] = {'count': timing['count'],
+                                 'sum_s': round(timing['sum'], 6),
+                                 'mean_s': round(timing['sum'] / timing['count'], 6),
+                                 'max_s': round(timing['max'], 6),
+                                 'active_s': round(timing['last'] - timing['first'], 6),
+                                 'histogram': {str(bound): n for bound, n in zip(self.buckets, itertools.accumulate(timing['buckets']))},
+                                 'slowest': [{'uid': uid, 'seconds': round(seconds, 6)} for seconds, uid in sorted(timing['slowest'], reverse=True)]}
+            return {'started': datetime.datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                    'wall_s': round(time.time() - self.started, 3),
+                    'counters': dict(sorted(self.counters.items())),
+                    'timings': timings}
+
+    def write_json(self, json_filename):
+        with open(json_filename, "w") as json_file:
+            json.dump(self.summary(), json_file, indent=2)
+
+    def write_prometheus(self, textfile_fn):
+        '''Write the metrics in the Prometheus text format, atomically as required by the node exporter textfile collector'''
+        summary = self.summary()
+        lines = ['# TYPE litmining_events_total counter']
+        for name, value in summary['counters'].items():
+            lines.append('litmining_events_total{event="%s"} %s' % (name, value))
+        lines.append('# TYPE litmining_duration_seconds histogram')
+        for name, timing in summary['timings'].items():
+            for bound, n in timing['histogram'].items():
+                lines.append('litmining_duration_seconds_bucket{timer="%s",le="%s"} %s' % (name, '+Inf' if bound == 'inf' else bound, n))
+            lines.append('litmining_duration_seconds_sum{timer="%s"} %s' % (name, timing['sum_s']))
+            lines.append('litmining_duration_seconds_count{timer="%s"} %s' % (name, timing['count']))
+        lines.append('# TYPE litmining_wall_seconds gauge')
+        lines.append('litmining_wall_seconds %s' % summary['wall_s'])
+        tmp_fn = textfile_fn + '.tmp'
+        with open(tmp_fn, "w") as outfile:
+            outfile.write('\n'.join(lines) + '\n')
+        os.replace(tmp_fn, textfile_fn)
+
+    def write_profiles(self, output_fn):
+        '''Write the collected cProfile statistics of each profiled timer'''
+        for name, stats in self.profiles.items():
+            stats.dump_stats('%s.%s.pstats' % (output_fn, name))
+
+class MetricsLogHandler(logging.Handler):
+
+    def __init__(self, metrics):
+        '''Count the warnings and errors logged during a run'''
+        super().__init__(level=logging.WARNING)
+        self.metrics = metrics
+
+    def emit(self, record):
+        self.metrics.count('log_%s' % record.levelname.lower())
+
+class RateLimiter:
+
+    def __init__(self, rate):
+        '''Token bucket shared by all download threads, refilled at `rate` requests per second'''
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        '''Block until the next request may be sent'''
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+            self.tokens -= 1  # A negative balance reserves a slot in the future
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+class FulltextFetcher:
+
+    def __init__(self, rate_limiter, timeout, max_retries, cache=None, metrics=None):
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.cache = cache
+        self.metrics = metrics or RunMetrics()
+
+    def fetch_url(self, request):
+        '''Download a URL, retrying with backoff on timeouts, 429 and server errors'''
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as handle:
+                    return handle.read()
+            except urllib.error.HTTPError as error:
+                if (error.code != 429 and error.code < 500) or attempt == self.max_retries:
+                    raise
+            except (urllib.error.URLError, TimeoutError, ConnectionError):
+                if attempt == self.max_retries:
+                    raise
+            self.metrics.count('fetch_retries')
+            time.sleep(0.5 * 2**attempt)
+
+    @staticmethod
+    def refused(error):
+        '''Whether a download failed for good, i.e. with an HTTP error other than 429 and server errors'''
+        return isinstance(error, urllib.error.HTTPError) and error.code != 429 and error.code < 500
+
+    def fetch_article(self, pmcid, bioc_url, pubreader_url):
+        '''Read the full text from the cache or download it via the BioC API, falling back to the PubReader; returns None if both refuse it and raises if a download failed otherwise'''
+        if self.cache:
+            for source in ['bioc', 'pubreader']:
+                article_complete = self.cache.get(source, pmcid)
+                if article_complete:
+                    self.metrics.count('cache_hits_%s' % source)
+                    return article_complete
+            self.metrics.count('cache_misses_fulltext')
+        try:
+            with self.metrics.timer('fetch_bioc', pmcid):
+                source, article_complete = 'bioc', self.fetch_url(bioc_url)
+        except Exception as bioc_error:
+            try:
+                request = urllib.request.Request(pubreader_url, headers={'User-Agent': 'Mozilla/5.0'})
+                with self.metrics.timer('fetch_pubreader', pmcid):
+                    source, article_complete = 'pubreader', self.fetch_url(request)
+            except Exception as pubreader_error:
+                # Only if both sources refuse the article is it unavailable; any other failure may pass and is raised
+                if self.refused(bioc_error) and self.refused(pubreader_error):
+                    return None
+                raise
+        self.metrics.count('bytes_downloaded_%s' % source, len(article_complete))
+        if self.cache and article_complete:
+            self.cache.put(source, pmcid, article_complete)
+        return article_complete
+
 class LXMLops:
 
-    def __init__(self, etree):
+    expendable_sections = {'FIG', 'TABLE', 'COMP_INT', 'AUTH_CONT', 'SUPPL', 'ACK_FUND'}
+
+    def __init__(self, etree=None):
         self.etree = etree
 
     def remove_expendable(self):
@@ -187,8 +679,130 @@ class LXMLops:
         #        paragraphs.append(paragraph)
         return paragraphs
 
+    def iter_all_text(self, xml_source):
+        '''Extract all text of the full text by paragraph in a single streaming pass, skipping unnecessary sections'''
+        if isinstance(xml_source, bytes):
+            xml_source = io.BytesIO(xml_source)
+        known = set()  # Headers and paragraphs yielded so far
+        for event, passage in lxml.etree.iterparse(xml_source, events=('end',), tag='passage'):
+            header, passage_type, main_text = self.passage_fields(passage)
+            # Skipping figures, tables, any backmatter parts and references
+            if header not in self.expendable_sections and passage_type != 'ref':
+                yield from self.passage_paragraphs(header, main_text, known)
+            # Freeing the processed passage and its preceding siblings
+            passage.clear()
+            while passage.getprevious() is not None:
+                del passage.getparent()[0]
+
+    def passage_paragraphs(self, header, main_text, known):
+        '''Return the paragraphs of a passage as in extract_all_text: its header unless already known, then its main text'''
+        paragraphs = []
+        if header not in known:
+            known.add(header)
+            paragraphs.append(header)
+        if main_text:
+            known.add(main_text)
+            paragraphs.append(main_text)
+        return paragraphs
+
+    def passage_fields(self, passage):
+        '''Return the section type, type and text of a passage'''
+        header, passage_type, main_text = None, None, None
+        for child in passage:
+            if child.tag == 'infon':
+                key = child.get('key')
+                if key == 'section_type':
+                    header = child.text
+                elif key == 'type':
+                    passage_type = child.text
+            elif child.tag == 'text':
+                main_text = child.text
+        return header, passage_type, main_text
+
+    def iter_documents(self, xml_source):
+        '''Yield (infons of the front passage, paragraphs) of every document of a BioC collection in a single streaming pass, skipping unnecessary sections'''
+        if isinstance(xml_source, bytes):
+            xml_source = io.BytesIO(xml_source)
+        front, paragraphs, known = None, [], set()
+        for event, element in lxml.etree.iterparse(xml_source, events=('end',), tag=('passage', 'document')):
+            if element.tag == 'document':
+                yield front or {}, paragraphs
+                front, paragraphs, known = None, [], set()
+            else:
+                header, passage_type, main_text = self.passage_fields(element)
+                if front is None:
+                    # The first passage holds the front matter: title, article ids, year and keywords
+                    front = {child.get('key'): child.text for child in element if child.tag == 'infon'}
+                    front['title'] = main_text
+                if header not in self.expendable_sections and passage_type != 'ref':
+                    paragraphs.extend(self.passage_paragraphs(header, main_text, known))
+            # Freeing the processed element and its preceding siblings
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+class JATSops:
+
+    expendable_tags = {'fig', 'table-wrap', 'supplementary-material', 'ref-list', 'ack', 'fn-group', 'glossary'}
+
+    def __init__(self, xml):
+        '''Parse a full text in the JATS format of the PMC Open Access packages (.nxml)'''
+        self.root = lxml.etree.fromstring(xml, lxml.etree.XMLParser(resolve_entities=False, no_network=True, huge_tree=True))
+        self.meta = self.root.find('front/article-meta')
+
+    def text(self, element):
+        '''Return the text of an element and its children, with whitespace collapsed'''
+        return ' '.join(''.join(element.itertext()).split()) if element is not None else None
+
+    def article_ids(self):
+        '''Return the PMID and PMCID of the article'''
+        ids = {element.get('pub-id-type'): (element.text or '').strip() for element in self.meta.findall('article-id')}
+        pmcid = ids.get('pmc') or ids.get('pmcid')
+        return ids.get('pmid') or None, 'PMC' + pmcid.replace('PMC', '') if pmcid else None
+
+    def article_publdate(self):
+        '''Parse the date of publication, preferring the electronic one'''
+        pub_dates = sorted(self.meta.findall('pub-date'), key=lambda element: (element.get('pub-type') or element.get('date-type')) not in ('epub', 'pub'))
+        for pub_date in pub_dates:
+            if pub_date.findtext('year'):
+                article_publdate = {'Year': pub_date.findtext('year').strip()}
+                if pub_date.findtext('month'):
+                    article_publdate['Month'] = pub_date.findtext('month').strip().zfill(2)
+                return article_publdate
+        return None
+
+    def article_metadata(self, article_dict):
+        '''Parse all relevant metadata of an article into its dictionary, with the same fields as from PubMed'''
+        article_dict['article_title'] = self.text(self.meta.find('title-group/article-title'))
+        article_dict['article_publdate'] = self.article_publdate()
+        article_dict['article_publdate_str'] = MiscOps().convert_to_date(article_dict['article_publdate'] or {})
+        article_dict['article_keywords'] = [self.text(kwd) for kwd in self.meta.iter('kwd')] or None
+        article_dict['article_mesh'] = None  # MeSH terms are assigned by PubMed, not part of the full text
+        article_dict['article_pmid'], article_dict['article_pmcid'] = self.article_ids()
+        return article_dict
+
+    def extract_all_text(self):
+        '''Extract all text of the full text by paragraph (title, abstract, body and appendices), skipping unnecessary sections'''
+        paragraphs, known = [], set()
+        sections = [self.meta.find('title-group/article-title')] + self.meta.findall('abstract') + self.root.findall('body') + self.root.findall('back/app-group')
+        for section in sections:
+            if section is None:
+                continue
+            for element in section.iter('title', 'article-title', 'p'):
+                if any(ancestor.tag in self.expendable_tags for ancestor in element.iterancestors()):
+                    continue
+                paragr = self.text(element)
+                if paragr and paragr not in known:
+                    known.add(paragr)
+                    paragraphs.append(paragr)
+        return paragraphs
+
 class HTMLops:
 
+    expendable_ids = ['ack-1', 'fn-group-1', '__ffn_sec', 'ref-list-1']
+    p_start_pattern = re.compile(r'<p[\s/>]', re.IGNORECASE)
+    p_end_pattern = re.compile(r'</p\s*>', re.IGNORECASE)
+
     def __init__(self):
         pass
     
@@ -214,6 +828,36 @@ class HTMLops:
         all_paragraphs = list(filter(None, all_paragraphs))  # removing empty strings in list
         return all_paragraphs
 
+    def extract_all_text_lxml(self, html):
+        '''Extract all text of the full text by paragraph via lxml, skipping unnecessary sections instead of removing them; returns None where the paragraphs may differ from those of BeautifulSoup'''
+        if isinstance(html, bytes):
+            html = html.decode('utf-8', errors='replace')
+        # The HTML parser of libxml2 closes a paragraph at any block element (e.g., div, table, ul, p) it holds and drops the stray end tag,
+        # whereas BeautifulSoup keeps the nesting of the page; such pages are recognized by a mismatched end tag or by unbalanced paragraph tags
+        if len(self.p_start_pattern.findall(html)) != len(self.p_end_pattern.findall(html)):
+            return None
+        parser = lxml.etree.HTMLParser()
+        html_root = lxml.etree.fromstring(html, parser)
+        if any(error.type_name == 'ERR_TAG_NAME_MISMATCH' for error in parser.error_log):
+            return None
+        html_article = html_root.find('.//article[@data-type="main"]')
+        expendable = ' or '.join('@id="%s"' % div_id for div_id in self.expendable_ids)
+        all_paragraphs = []
+        for div in html_article.xpath('.//div[normalize-space(@class)="tsec sec"][not(ancestor-or-self::div[%s])]' % expendable):
+            for paragr in div.xpath('.//p[not(ancestor::div[%s])]' % expendable):
+                # Skipping scripts and style sheets and collapsing whitespace-only strings the way BeautifulSoup does
+                all_paragraphs.append(''.join(text if text.strip(' \t\n\r\f') else ('\n' if '\n' in text else ' ') for text in paragr.xpath('.//text()[not(ancestor::script or ancestor::style or ancestor::template)]')))
+        all_paragraphs = list(filter(None, all_paragraphs))  # removing empty strings in list
+        return all_paragraphs
+
+    def extract_all_text_bs4(self, html):
+        '''Extract all text of the full text by paragraph via BeautifulSoup (reference backend)'''
+        fulltext_soup = bs4.BeautifulSoup(html, 'html.parser')
+        # Remove unnecessary sections from full text
+        html_divs = self.remove_expendable(fulltext_soup)
+        # Extract all text of the full text by paragraph
+        return self.extract_all_text(html_divs)
+
 class ParagrOps:
 
     def __init__(self):
@@ -227,19 +871,1180 @@ class ParagrOps:
                 paragraphs.append(paragr.strip())
         return paragraphs
 
+    def remove_duplicate_results(self, result_paragraphs, result_spans):
+        '''Remove all duplicate result paragraphs, together with their spans'''
+        spans_of = dict(zip(result_paragraphs, result_spans))
+        unique_paragraphs = self.remove_duplicate_paragraphs(result_paragraphs)
+        return unique_paragraphs, [spans_of[paragr] for paragr in unique_paragraphs]
+
+    def unfold_spans(self, text, folded, spans):
+        '''Map (start, end, ...) spans in the case-folded text to the text, where case folding changed the length (e.g., ß to ss)'''
+        if len(folded) == len(text):
+            return spans
+        origins = [pos for pos, char in enumerate(text) for i in range(len(char.casefold()))]
+        return [(origins[span[0]], origins[span[1]-1]+1) + tuple(span[2:]) for span in spans]
+
+    def normalize_paragraph(self, paragr):
+        '''Case-fold a paragraph and collapse its whitespace'''
+        return ' '.join(paragr.casefold().split())
+
     def remove_duplicate_paragraphs(self, in_list):
-        '''Remove all duplicate paragraphs'''
+        '''Remove all duplicate paragraphs, comparing hashes of the normalized text'''
         unique_paragraphs = []
-        known_paragraphs = []
+        known_hashes = set()
         for paragr in in_list:
-            if paragr not in known_paragraphs:
+            paragr_hash = hashlib.sha1(self.normalize_paragraph(paragr).encode('utf-8')).digest()
+            if paragr_hash not in known_hashes:
                 unique_paragraphs.append(paragr)
-                known_paragraphs.append(paragr)
-            else:
-                pass
-                #print("Duplicate: \n\n %s" % paragr)
+                known_hashes.add(paragr_hash)
         return unique_paragraphs
 
+class DuplicateFinder:
+
+    prime = 4294967311  # Smallest prime above 2**32, the range of the shingle hashes
+
+    def __init__(self, threshold, shingle_size=5, bands=16, rows=4):
+        '''Group near-duplicate paragraphs by MinHash signatures over word shingles, with LSH banding to find candidates'''
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.bands = bands
+        self.rows = rows
+        random_state = numpy.random.RandomState(1)  # Fixed seed, so that signatures are reproducible across runs
+        self.coef_a = random_state.randint(1, 2**31, size=bands*rows).astype(numpy.uint64)
+        self.coef_b = random_state.randint(0, 2**31, size=bands*rows).astype(numpy.uint64)
+        self.buckets = collections.defaultdict(list)  # (band, band signature) -> paragraph numbers, at most one per group when added
+        self.exact = {}  # hash of normalized paragraph -> paragraph number
+        self.provenance = []  # paragraph number -> [(uid, index of paragraph in article)] of all its exact duplicates
+        self.paragraphs = []
+        self.signatures = []
+        self.parent = []  # union-find forest over paragraph numbers
+
+    def signature(self, normalized):
+        '''Compute the MinHash signature of the word shingles of a normalized paragraph'''
+        words = normalized.split()
+        shingles = {' '.join(words[i:i+self.shingle_size]) for i in range(max(1, len(words)-self.shingle_size+1))}
+        shingle_hashes = numpy.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles), dtype=numpy.uint64, count=len(shingles))
+        return ((numpy.outer(self.coef_a, shingle_hashes) + self.coef_b[:, None]) % numpy.uint64(self.prime)).min(axis=1)
+
+    def find(self, num):
+        while self.parent[num] != num:
+            self.parent[num] = self.parent[self.parent[num]]
+            num = self.parent[num]
+        return num
+
+    def add(self, uid, index, paragr):
+        '''Add a paragraph and merge it into the group of every sufficiently similar candidate; exact duplicates only add their provenance'''
+        normalized = ParagrOps().normalize_paragraph(paragr)
+        paragr_hash = hashlib.sha1(normalized.encode('utf-8')).digest()
+        if paragr_hash in self.exact:
+            self.provenance[self.exact[paragr_hash]].append((uid, index))
+            return
+        num = len(self.paragraphs)
+        sig = self.signature(normalized)
+        self.exact[paragr_hash] = num
+        self.provenance.append([(uid, index)])
+        self.paragraphs.append(paragr)
+        self.signatures.append(sig)
+        self.parent.append(num)
+        buckets = [self.buckets[(band, band_sig.tobytes())] for band, band_sig in enumerate(sig.reshape(self.bands, self.rows))]
+        ## Comparing with the distinct candidates of all bands, until one member of each group is similar enough
+        candidates = collections.defaultdict(list)  # root -> candidates in its group
+        for candidate in sorted({candidate for bucket in buckets for candidate in bucket}):
+            candidates[self.find(candidate)].append(candidate)
+        for candidate_root, group in sorted(candidates.items()):
+            if any(numpy.mean(sig == self.signatures[candidate]) >= self.threshold for candidate in group):
+                root = self.find(num)
+                self.parent[max(root, candidate_root)] = min(root, candidate_root)  # The earliest paragraph stays the root
+        root = self.find(num)
+        for bucket in buckets:
+            if not any(self.find(candidate) == root for candidate in bucket):  # Keeps the buckets from growing with the groups
+                bucket.append(num)
+
+    def groups(self):
+        '''Return the groups of near-duplicate paragraphs with the provenance of each member, represented by their earliest paragraph'''
+        members = collections.defaultdict(list)
+        for num in range(len(self.paragraphs)):
+            members[self.find(num)].append(num)
+        groups = []
+        for root, nums in members.items():
+            if len(nums) > 1 or len(self.provenance[root]) > 1:
+                groups.append({'paragraph': self.paragraphs[root],
+                               'members': [{'uid': uid,
+                                            'paragraph_index': index,
+                                            'similarity': float(numpy.mean(self.signatures[num] == self.signatures[root]))} for num in nums for uid, index in self.provenance[num]]})
+        return groups
+
+class CooccurrenceRule:
+
+    windows = ['substring', 'paragraph', 'sentence', 'tokens']
+    default_sizes = {'substring': 0, 'paragraph': 0, 'sentence': 0, 'tokens': 10}
+    priorities = {'gene': 0, 'toxin': 1, 'keyw': 2}  # Of overlapping spans of the same length, the first one is highlighted (cf. the highlighter)
+    abbreviations = {'al', 'approx', 'ca', 'cf', 'eq', 'fig', 'figs', 'no', 'nos', 'ref', 'refs', 'resp', 'sp', 'spp', 'ssp', 'subsp', 'suppl', 'tab', 'var', 'vol', 'vs'}
+    # Word tokens, and the full stops, question and exclamation marks that end a sentence: followed by a capital letter or a digit, or by the end of the paragraph
+    token_pattern = re.compile(r'''(\w+)|[.!?]+(?=["')\]]*(?:\s+["'(\[]?[A-Z0-9]|\s*$))''')
+
+    def __init__(self, window='substring', window_size=None, keywVariants_list=()):
+        '''Rule by which toxin and gene names co-occur in a paragraph: anywhere, also within words (`substring`, the original rule), as whole words anywhere (`paragraph`), as whole words within `window_size` sentences of each other (`sentence`) or with at most `window_size` tokens between them (`tokens`)'''
+        self.window = window
+        self.window_size = self.default_sizes[window] if window_size is None else window_size
+        # Keyword variants such as ' gene,' are found as the word token they contain
+        self.keywords = {words[0] for words in (re.findall(r'\w+', keyw) for keyw in keywVariants_list) if len(words) == 1}
+        # The keywords as whole word tokens, for the original rule, which needs no tokenization otherwise
+        self.keyword_pattern = re.compile(r'(?<!\w)(?:%s)(?!\w)' % '|'.join(re.escape(keyw) for keyw in sorted(self.keywords, key=len, reverse=True))) if self.keywords else None
+
+    def settings(self):
+        '''Describe the rule for the matcher hash; the original rule adds nothing, so that the hashes of earlier runs remain valid'''
+        return [] if self.window == 'substring' else ['cooccurrence %s %s' % (self.window, self.window_size)]
+
+    @staticmethod
+    def is_word_char(char):
+        return char.isalnum() or char == '_'
+
+    def is_whole_word(self, text, start, end):
+        '''Check that a hit neither begins nor ends within a word'''
+        return (not (start > 0 and self.is_word_char(text[start-1]) and self.is_word_char(text[start])) and
+                not (end < len(text) and self.is_word_char(text[end]) and self.is_word_char(text[end-1])))
+
+    def tokenize(self, text):
+        '''Split a paragraph into word tokens and sentences in one pass; returns the start and end offsets and the sentence number of every token and the spans of the keywords'''
+        starts, ends, sentences, keyword_spans = [], [], [], []
+        sentence = 0
+        for match in self.token_pattern.finditer(text):
+            if match.group(1):
+                starts.append(match.start())
+                ends.append(match.end())
+                sentences.append(sentence)
+                if match.group(1) in self.keywords:
+                    keyword_spans.append((match.start(), match.end(), 'keyw'))
+            elif match.group() == '.' and starts and ends[-1] == match.start() and ((ends[-1]-starts[-1] == 1 and text[starts[-1]].isalpha()) or text[starts[-1]:ends[-1]].lower() in self.abbreviations):
+                continue  # Initials and abbreviations, e.g. `e.g. The` or `Fig. 2`
+            else:
+                sentence += 1
+        return starts, ends, sentences, keyword_spans
+
+    def evaluate(self, text, hits):
+        '''Evaluate the rule on the (start, end, kind, name) toxin and gene hits of a paragraph, using the positions of a single tokenization; returns the co-occurring toxin and gene names and the non-overlapping (start, end, kind) spans of their hits and of the keywords, or None'''
+        if not any(hit[2] == 'toxin' for hit in hits) or not any(hit[2] == 'gene' for hit in hits):
+            return None  # Most paragraphs end here, without being tokenized
+        if self.window == 'substring':
+            keyword_spans = [(match.start(), match.end(), 'keyw') for match in self.keyword_pattern.finditer(text)] if self.keyword_pattern else []
+        else:
+            starts, ends, sentences, keyword_spans = self.tokenize(text)
+        located = {'toxin': [], 'gene': []}
+        for start, end, kind, name in hits:
+            if self.window == 'substring':
+                located[kind].append((0, 0, start, end, kind, name))
+                continue
+            if not self.is_whole_word(text, start, end):
+                continue
+            first, last = bisect.bisect_right(ends, start), bisect.bisect_left(starts, end) - 1  # The first and the last token of the hit
+            if first > last:
+                continue
+            if self.window == 'sentence':
+                first, last = sentences[first], sentences[last]
+            located[kind].append((first, last, start, end, kind, name))
+        paired = set()
+        if self.window in ('substring', 'paragraph'):
+            if located['toxin'] and located['gene']:
+                paired.update(located['toxin'] + located['gene'])
+        else:
+            window = self.window_size + 1 if self.window == 'tokens' else self.window_size  # Tokens between two hits plus one, or sentences between them
+            for toxin in located['toxin']:
+                for gene in located['gene']:
+                    if max(gene[0] - toxin[1], toxin[0] - gene[1]) <= window:
+                        paired.update((toxin, gene))
+        if not paired:
+            return None
+        ## Selecting the spans to highlight: the leftmost and, among those, the longest
+        spans, position = [], 0
+        for start, end, kind in sorted({hit[2:5] for hit in paired} | set(keyword_spans), key=lambda span: (span[0], span[0]-span[1], self.priorities[span[2]])):
+            if start >= position:
+                spans.append([start, end, kind])
+                position = end
+        return {hit[5] for hit in paired if hit[4] == 'toxin'}, {hit[5] for hit in paired if hit[4] == 'gene'}, spans
+
+class DictMatcher:
+
+    def __init__(self, toxinDB_list, geneProdDB_list, rule=None):
+        '''Compile an Aho-Corasick automaton over the case-folded toxin and gene/product names'''
+        self.rule = rule or CooccurrenceRule()
+        self.goto = [{}]  # per node: character -> next node
+        self.fail = [0]  # per node: node of the longest proper suffix that is also in the trie
+        self.out = [()]  # per node: (pattern length, kind, name) of every pattern ending here
+        for kind, names in (('toxin', toxinDB_list), ('gene', geneProdDB_list)):
+            for name in names:
+                pattern = name.casefold()
+                if not pattern:
+                    continue
+                node = 0
+                for char in pattern:
+                    next_node = self.goto[node].get(char)
+                    if next_node is None:
+                        next_node = len(self.goto)
+                        self.goto[node][char] = next_node
+                        self.goto.append({})
+                        self.fail.append(0)
+                        self.out.append(())
+                    node = next_node
+                self.out[node] += ((len(pattern), kind, name),)
+        # Breadth-first pass to set the failure links and merge the outputs reachable via them
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, next_node in self.goto[node].items():
+                queue.append(next_node)
+                fail_node = self.fail[node]
+                while fail_node and char not in self.goto[fail_node]:
+                    fail_node = self.fail[fail_node]
+                self.fail[next_node] = self.goto[fail_node].get(char, 0)
+                self.out[next_node] += self.out[self.fail[next_node]]
+
+    @classmethod
+    def load_or_build(cls, cache_fn, toxinDB_list, geneProdDB_list, rule=None):
+        '''Load a compiled matcher from the on-disk cache or compile and cache it'''
+        matcher = cls.__new__(cls)
+        matcher.rule = rule or CooccurrenceRule()
+        try:
+            with open(cache_fn, "rb") as pickle_file:
+                matcher.goto, matcher.fail, matcher.out = pickle.load(pickle_file)
+            return matcher
+        except:
+            pass
+        matcher = cls(toxinDB_list, geneProdDB_list, rule)
+        os.makedirs(os.path.dirname(cache_fn) or '.', exist_ok=True)
+        tmp_fn = cache_fn + '.tmp'
+        with open(tmp_fn, "wb") as pickle_file:
+            pickle.dump((matcher.goto, matcher.fail, matcher.out), pickle_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_fn, cache_fn)
+        return matcher
+
+    def find_spans(self, text):
+        '''Find all (overlapping) toxin and gene hits in one pass over the case-folded text; spans refer to the text'''
+        goto, fail, out = self.goto, self.fail, self.out
+        spans = []
+        node = 0
+        folded = text.casefold()
+        for pos, char in enumerate(folded):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length, kind, name in out[node]:
+                spans.append((pos+1-length, pos+1, kind, name))
+        return ParagrOps().unfold_spans(text, folded, spans)
+
+    def match_paragraphs(self, in_list):
+        '''Identify paragraphs in which a toxin and a gene name co-occur by the rule of the matcher; return them with the names found and the spans to highlight in each'''
+        result_paragraphs, found_toxins, found_genes, result_spans = [], set(), set(), []
+        for paragr in in_list:
+            result = self.rule.evaluate(paragr, self.find_spans(paragr))
+            if result:
+                toxins, genes, spans = result
+                result_paragraphs.append(paragr)
+                found_toxins.update(toxins)
+                found_genes.update(genes)
+                result_spans.append(spans)
+        return result_paragraphs, found_toxins, found_genes, result_spans
+
+class RunJournal:
+
+    stages = ['metadata', 'fulltext', 'match']
+    stage_fields = {'metadata': ['article_title', 'article_publdate', 'article_publdate_str', 'article_keywords', 'article_mesh', 'article_pmid', 'article_pmcid'],
+                    'fulltext': ['article_bioc_url', 'article_pubreader_url', 'article_source', 'n_fulltext_paragr', 'article_paragraphs_with_keyw'],
+                    'match': ['article_result_paragraphs', 'article_result_spans', 'found_toxins', 'found_genes']}
+
+    def __init__(self, output_fn):
+        self.journal_fn = output_fn + '.jsonl'
+        self.manifest_fn = output_fn + '.manifest.json'
+        self.manifest = {}
+        self.journal_file = None
+
+    @staticmethod
+    def find_resumable(outfolder, outfn_stem, query_string=None):
+        '''Find the output stem of the most recent unfinished run of the same query, or of any query'''
+        for manifest_fn in sorted(glob.glob(os.path.join(outfolder, glob.escape(outfn_stem) + '*.manifest.json')), reverse=True):
+            with open(manifest_fn, "r") as json_file:
+                manifest = json.load(json_file)
+            if not manifest.get('finished') and query_string in (None, manifest['pubmed_query']['query_string']):
+                return manifest_fn[:-len('.manifest.json')]
+        return None
+
+    @staticmethod
+    def claim_stem(output_fn):
+        '''Claim the output stem of a new run by creating its empty journal; a run started within the same minute as an earlier one gets a numbered stem instead of appending to its journal'''
+        stem, n = output_fn, 1
+        while True:
+            if not os.path.exists(stem + '.manifest.json'):  # Runs started by `search` have no journal yet
+                try:
+                    with open(stem + '.jsonl', "x"):
+                        return stem
+                except FileExistsError:
+                    pass
+            n += 1
+            stem = '%s_%d' % (output_fn, n)
+
+    def write_manifest(self, **fields):
+        '''Update the run manifest (query, settings, stage reached by each uid) on disk'''
+        self.manifest.update(fields)
+        tmp_fn = self.manifest_fn + '.tmp'
+        with open(tmp_fn, "w") as json_file:
+            json.dump(self.manifest, json_file)
+        os.replace(tmp_fn, self.manifest_fn)
+
+    def load_manifest(self):
+        with open(self.manifest_fn, "r") as json_file:
+            self.manifest = json.load(json_file)
+        return self.manifest
+
+    def stage_data(self, stage, article):
+        '''Collect the fields that a stage produced for an article'''
+        return {field: article[field] for field in self.stage_fields[stage] if field in article}
+
+    def record(self, uid, stage, data):
+        '''Append the fields that a stage produced for a uid to the journal'''
+        if not self.journal_file:
+            self.journal_file = open(self.journal_fn, "a")
+            if self.journal_file.tell() > 0:
+                self.journal_file.write('\n')  # Terminate a record truncated by a crash
+        self.journal_file.write(json.dumps({'uid': uid, 'stage': stage, 'data': data}) + '\n')
+        self.journal_file.flush()
+
+    def iter_records(self):
+        '''Yield (byte offset, record) of every complete record in the journal'''
+        if not os.path.isfile(self.journal_fn):
+            return
+        offset = 0
+        with open(self.journal_fn, "rb") as journal_file:
+            for line in journal_file:
+                try:
+                    yield offset, json.loads(line)
+                except:
+                    pass
+                offset += len(line)
+
+    def replay(self, masterDict):
+        '''Restore the journalled fields into masterDict; return the stage reached by each uid'''
+        uid_stages = {}
+        for offset, record in self.iter_records():
+            if record['uid'] in masterDict:
+                masterDict[record['uid']].update(record['data'])
+                uid_stages[record['uid']] = record['stage']
+        return uid_stages
+
+    def iter_articles(self, ordered_uids, previous=None):
+        '''Yield (uid, article) in the given uid order, reading one article at a time from the journal, or else from the previous results'''
+        offsets = collections.defaultdict(list)
+        for offset, record in self.iter_records():
+            offsets[record['uid']].append(offset)
+        with (open(self.journal_fn, "rb") if offsets else io.BytesIO()) as journal_file:  # No journal if no uid was processed, e.g. by a delta run without new uids
+            for uid in ordered_uids:
+                if uid not in offsets and previous and uid in previous:
+                    yield uid, previous[uid]
+                    continue
+                article = {}
+                for offset in offsets[uid]:
+                    journal_file.seek(offset)
+                    article.update(json.loads(journal_file.readline())['data'])
+                yield uid, article
+
+    def close(self):
+        if self.journal_file:
+            self.journal_file.close()
+
+class WorkQueue:
+
+    def __init__(self, queue_fn):
+        '''Open the work queue of a sharded run: a SQLite file on storage shared by all workers, holding the shards of uids and their leases'''
+        self.queue_fn = queue_fn
+        self.lock = threading.Lock()  # The connection is shared with the heartbeat thread
+        # Transactions are begun explicitly; the default rollback journal is kept, as WAL mode does not work on network file systems
+        self.conn = sqlite3.connect(queue_fn, timeout=60, isolation_level=None, check_same_thread=False)
+
+    @classmethod
+    def create(cls, queue_fn, shards, lease_seconds, max_attempts, rate=None):
+        '''Create a work queue holding the shards (lists of uids) of a run, and the request rate of all its workers together'''
+        if os.path.isfile(queue_fn):
+            raise Exception("Error when creating work queue: %s exists already" % queue_fn)
+        work_queue = cls(queue_fn)
+        with work_queue.transaction() as conn:
+            conn.execute('CREATE TABLE settings (lease_seconds REAL, max_attempts INTEGER, rate REAL)')
+            # A shard is leased by `owner` until `lease_expires`; `attempt` counts its leases and identifies the current one
+            conn.execute('CREATE TABLE shards (shard INTEGER PRIMARY KEY, uids TEXT, status TEXT, owner TEXT, attempt INTEGER, lease_expires REAL, result TEXT, matcher_hash TEXT)')
+            conn.execute('INSERT INTO settings VALUES (?, ?, ?)', (lease_seconds, max_attempts, rate))
+            conn.executemany("INSERT INTO shards VALUES (?, ?, 'pending', NULL, 0, NULL, NULL, NULL)", [(num, json.dumps(uids)) for num, uids in enumerate(shards)])
+        return work_queue
+
+    @contextlib.contextmanager
+    def transaction(self):
+        '''Run a block of statements as one transaction, holding the write lock of the database file from its start'''
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.conn
+            except:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+
+    def settings(self):
+        '''Return the lease duration in seconds and the maximum number of leases per shard'''
+        with self.lock:
+            return self.conn.execute('SELECT lease_seconds, max_attempts FROM settings').fetchone()
+
+    def rate(self):
+        '''Return the maximum number of full text requests per second of all workers together, or None for the default of NCBI'''
+        with self.lock:
+            return self.conn.execute('SELECT rate FROM settings').fetchone()[0]
+
+    def n_active_workers(self):
+        '''Return the number of workers holding an unexpired lease'''
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(DISTINCT owner) FROM shards WHERE status = 'leased' AND lease_expires >= ?", (time.time(),)).fetchone()[0]
+
+    def claim(self, owner):
+        '''Lease the first shard that is pending or whose lease has expired; returns (shard, attempt, uids), or None if no shard can be leased'''
+        with self.transaction() as conn:
+            now = time.time()
+            lease_seconds, max_attempts = conn.execute('SELECT lease_seconds, max_attempts FROM settings').fetchone()
+            row = conn.execute("SELECT shard, attempt, uids FROM shards WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?)) AND attempt < ? ORDER BY shard LIMIT 1",
+                               (now, max_attempts)).fetchone()
+            if row is None:
+                return None
+            shard, attempt, uids = row
+            conn.execute("UPDATE shards SET status = 'leased', owner = ?, attempt = ?, lease_expires = ? WHERE shard = ?", (owner, attempt+1, now+lease_seconds, shard))
+        return shard, attempt+1, json.loads(uids)
+
+    def renew(self, shard, owner, attempt):
+        '''Extend the lease of a shard; returns False if the shard has been leased to another worker in the meantime'''
+        with self.transaction() as conn:
+            lease_seconds = conn.execute('SELECT lease_seconds FROM settings').fetchone()[0]
+            return conn.execute("UPDATE shards SET lease_expires = ? WHERE shard = ? AND status = 'leased' AND owner = ? AND attempt = ?",
+                                (time.time()+lease_seconds, shard, owner, attempt)).rowcount == 1
+
+    def complete(self, shard, owner, attempt, result_fn, matcher_hash):
+        '''Record the journal of a mined shard; returns False if the shard has been leased to another worker in the meantime'''
+        with self.transaction() as conn:
+            return conn.execute("UPDATE shards SET status = 'done', lease_expires = NULL, result = ?, matcher_hash = ? WHERE shard = ? AND status = 'leased' AND owner = ? AND attempt = ?",
+                                (result_fn, matcher_hash, shard, owner, attempt)).rowcount == 1
+
+    def release(self, shard, owner, attempt):
+        '''Return a shard to the queue, e.g. after an error, so that any worker can lease it again'''
+        with self.transaction() as conn:
+            conn.execute("UPDATE shards SET status = 'pending', owner = NULL, lease_expires = NULL WHERE shard = ? AND status = 'leased' AND owner = ? AND attempt = ?",
+                         (shard, owner, attempt))
+
+    def next_expiry(self):
+        '''Return the time at which the next lease that may be reclaimed expires, or None if no shard is leased'''
+        with self.lock:
+            return self.conn.execute("SELECT MIN(lease_expires) FROM shards WHERE status = 'leased' AND attempt < (SELECT max_attempts FROM settings)").fetchone()[0]
+
+    @contextlib.contextmanager
+    def lease(self, shard, owner, attempt):
+        '''Renew the lease of a shard from a heartbeat thread while the block runs; yields an event that is set if the lease is lost'''
+        lease_seconds = self.settings()[0]
+        stopped, lost = threading.Event(), threading.Event()
+        def heartbeat():
+            while not stopped.wait(lease_seconds / 3):
+                try:
+                    if not self.renew(shard, owner, attempt):
+                        logging.getLogger(__name__).warning("\tshard %s: lease lost to another worker" % shard)
+                        lost.set()
+                        break
+                except:
+                    logging.getLogger(__name__).critical("\tshard %s: Error when renewing lease" % shard)
+        thread = threading.Thread(target=heartbeat, name='heartbeat-%s' % shard, daemon=True)
+        thread.start()
+        try:
+            yield lost
+        finally:
+            stopped.set()
+            thread.join()
+
+    def counts(self):
+        '''Return the number of shards by status: pending, leased, done or merged'''
+        with self.lock:
+            return dict(self.conn.execute('SELECT status, COUNT(*) FROM shards GROUP BY status').fetchall())
+
+    def done_shards(self):
+        '''Return (shard, journal stem, matcher hash) of the mined shards not yet merged, in shard order'''
+        with self.lock:
+            return self.conn.execute("SELECT shard, result, matcher_hash FROM shards WHERE status = 'done' ORDER BY shard").fetchall()
+
+    def mark_merged(self, shards):
+        with self.transaction() as conn:
+            conn.executemany("UPDATE shards SET status = 'merged' WHERE shard = ?", [(shard,) for shard in shards])
+
+    def close(self):
+        self.conn.close()
+
+class ResultStore:
+
+    list_fields = {'article_paragraphs_with_keyw': 'paragraphs', 'article_result_paragraphs': 'paragraphs', 'found_toxins': 'hits', 'found_genes': 'hits'}
+
+    def __init__(self, store_fn):
+        '''Open the results of a run stored as SQLite tables: articles, their paragraphs with keyword and their toxin and gene hits'''
+        self.store_fn = store_fn
+        self.conn = sqlite3.connect(store_fn)
+
+    @classmethod
+    def create(cls, store_fn, query_entry):
+        '''Create a result store holding the query; articles are then added in output order'''
+        if os.path.isfile(store_fn):
+            os.remove(store_fn)
+        store = cls(store_fn)
+        store.conn.execute('PRAGMA journal_mode = OFF')  # Written once, in one transaction
+        store.conn.execute('CREATE TABLE query (query_entry TEXT)')
+        # The fields of an article that are not columns are kept in `fields` (JSON); list-valued fields are stored there as their length, or None
+        store.conn.execute('CREATE TABLE articles (uid TEXT PRIMARY KEY, position INTEGER, pmid TEXT, pmcid TEXT, title TEXT, publdate_str TEXT, n_fulltext_paragr INTEGER, has_hits INTEGER, fields TEXT)')
+        # A paragraph is stored once per article, zlib-compressed, with its position among the paragraphs with keyword and/or among the result paragraphs
+        store.conn.execute('CREATE TABLE paragraphs (uid TEXT, keyw_position INTEGER, result_position INTEGER, text BLOB)')
+        store.conn.execute('CREATE TABLE hits (uid TEXT, kind TEXT, position INTEGER, name TEXT)')
+        store.conn.execute('INSERT INTO query VALUES (?)', (json.dumps(query_entry),))
+        return store
+
+    def add(self, position, uid, article):
+        '''Store an article; its paragraphs and hits go to their own tables'''
+        fields = {field: value for field, value in article.items() if field not in self.list_fields}
+        for field in self.list_fields:
+            if field in article:
+                fields[field] = len(article[field]) if article[field] is not None else None
+        self.conn.execute('INSERT INTO articles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                          (uid, position, article.get('article_pmid'), article.get('article_pmcid'), article.get('article_title'), article.get('article_publdate_str'),
+                           article.get('n_fulltext_paragr'), 1 if article.get('article_result_paragraphs') else 0, json.dumps(fields)))
+        keyw_position = {}
+        for num, paragr in enumerate(article.get('article_paragraphs_with_keyw') or []):
+            keyw_position.setdefault(paragr, []).append(num)
+        result_position = {paragr: num for num, paragr in reversed(list(enumerate(article.get('article_result_paragraphs') or [])))}
+        rows = []
+        for paragr, nums in keyw_position.items():
+            compressed = zlib.compress(paragr.encode('utf8'))
+            rows.append((uid, nums[0], result_position.pop(paragr, None), compressed))
+            rows.extend((uid, num, None, compressed) for num in nums[1:])
+        rows.extend((uid, None, num, zlib.compress(paragr.encode('utf8'))) for paragr, num in result_position.items())  # Result paragraphs without a paragraph with keyword
+        self.conn.executemany('INSERT INTO paragraphs VALUES (?, ?, ?, ?)', rows)
+        self.conn.executemany('INSERT INTO hits VALUES (?, ?, ?, ?)',
+                              [(uid, kind, num, name) for kind, field in (('toxin', 'found_toxins'), ('gene', 'found_genes')) for num, name in enumerate(article.get(field) or [])])
+
+    def finish(self):
+        '''Index the tables by PMID, date, gene and toxin and commit'''
+        conn = self.conn
+        conn.execute('CREATE INDEX articles_position ON articles (position)')
+        conn.execute('CREATE INDEX articles_pmid ON articles (pmid)')
+        conn.execute('CREATE INDEX articles_publdate ON articles (publdate_str)')
+        conn.execute('CREATE INDEX paragraphs_uid ON paragraphs (uid)')
+        conn.execute('CREATE INDEX hits_uid ON hits (uid)')
+        conn.execute('CREATE INDEX hits_name ON hits (kind, name)')
+        conn.commit()
+
+    def query_entry(self):
+        return json.loads(self.conn.execute('SELECT query_entry FROM query').fetchone()[0])
+
+    def iter_articles(self, hits_only=False):
+        '''Yield (uid, article) in output order, with the same fields as in the JSON output, reading one article at a time'''
+        cursor = self.conn.execute('SELECT uid, fields FROM articles %s ORDER BY position' % ('WHERE has_hits = 1' if hits_only else ''))
+        for uid, fields in cursor:
+            article = json.loads(fields)
+            if article.get('article_paragraphs_with_keyw') is not None:
+                article['article_paragraphs_with_keyw'] = [zlib.decompress(text).decode('utf8') for (text,) in self.conn.execute('SELECT text FROM paragraphs WHERE uid = ? AND keyw_position IS NOT NULL ORDER BY keyw_position', (uid,))]
+            if article.get('article_result_paragraphs') is not None:
+                article['article_result_paragraphs'] = [zlib.decompress(text).decode('utf8') for (text,) in self.conn.execute('SELECT text FROM paragraphs WHERE uid = ? AND result_position IS NOT NULL ORDER BY result_position', (uid,))]
+            for kind, field in (('toxin', 'found_toxins'), ('gene', 'found_genes')):
+                if article.get(field) is not None:
+                    article[field] = [name for (name,) in self.conn.execute('SELECT name FROM hits WHERE uid = ? AND kind = ? ORDER BY position', (uid, kind))]
+            yield uid, article
+
+    @staticmethod
+    def read_results(results_fn):
+        '''Read a results file, JSON or SQLite, into a dict like the JSON output'''
+        if not results_fn.endswith('.sqlite'):
+            with open(results_fn, "r") as json_file:
+                return json.load(json_file)
+        store = ResultStore(results_fn)
+        results = {'pubmed_query': store.query_entry()}
+        results.update(store.iter_articles())
+        store.close()
+        return results
+
+    def close(self):
+        self.conn.close()
+
+class ParagraphIndex:
+
+    gram_size = 3  # Character n-grams, so that names are found as substrings just as by DictMatcher
+
+    def __init__(self, query_entry, articles, paragraphs, terms, offsets, postings):
+        '''Inverted index from character n-grams of the case-folded paragraphs to paragraph numbers'''
+        self.query_entry = query_entry
+        self.articles = articles  # [(uid, article)] in output order; article_paragraphs_with_keyw holds the range of paragraph numbers
+        self.paragraphs = paragraphs
+        self.terms = terms  # n-gram -> position in offsets
+        self.offsets = offsets
+        self.postings = postings  # sorted paragraph numbers of all n-grams, concatenated
+        self.lengths = numpy.diff(offsets).tolist()  # Number of paragraphs per n-gram
+        self.folded = {}
+
+    @classmethod
+    def build(cls, query_entry, articles_iter):
+        '''Tokenize the paragraphs with keyword of every article once and collect the postings of each n-gram'''
+        articles, paragraphs = [], []
+        term_postings = collections.defaultdict(list)
+        for uid, article in articles_iter:
+            article = {field: value for field, value in article.items() if field not in RunJournal.stage_fields['match']}
+            first = len(paragraphs)
+            for paragr in article.get('article_paragraphs_with_keyw') or []:
+                text = paragr.casefold()
+                for term in {text[i:i+cls.gram_size] for i in range(len(text)-cls.gram_size+1)}:
+                    term_postings[term].append(len(paragraphs))
+                paragraphs.append(paragr)
+            if 'article_paragraphs_with_keyw' in article:
+                article['article_paragraphs_with_keyw'] = [first, len(paragraphs)] if article['article_paragraphs_with_keyw'] is not None else None
+            articles.append((uid, article))
+        terms, offsets, postings = {}, [0], []
+        for term, term_list in term_postings.items():
+            terms[term] = len(terms)
+            postings.extend(term_list)  # Already sorted, as paragraphs are numbered in order
+            offsets.append(len(postings))
+        return cls(query_entry, articles, paragraphs, terms, numpy.array(offsets, dtype=numpy.int64), numpy.array(postings, dtype=numpy.uint32))
+
+    def save(self, index_fn):
+        tmp_fn = index_fn + '.tmp'
+        with open(tmp_fn, "wb") as pickle_file:
+            pickle.dump((self.query_entry, self.articles, self.paragraphs, self.terms, self.offsets, self.postings), pickle_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_fn, index_fn)
+
+    @classmethod
+    def load(cls, index_fn):
+        with open(index_fn, "rb") as pickle_file:
+            return cls(*pickle.load(pickle_file))
+
+    max_checked = 32  # Candidates checked directly instead of intersecting further postings
+
+    def find_name(self, name):
+        '''Return the numbers of all paragraphs that contain a name, by intersecting the postings of its rarest n-grams (until few candidates are left) and checking the candidates'''
+        pattern = name.casefold()
+        if len(pattern) < self.gram_size:
+            candidates = range(len(self.paragraphs))
+        else:
+            positions = set()
+            for i in range(len(pattern)-self.gram_size+1):
+                pos = self.terms.get(pattern[i:i+self.gram_size])
+                if pos is None:
+                    return []
+                positions.add(pos)
+            positions = sorted(positions, key=self.lengths.__getitem__)
+            candidates = self.postings[self.offsets[positions[0]]:self.offsets[positions[0]+1]]
+            for pos in positions[1:3]:
+                if len(candidates) <= self.max_checked:
+                    break
+                # Binary search of the candidates in the longer postings, instead of sorting both
+                postings = self.postings[self.offsets[pos]:self.offsets[pos+1]]
+                present = postings[numpy.minimum(numpy.searchsorted(postings, candidates), len(postings)-1)] == candidates
+                candidates = candidates[present]
+        found = []
+        for num in candidates:
+            num = int(num)
+            if num not in self.folded:
+                self.folded[num] = self.paragraphs[num].casefold()
+            if pattern in self.folded[num]:
+                found.append(num)
+        return found
+
+    def find_hits(self, num, names, kind):
+        '''Return the (start, end, kind, name) hits of names known to occur in a paragraph'''
+        folded = self.folded.get(num) or self.paragraphs[num].casefold()
+        hits = []
+        for name in names:
+            pattern = name.casefold()
+            start = folded.find(pattern)
+            while start >= 0:
+                hits.append((start, start+len(pattern), kind, name))
+                start = folded.find(pattern, start+1)
+        return ParagrOps().unfold_spans(self.paragraphs[num], folded, hits)
+
+    def query(self, toxinDB_list, geneProdDB_list, rule=None):
+        '''Identify paragraphs in which a toxin and a gene name co-occur by the rule; yield (uid, article) with the same fields as the mining run'''
+        rule = rule or CooccurrenceRule()
+        toxin_hits, gene_hits = collections.defaultdict(set), collections.defaultdict(set)
+        for names, hits in ((toxinDB_list, toxin_hits), (geneProdDB_list, gene_hits)):
+            for name in names:
+                if name:
+                    for num in self.find_name(name):
+                        hits[num].add(name)
+        for uid, article in self.articles:
+            article = dict(article)
+            paragr_range = article.get('article_paragraphs_with_keyw')
+            if paragr_range is not None:
+                article['article_paragraphs_with_keyw'] = self.paragraphs[paragr_range[0]:paragr_range[1]]
+            result_paragraphs, found_toxins, found_genes, result_spans = [], set(), set(), []
+            if paragr_range:
+                for num in range(*paragr_range):
+                    if toxin_hits.get(num) and gene_hits.get(num):
+                        result = rule.evaluate(self.paragraphs[num], self.find_hits(num, toxin_hits[num], 'toxin') + self.find_hits(num, gene_hits[num], 'gene'))
+                        if result:
+                            result_paragraphs.append(self.paragraphs[num])
+                            found_toxins.update(result[0])
+                            found_genes.update(result[1])
+                            result_spans.append(result[2])
+            if result_paragraphs:
+                article['article_result_paragraphs'], article['article_result_spans'] = ParagrOps().remove_duplicate_results(result_paragraphs, result_spans)
+                article['found_toxins'] = sorted(found_toxins)
+                article['found_genes'] = sorted(found_genes)
+            else:
+                article['article_result_paragraphs'] = None
+                article['article_result_spans'] = None
+                article['found_toxins'] = None
+                article['found_genes'] = None
+            yield uid, article
+
+class PipelineStage:
+
+    done = object()  # Sentinel that tells a worker its input is exhausted
+
+    def __init__(self, name, func, n_workers, in_queue, out_queue=None, metrics=None):
+        '''Run `func` on every item of `in_queue` in `n_workers` threads; `func` returns the items to pass on to `out_queue`'''
+        self.name = name
+        self.func = func
+        self.metrics = metrics
+        self.n_workers = n_workers
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.n_downstream_workers = 0
+        self.remaining = n_workers
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self.run, name='%s-%s' % (name, i), daemon=True) for i in range(n_workers)]
+
+    def connect(self, downstream):
+        '''Feed the output of this stage into the next stage'''
+        self.out_queue = downstream.in_queue
+        self.n_downstream_workers = downstream.n_workers
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def finish(self):
+        '''Tell all workers that no further input follows'''
+        for i in range(self.n_workers):
+            self.in_queue.put(self.done)
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+    def run(self):
+        while True:
+            item = self.in_queue.get()
+            if item is self.done:
+                break
+            try:
+                with (self.metrics.timer('stage_%s' % self.name) if self.metrics else contextlib.nullcontext()):
+                    results = self.func(item)
+            except:
+                logging.getLogger(__name__).critical("Error in pipeline stage `%s`" % self.name, exc_info=True)
+                results = []
+            if self.out_queue is not None:
+                for result in results:
+                    self.out_queue.put(result)  # Blocks while the downstream queue is full
+        # The last worker to finish passes the sentinel on to all downstream workers
+        with self.lock:
+            self.remaining -= 1
+            last = self.remaining == 0
+        if last and self.out_queue is not None:
+            for i in range(self.n_downstream_workers):
+                self.out_queue.put(self.done)
+
+class MiningStages:
+
+    def __init__(self, email, masterDict, journal, journal_queue, pmcid_cache, fetch_cache, fetcher, engine, keywVariants_list, html_backend, metrics=None, n_pending=0, progress_every=100, progress_stage='match', entrez_limiter=None):
+        self.email = email
+        self.masterDict = masterDict
+        self.journal = journal
+        self.journal_queue = journal_queue
+        self.pmcid_cache = pmcid_cache
+        self.fetch_cache = fetch_cache
+        self.fetcher = fetcher
+        self.engine = engine  # LocalEngine or WorkerPool
+        self.keywVariants_list = keywVariants_list
+        self.html_backend = html_backend
+        self.metrics = metrics or RunMetrics()
+        self.n_pending = n_pending
+        self.progress_every = progress_every
+        self.progress_stage = progress_stage  # The last stage of the pipeline, after which an article is finished
+        self.entrez_limiter = entrez_limiter  # Entrez requests are limited by Bio.Entrez, unless a worker of a sharded run sends fewer
+        self.log = logging.getLogger(__name__)
+
+    def progress(self):
+        '''Count an article as finished and log aggregate progress every `progress_every` articles'''
+        n_processed = self.metrics.count('articles_processed')
+        if self.progress_every and (n_processed % self.progress_every == 0 or n_processed == self.n_pending):
+            counters = self.metrics.counters
+            self.log.info("processed %s of %s articles: %s with full text, %s with hits, %s not on PubMedCentral, %s not retrievable, %s errors; %.1f articles per second"
+                          % (n_processed, self.n_pending, counters['articles_with_fulltext'], counters['articles_with_hits'], counters['articles_not_in_pmc'],
+                             counters['articles_not_retrieved'], counters['log_critical'], n_processed / (time.time() - self.metrics.started)))
+
+    def record(self, uid, stage):
+        '''Hand a snapshot of the fields produced by a stage to the journal writer'''
+        self.journal_queue.put((uid, stage, self.journal.stage_data(stage, self.masterDict[uid])))
+
+    def fail(self, uid):
+        '''Journal a uid whose retrieval failed, e.g. by a timeout, under the stage `error`, so that resuming the run retries it'''
+        self.journal_queue.put((uid, 'error', {}))
+        self.progress()
+
+    def retrieve_metadata(self, page):
+        '''Stage: retrieve and parse the metadata of a page of uids, from the cache (retstart None) or PubMed; records are matched to the page by PMID'''
+        retstart, uids = page
+        log = self.log
+        if retstart is None:
+            articles = [PubMedInteract(self.email, self.fetch_cache).retrieve_cached_metadata(uid) for uid in uids]
+            self.metrics.count('cache_hits_efetch', len(uids))
+        else:
+            ## Retrieving metadata from PubMed, one request per page
+            action = "retrieving metadata from PubMed"
+            log.debug("\tuids %s-%s: %s" % (retstart+1, retstart+len(uids), action))
+            self.metrics.count('cache_misses_efetch', len(uids))
+            try:
+                if self.entrez_limiter:
+                    self.entrez_limiter.acquire()
+                with self.metrics.timer('efetch'):
+                    articles = PubMedInteract(self.email, self.fetch_cache).retrieve_metadata_batch(uids)
+            except:
+                log.critical("\tuids %s-%s: Error when %s" % (retstart+1, retstart+len(uids), action))
+                articles = []
+        page_uids, found_uids = set(uids), set()
+        for article in articles:
+            ## Parsing the metadata, extracting relevant info
+            action = "parsing the metadata, extracting relevant info"
+            try:
+                uid = XMLparsing().article_pmid(article)
+            except:
+                log.critical("\tuid unknown: Error when %s" % action)
+                continue
+            if uid not in page_uids:
+                continue
+            log.debug("\tuid %s: %s" % (uid, action))
+            found_uids.add(uid)
+            try:
+                XMLparsing().article_metadata(article, self.masterDict[uid])
+            except:
+                log.critical("\tuid %s: Error when %s" % (uid, action))
+        for uid in uids:
+            if uid not in found_uids:
+                log.critical("\tuid %s: Error when retrieving metadata from PubMed" % uid)
+                self.fail(uid)
+        found_uids = [uid for uid in uids if uid in found_uids]
+        return [found_uids] if found_uids else []
+
+    def resolve_pmcids(self, uids):
+        '''Stage: resolve the PMCIDs of a page of uids in bulk, consulting the mapping cache first'''
+        action = "resolving PubMedCentral IDs"
+        self.log.debug("\tuids %s to %s: %s" % (uids[0], uids[-1], action))
+        article_pmids = [self.masterDict[uid]['article_pmid'] for uid in uids if 'article_pmid' in self.masterDict[uid]]
+        n_cached = sum(1 for pmid in article_pmids if pmid in self.pmcid_cache)
+        self.metrics.count('cache_hits_pmcid', n_cached)
+        self.metrics.count('cache_misses_pmcid', len(article_pmids) - n_cached)
+        if self.entrez_limiter and n_cached < len(article_pmids):
+            self.entrez_limiter.acquire()
+        with self.metrics.timer('elink'):
+            article_pmcids = PMCIDops().article_pmcids(article_pmids, self.email, self.pmcid_cache, len(uids))
+        resolved_uids = []
+        for uid in uids:
+            if 'article_pmid' in self.masterDict[uid]:
+                if self.masterDict[uid]['article_pmid'] not in article_pmcids:
+                    self.log.critical("\tuid %s: Error when %s" % (uid, action))
+                    self.fail(uid)
+                    continue
+                self.masterDict[uid]['article_pmcid'] = article_pmcids[self.masterDict[uid]['article_pmid']]
+            self.record(uid, 'metadata')
+            resolved_uids.append(uid)
+        return resolved_uids
+
+    def fetch_fulltext(self, uid):
+        '''Stage: retrieve the complete article from PubMedCentral (BioC API first, PubReader as fallback)'''
+        article = self.masterDict[uid]
+        if 'article_pmcid' in article.keys() and article['article_pmcid']:
+            article['article_bioc_url'] = PMCIDops().get_pmcid_bioc_url(article['article_pmcid'])
+            article['article_pubreader_url'] = PMCIDops().get_pmcid_pubreader_url(article['article_pmcid'])
+            action = "retrieving complete article from PubMedCentral"
+            self.log.debug("\tuid %s: %s" % (uid, action))
+            try:
+                return [(uid, self.fetcher.fetch_article(article['article_pmcid'], article['article_bioc_url'], article['article_pubreader_url']))]
+            except:
+                self.log.critical("\tuid %s: Error when %s" % (uid, action))
+                self.fail(uid)
+                return []
+        self.metrics.count('articles_not_in_pmc')
+        self.log.debug("\tuid %s: publication on PubMed but not on PubMedCentral" % uid)
+        return [(uid, None)]
+
+    def extract_fulltext(self, item):
+        '''Stage: extract the full text by paragraph and keep the paragraphs with the keyword `gene`'''
+        uid, article_complete = item
+        article = self.masterDict[uid]
+        log = self.log
+        if not article_complete:
+            if 'article_bioc_url' in article:
+                self.metrics.count('articles_not_retrieved')
+                log.debug("\tuid %s: Retrieval unsuccessful" % uid)
+            article['article_paragraphs_with_keyw'] = None
+        else:
+            ## Extracting the full text and the paragraphs with keyword `gene` in its different forms
+            action = "extracting full text and paragraphs with keyword `gene`"
+            log.debug("\tuid %s: %s" % (uid, action))
+            try:
+                n_fulltext_paragr, paragraphs_with_keyw, backends_differ, timings = self.engine.extract_paragraphs(article_complete, self.html_backend, self.keywVariants_list)
+                for name, seconds in timings.items():
+                    self.metrics.observe(name, seconds, uid)  # Timed where the work was done, possibly in a worker process
+                if n_fulltext_paragr is not None:
+                    article['n_fulltext_paragr'] = n_fulltext_paragr
+                    self.metrics.count('articles_with_fulltext')
+                if backends_differ:
+                    log.warning("\tuid %s: lxml and bs4 HTML backends extract different paragraphs" % uid)
+            except:
+                log.critical("\tuid %s: Error when %s" % (uid, action))
+                paragraphs_with_keyw = []
+            article['article_paragraphs_with_keyw'] = paragraphs_with_keyw
+        self.record(uid, 'fulltext')
+        if self.progress_stage == 'fulltext':
+            article.pop('article_paragraphs_with_keyw', None)  # Journalled already; no longer needed in memory
+            self.progress()
+        return [uid]
+
+    @staticmethod
+    def extract_paragraphs(article_complete, html_backend, keywVariants_list):
+        '''Extract all text of the full text by paragraph and keep those with a keyword; returns (number of paragraphs, paragraphs with keyword, whether the HTML backends differ, timings)'''
+        all_paragraphs, n_fulltext_paragr, backends_differ = [], None, False
+        start = time.perf_counter()
+        if '<?xml version="1.0"' in str(article_complete):
+            # Parse the XML of the full text in a single pass, extracting all text by paragraph without unnecessary sections
+            all_paragraphs = list(LXMLops().iter_all_text(article_complete))
+            n_fulltext_paragr = len(all_paragraphs)
+        if '<!DOCTYPE html>' in str(article_complete):
+            # Parse the HTML of the full text and extract all text by paragraph without unnecessary sections
+            if html_backend != 'bs4':
+                all_paragraphs = HTMLops().extract_all_text_lxml(article_complete)
+            if html_backend == 'bs4' or all_paragraphs is None:
+                all_paragraphs = HTMLops().extract_all_text_bs4(article_complete)
+            backends_differ = html_backend == 'check' and all_paragraphs != HTMLops().extract_all_text_bs4(article_complete)
+            n_fulltext_paragr = len(all_paragraphs)
+        parsed = time.perf_counter()
+        ## PARAGRAPH FILTERING
+        paragraphs_with_keyw = ParagrOps().extract_gene_paragraphs(all_paragraphs, keywVariants_list)
+        return n_fulltext_paragr, paragraphs_with_keyw, backends_differ, {'parse': parsed-start, 'filter': time.perf_counter()-parsed}
+
+    def match_dictionaries(self, uid):
+        '''Stage: identify paragraphs that match any of the database names for both genes and toxins'''
+        article = self.masterDict[uid]
+        if article.get('article_paragraphs_with_keyw'):
+            ## PARAGRAPH SELECTION
+            action = "identifying paragraphs that match any of the database names for both genes and toxins"
+            self.log.debug("\tuid %s: %s" % (uid, action))
+            try:
+                with self.metrics.timer('match', uid):
+                    result_paragraphs, found_toxins, found_genes, result_spans = self.engine.match_paragraphs(article['article_paragraphs_with_keyw'])
+                if len(result_paragraphs) >= 1:
+                    self.metrics.count('articles_with_hits')
+                    article['article_result_paragraphs'], article['article_result_spans'] = ParagrOps().remove_duplicate_results(result_paragraphs, result_spans)  # Note: The same paragraph may have been found multiple times.
+                    article['found_toxins'] = sorted(set(found_toxins))  # Sorted, so that the output does not depend on hash seeds or worker processes
+                    article['found_genes'] = sorted(set(found_genes))
+                else:
+                    self.log.debug("\tuid %s: no fitting paragraphs detected" % uid)
+                    article['article_result_paragraphs'] = None
+                    article['article_result_spans'] = None
+                    article['found_toxins'] = None
+                    article['found_genes'] = None
+            except:
+                self.log.critical("\tuid %s: Error when %s" % (uid, action))
+        else:
+            article['article_result_paragraphs'] = None
+            article['article_result_spans'] = None
+            article['found_toxins'] = None
+            article['found_genes'] = None
+        self.record(uid, 'match')
+        article.pop('article_paragraphs_with_keyw', None)  # Journalled already; no longer needed in memory
+        if self.progress_stage == 'match':
+            self.progress()
+        return []
+
+    def write_journal(self, item):
+        '''Stage: append the fields produced by a stage to the journal'''
+        uid, stage, data = item
+        with self.metrics.timer('journal_write'):
+            self.journal.record(uid, stage, data)
+        return []
+
+class LocalEngine:
+
+    def __init__(self, matcher):
+        '''Extract and match full texts in the calling thread'''
+        self.matcher = matcher
+
+    def extract_paragraphs(self, article_complete, html_backend, keywVariants_list):
+        return MiningStages.extract_paragraphs(article_complete, html_backend, keywVariants_list)
+
+    def match_paragraphs(self, in_list):
+        return self.matcher.match_paragraphs(in_list)
+
+    def close(self):
+        pass
+
+class WorkerPool:
+
+    matcher = None  # Set before the worker processes start, so that they inherit it instead of receiving it with every task
+
+    def __init__(self, matcher, n_workers):
+        '''Start worker processes that extract and match full texts with a shared compiled dictionary matcher'''
+        WorkerPool.matcher = matcher
+        if 'fork' in multiprocessing.get_all_start_methods():
+            self.pool = multiprocessing.get_context('fork').Pool(n_workers)
+        else:
+            # Without fork, each worker unpickles the matcher once at start-up
+            self.pool = multiprocessing.Pool(n_workers, initializer=WorkerPool.init_worker, initargs=(matcher,))
+
+    @staticmethod
+    def init_worker(matcher):
+        WorkerPool.matcher = matcher
+
+    @staticmethod
+    def match_in_worker(in_list):
+        return WorkerPool.matcher.match_paragraphs(in_list)
+
+    def extract_paragraphs(self, article_complete, html_backend, keywVariants_list):
+        return self.pool.apply(MiningStages.extract_paragraphs, (article_complete, html_backend, keywVariants_list))
+
+    def match_paragraphs(self, in_list):
+        return self.pool.apply(WorkerPool.match_in_worker, (in_list,))
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+class ArchiveIngester:
+
+    archive_suffixes = ('.tar.gz', '.tgz', '.tar', '.xml', '.nxml', '.xml.gz', '.nxml.gz')
+    id_pattern = re.compile(rb'(?:pub-id-type="(?:pmid|pmc|pmcid)"|key="article-id_(?:pmid|pmc)")>\s*(?:PMC)?(\d+)')
+
+    def __init__(self, matcher, keywVariants_list, ids=None):
+        '''Extract, filter and match the full texts of local archives of BioC or JATS (PMC Open Access) XML files, optionally only those of a set of PMIDs/PMCIDs'''
+        self.matcher = matcher
+        self.keywVariants_list = keywVariants_list
+        self.ids = ids
+
+    @classmethod
+    def find_archives(cls, paths):
+        '''Expand directories into the archives they contain; paths are made absolute, as they are recorded in the results'''
+        archive_fns = []
+        for path in map(os.path.abspath, paths):
+            if os.path.isdir(path):
+                for dirpath, dirnames, filenames in sorted(os.walk(path)):
+                    archive_fns.extend(os.path.join(dirpath, filename) for filename in sorted(filenames) if filename.endswith(cls.archive_suffixes))
+            else:
+                archive_fns.append(path)
+        return archive_fns
+
+    def iter_members(self, archive_fn):
+        '''Yield (name, content) of the XML files of an archive, reading its members sequentially'''
+        if archive_fn.endswith(('.tar.gz', '.tgz', '.tar')):
+            with tarfile.open(archive_fn, 'r|*') as tar:  # Streaming mode; the members are read in the order in which they are stored
+                for member in tar:
+                    if member.isfile() and member.name.endswith(('.xml', '.nxml')):
+                        yield member.name, tar.extractfile(member).read()
+        elif archive_fn.endswith('.gz'):
+            with gzip.open(archive_fn, 'rb') as xml_file:
+                yield os.path.basename(archive_fn), xml_file.read()
+        else:
+            with open(archive_fn, 'rb') as xml_file:
+                yield os.path.basename(archive_fn), xml_file.read()
+
+    def wanted(self, pmid, pmcid):
+        return self.ids is None or pmid in self.ids or pmcid in self.ids
+
+    def iter_documents(self, xml):
+        '''Yield (metadata, paragraphs) of the articles of an XML file in the BioC or the JATS format'''
+        if b'<collection' in xml[:4096]:
+            for front, paragraphs in LXMLops().iter_documents(xml):
+                article = {}
+                article['article_title'] = front.get('title')
+                article['article_publdate'] = {'Year': front['year']} if front.get('year') else None
+                article['article_publdate_str'] = MiscOps().convert_to_date(article['article_publdate'] or {})
+                article['article_keywords'] = [kwd.strip() for kwd in re.split('[,;]', front['kwd']) if kwd.strip()] if front.get('kwd') else None
+                article['article_mesh'] = None  # MeSH terms are assigned by PubMed, not part of the full text
+                article['article_pmid'] = front.get('article-id_pmid')
+                article['article_pmcid'] = 'PMC' + front['article-id_pmc'].replace('PMC', '') if front.get('article-id_pmc') else None
+                yield article, paragraphs
+        else:
+            jats = JATSops(xml)
+            yield jats.article_metadata({}), jats.extract_all_text()
+
+    def iter_articles(self, archive_fn):
+        '''Yield (uid, article) for every wanted article of an archive, with its paragraphs with keyword and its matches; the uid is the PMID, or else the PMCID'''
+        log = logging.getLogger(__name__)
+        for name, xml in self.iter_members(archive_fn):
+            if self.ids is not None:
+                # Skipping files without any of the wanted ids before parsing them
+                if not any(number.decode() in self.ids or 'PMC' + number.decode() in self.ids for number in self.id_pattern.findall(xml)):
+                    continue
+            action = "extracting full text and paragraphs with keyword `gene`"
+            try:
+                for article, all_paragraphs in self.iter_documents(xml):
+                    if not self.wanted(article['article_pmid'], article['article_pmcid']):
+                        continue
+                    article['article_source'] = '%s:%s' % (archive_fn, name)
+                    article['n_fulltext_paragr'] = len(all_paragraphs)
+                    article['article_paragraphs_with_keyw'] = ParagrOps().extract_gene_paragraphs(all_paragraphs, self.keywVariants_list)
+                    article['article_result_paragraphs'], article['article_result_spans'], article['found_toxins'], article['found_genes'] = None, None, None, None
+                    if article['article_paragraphs_with_keyw']:
+                        result_paragraphs, found_toxins, found_genes, result_spans = self.matcher.match_paragraphs(article['article_paragraphs_with_keyw'])
+                        if result_paragraphs:
+                            article['article_result_paragraphs'], article['article_result_spans'] = ParagrOps().remove_duplicate_results(result_paragraphs, result_spans)
+                            article['found_toxins'] = sorted(set(found_toxins))
+                            article['found_genes'] = sorted(set(found_genes))
+                    yield article['article_pmid'] or article['article_pmcid'], article
+            except:
+                log.critical("\t%s:%s: Error when %s" % (archive_fn, name, action))
+
+    def work(self, archive_queue, result_queue):
+        '''Worker process: ingest archives from the queue until it is exhausted, passing the articles on in batches'''
+        while True:
+            archive_fn = archive_queue.get()
+            if archive_fn is None:
+                break
+            batch = []
+            try:
+                for item in self.iter_articles(archive_fn):
+                    batch.append(item)
+                    if len(batch) >= 100:
+                        result_queue.put(batch)
+                        batch = []
+            except:
+                logging.getLogger(__name__).critical("\t%s: Error when reading archive" % archive_fn)
+            result_queue.put(batch + [(None, archive_fn)])  # Marks the archive as done
+        result_queue.put(None)
+
+    def ingest(self, archive_fns, n_workers, queue_size=64):
+        '''Yield (uid, article) of all archives, ingesting up to `n_workers` archives in parallel, and (None, archive) after each archive'''
+        if n_workers <= 1:
+            for archive_fn in archive_fns:
+                yield from self.iter_articles(archive_fn)
+                yield None, archive_fn
+            return
+        context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else multiprocessing.get_context()
+        archive_queue, result_queue = context.Queue(), context.Queue(queue_size)
+        for archive_fn in archive_fns:
+            archive_queue.put(archive_fn)
+        workers = [context.Process(target=self.work, args=(archive_queue, result_queue), daemon=True) for i in range(n_workers)]
+        for worker in workers:
+            archive_queue.put(None)
+            worker.start()
+        n_running = n_workers
+        while n_running:
+            batch = result_queue.get()
+            if batch is None:
+                n_running -= 1
+                continue
+            yield from batch
+        for worker in workers:
+            worker.join()
+
 class MiscOps:
 
     def __init__(self):
@@ -262,274 +2067,869 @@ class MiscOps:
                 outdate.append('01')
         return '-'.join(outdate)
     
+    def hash_inputs(self, fnames, in_list):
+        '''Hash the contents of the given files together with a list of strings'''
+        digest = hashlib.sha256()
+        for fname in fnames:
+            with open(fname, "rb") as file:
+                digest.update(hashlib.sha256(file.read()).digest())
+        digest.update(json.dumps(in_list).encode('utf8'))
+        return digest.hexdigest()
+
     def write_to_json(self, json_filename, json_data):
         with open(json_filename, "w") as json_file:
             json.dump(json_data, json_file)
-    
 
-def main(args):
+    def latest_results(self, outfolder, outfn_stem):
+        '''Find the most recent results file in the output folder, preferring the result store over the JSON file of the same run'''
+        results_fns = sorted(glob.glob(os.path.join(outfolder, glob.escape(outfn_stem) + '*[0-9].json')) +
+                             glob.glob(os.path.join(outfolder, glob.escape(outfn_stem) + '*[0-9].sqlite')))
+        return results_fns[-1] if results_fns else None
 
-    ### STEP 1. Getting variables
-    email = args.mail
-    query = args.query
-    verbose = args.verbose
-    keywVariants_list = args.keywVariants_list
-    keywVariants_list = [keyw.strip() for keyw in keywVariants_list]
-
-    toxinDB_fname = args.toxinDB_fname
-    with open(toxinDB_fname) as file:
-        toxinDB_list = file.read().splitlines()
-        toxinDB_list = [line.strip() for line in toxinDB_list]
-
-    geneProdDB_fname = args.geneProdDB_fname
-    with open(geneProdDB_fname) as file:
-        geneProdDB_list = file.read().splitlines()
-        geneProdDB_list = [line.strip() for line in geneProdDB_list]
-
-    geneProdExcl_fname = args.geneProdExcl_fname
-    with open(geneProdExcl_fname) as file:
-        geneProdExcl_list = file.read().splitlines()
-        geneProdExcl_list = [line.strip() for line in geneProdExcl_list]
-        geneProdExcl_list = [line for line in geneProdExcl_list if '#' not in line]
-        geneProdExcl_list = [line for line in geneProdExcl_list if not line.startswith('#')]
-        geneProdExcl_list = list(filter(None, geneProdExcl_list))
-
-    # Excluding some elements from gene/product name database    
-    geneProdDB_list = list(set(geneProdDB_list)-set(keywVariants_list))
-    geneProdDB_list = list(set(geneProdDB_list)-set(toxinDB_list))
-    geneProdDB_list = list(set(geneProdDB_list)-set(geneProdExcl_list))
+    def write_report(self, results_fn, report_fn):
+        '''Write a tab-separated table of the articles with hits, in the order of the results file; returns the number of articles'''
+        if results_fn.endswith('.sqlite'):
+            store = ResultStore(results_fn)
+            results = dict(store.iter_articles(hits_only=True))
+            store.close()
+        else:
+            results = ResultStore.read_results(results_fn)
+            results.pop('pubmed_query', None)
+        n_articles = 0
+        with open(report_fn, "w") as report_file:
+            report_file.write('\t'.join(['uid', 'pmcid', 'publdate', 'title', 'found_toxins', 'found_genes', 'n_result_paragr']) + '\n')
+            for uid, article in results.items():
+                if not article.get('article_result_paragraphs'):
+                    continue
+                row = [uid, article.get('article_pmcid') or '', article.get('article_publdate_str', ''), article.get('article_title', ''),
+                       '; '.join(article['found_toxins']), '; '.join(article['found_genes']), str(len(article['article_result_paragraphs']))]
+                report_file.write('\t'.join(re.sub(r'\s+', ' ', str(field)) for field in row) + '\n')
+                n_articles += 1
+        return n_articles
     
-    output_fn = args.outfolder +\
-                args.outfn_stem +\
-                datetime.datetime.today().strftime('%Y_%m_%d_%H%M')
 
-    ### STEP 2. Set up logger
+def set_up_logger(verbose, metrics=None):
+    '''Set up the logger; warnings and errors are counted in the run metrics, if given'''
     log = logging.getLogger(__name__)
     if verbose:
         coloredlogs.install(fmt='%(asctime)s [%(levelname)s] %(message)s', level=logging.DEBUG, logger=log)
     else:
         coloredlogs.install(fmt='%(asctime)s [%(levelname)s] %(message)s', level=logging.INFO, logger=log)
+    if metrics is not None:
+        log.addHandler(MetricsLogHandler(metrics))
+    return log
 
-    
-    ### STEP 3. Setting up masterDict, querying PubMed
-    masterDict = {}
-    masterDict['pubmed_query'] = {}
-    masterDict['pubmed_query']['query_string'] = re.sub('\s+',' ', query)
-    ## Querying PubMed for user-supplied query
-    action = "querying PubMed for user-supplied query"
-    log.info("%s" % action)
-    try:
-        masterDict['pubmed_query']['query_return'] = PubMedInteract(email).search_via_query(query)
-        masterDict['pubmed_query']['query_return']['IdList']
-    except:
-        raise Exception("Error when %s" % action)
-    log.info("Number of uids matching the query found: %s" % len(masterDict['pubmed_query']['query_return']['IdList']))
-    ## Updating output file
-    action = "generating JSON output file"
-    log.info("%s" % action)
-    MiscOps().write_to_json(output_fn+'.json', masterDict)
-
-
-    ### STEP 4. Retrieving metadata from PubMed, extracting metadata
-    ## Looping through query uids
-    action = "looping through query uids"
-    log.info("%s" % action)
-    for uid in masterDict['pubmed_query']['query_return']['IdList']:
-        ## Setting up entry in masterDict
-        masterDict[uid] = {}
-        #masterDict[uid]['article_uid'] = uid
-        ## Retrieving metadata from PubMed
-        action = "retrieving metadata from PubMed"
-        log.info("\tuid %s: %s" % (uid, action))
-        try:
-            xml_result = PubMedInteract(email).retrieve_metadata(uid)
-            article = xml_result['PubmedArticle'][0]
-        except:
-            log.critical("\tuid %s: Error when %s" % (uid, action))
-        ## Parsing the metadata, extracting relevant info
-        action = "parsing the metadata, extracting relevant info"
-        log.info("\tuid %s: %s" % (uid, action))
-        try:
-            masterDict[uid]['article_title'] = XMLparsing().article_title(article)
-            masterDict[uid]['article_publdate'] = XMLparsing().article_publdate(article)
-            masterDict[uid]['article_publdate_str'] = MiscOps().convert_to_date(masterDict[uid]['article_publdate'])
-            masterDict[uid]['article_keywords'] = XMLparsing().article_keywords(article)
-            masterDict[uid]['article_mesh'] = XMLparsing().article_mesh(article)
-            masterDict[uid]['article_pmid'] = XMLparsing().article_pmid(article)
-            masterDict[uid]['article_pmcid'] = PMCIDops().article_pmcid(masterDict[uid]['article_pmid'], email)
-        except:
-            log.critical("\tuid %s: Error when %s" % (uid, action))
+class MiningRun:
 
-    ## Updating output file
-    action = "updating JSON output file"
-    log.info("%s" % action)
-    MiscOps().write_to_json(output_fn+'.json', masterDict)
+    def __init__(self, args):
+        '''Set up the steps of a mining run; the subcommands perform some of the steps each and hand over through the run's manifest and journal on disk'''
 
+        ### STEP 1. Getting variables
+        self.args = args
+        self.command = args.command
+        if hasattr(args, 'keywVariants_list'):
+            self.keywVariants_list = [keyw.strip() for keyw in args.keywVariants_list]
+        self.fetch_cache = None
+        if hasattr(args, 'cache_ttl'):  # Subcommands that query NCBI
+            self.fetch_cache = FetchCache(os.path.join(args.cachefolder, 'fetch_cache.sqlite'), args.cache_ttl, args.cache_size)
+        self.output_fn = args.outfolder +\
+                         args.outfn_stem +\
+                         datetime.datetime.today().strftime('%Y_%m_%d_%H%M')
+        self.metrics = RunMetrics(args.profile.split(',') if args.profile else [])
+        self.delta_state = DeltaState(os.path.join(args.outfolder, args.outfn_stem + 'delta_state.json'))
+        self.run_date = datetime.date.today().strftime('%Y/%m/%d')
+        self.masterDict = {}
+        self.uid_stages = {}
+        self.delta = {}
+        self.journal = None
 
-    ### STEP 5. Extract and parse the fulltext of target publications
-    action = "looping through masterDict items"
-    log.info("%s" % action)
-    for uid, article in masterDict.items():
-        if uid == 'pubmed_query':
-            continue
-        if 'article_pmcid' in article.keys() and article['article_pmcid']:
-            
-            ## Forming BioC PMCID URL and retrieving full articles in XML format via BioC API
-            action = "retrieving complete article from PubMedCentral"
-            log.info("\tuid %s: %s" % (uid, action))
+        ### STEP 2. Set up logger
+        self.log = set_up_logger(args.verbose, self.metrics)
+
+    def read_dictionaries(self):
+        '''Read the toxin and gene/product name databases and hash them, together with the keyword variants, for the matcher cache; the matcher hash also covers the co-occurrence rule'''
+        toxinDB_fname = self.args.toxinDB_fname
+        with open(toxinDB_fname) as file:
+            toxinDB_list = file.read().splitlines()
+            toxinDB_list = [line.strip() for line in toxinDB_list]
+
+        geneProdDB_fname = self.args.geneProdDB_fname
+        with open(geneProdDB_fname) as file:
+            geneProdDB_list = file.read().splitlines()
+            geneProdDB_list = [line.strip() for line in geneProdDB_list]
+
+        geneProdExcl_fname = self.args.geneProdExcl_fname
+        with open(geneProdExcl_fname) as file:
+            geneProdExcl_list = file.read().splitlines()
+            geneProdExcl_list = [line.strip() for line in geneProdExcl_list]
+            geneProdExcl_list = [line for line in geneProdExcl_list if '#' not in line]
+            geneProdExcl_list = [line for line in geneProdExcl_list if not line.startswith('#')]
+            geneProdExcl_list = list(filter(None, geneProdExcl_list))
+
+        # Excluding some elements from gene/product name database
+        geneProdDB_list = list(set(geneProdDB_list)-set(self.keywVariants_list))
+        geneProdDB_list = list(set(geneProdDB_list)-set(toxinDB_list))
+        geneProdDB_list = list(set(geneProdDB_list)-set(geneProdExcl_list))
+
+        self.toxinDB_list = toxinDB_list
+        self.geneProdDB_list = geneProdDB_list
+        self.rule = CooccurrenceRule(self.args.cooccurrence, self.args.window_size, self.keywVariants_list)
+        self.dictionaries_hash = MiscOps().hash_inputs([toxinDB_fname, geneProdDB_fname, geneProdExcl_fname], self.keywVariants_list)  # Key of the compiled matcher in the cache
+        self.matcher_hash = MiscOps().hash_inputs([toxinDB_fname, geneProdDB_fname, geneProdExcl_fname], self.keywVariants_list + self.rule.settings())
+
+    def match_index(self):
+        '''Match the dictionaries against a previously built paragraph index instead of mining PubMed'''
+        log = self.log
+        self.read_dictionaries()
+        action = "loading paragraph index %s" % self.args.from_index
+        log.info("%s" % action)
+        index = ParagraphIndex.load(self.args.from_index)
+        action = "identifying indexed paragraphs that match any of the database names for both genes and toxins"
+        log.info("%s" % action)
+        os.makedirs(self.args.outfolder, exist_ok=True)
+        self.output_fn = RunJournal.claim_stem(self.output_fn)  # The empty journal keeps other runs from writing to the same results files
+        self.write_outputs(index.query_entry, index.query(self.toxinDB_list, self.geneProdDB_list, self.rule))
+
+    def write_outputs(self, query_entry, articles_iter):
+        '''Write the (uid, article) pairs in the given order to the JSON output file and/or the result store, in one pass; returns the name of the results file'''
+        results_format = self.args.results_format
+        json_file, store = None, None
+        if results_format in ('json', 'both'):
+            json_file = open(self.output_fn + '.json.tmp', "w")
+            json_file.write('{' + json.dumps('pubmed_query') + ': ' + json.dumps(query_entry))
+        if results_format in ('sqlite', 'both'):
+            store = ResultStore.create(self.output_fn + '.sqlite.tmp', query_entry)
+        for position, (uid, article) in enumerate(articles_iter):
+            if json_file:
+                json_file.write(', ' + json.dumps(uid) + ': ' + json.dumps(article))
+            if store:
+                store.add(position, uid, article)
+        if store:
+            store.finish()
+            store.close()
+            os.replace(self.output_fn + '.sqlite.tmp', self.output_fn + '.sqlite')
+        if json_file:
+            json_file.write('}')
+            json_file.close()
+            os.replace(self.output_fn + '.json.tmp', self.output_fn + '.json')
+        return self.output_fn + ('.json' if json_file else '.sqlite')
+
+    def start_run(self, resume=False):
+        '''Query PubMed and write the manifest of a new run, or resume the most recent unfinished run of the same query'''
+        args, log, masterDict = self.args, self.log, self.masterDict
+        email, query = args.mail, args.query
+        Bio.Entrez.api_key = args.api_key
+
+        ### STEP 3. Setting up masterDict, querying PubMed
+        resume_fn = None
+        if resume:
+            resume_fn = RunJournal.find_resumable(args.outfolder, args.outfn_stem, re.sub(r'\s+',' ', query))
+            if not resume_fn:
+                log.warning("no unfinished run of this query found in %s; starting a new run" % args.outfolder)
+        if resume_fn:
+            self.load_run(resume_fn)
+            return
+        masterDict['pubmed_query'] = {}
+        masterDict['pubmed_query']['query_string'] = re.sub(r'\s+',' ', query)
+        search_ttl = args.search_cache_ttl * 3600  # Search results are cached for repeating a run offline only
+        delta = {}
+        last_run = self.delta_state.lookup(masterDict['pubmed_query']['query_string']) if args.delta else None
+        if last_run:
+            ## Querying PubMed for uids of user-supplied query added or modified since the last run
+            action = "querying PubMed for uids added or modified since %s" % last_run['last_run']
+            log.info("%s" % action)
             try:
-                article['article_bioc_url'] = PMCIDops().get_pmcid_bioc_url(article['article_pmcid'])
-                article['article_pubreader_url'] = PMCIDops().get_pmcid_pubreader_url(article['article_pmcid'])
-                try:
-                    handle = urllib.request.urlopen(article['article_bioc_url'])
-                    article_complete = handle.read()
-                except:
-                    try:
-                        handle = urllib.request.Request(article['article_pubreader_url'], headers={'User-Agent': 'Mozilla/5.0'})
-                        article_complete = urllib.request.urlopen(handle).read()
-                    except:
-                        log.warning("\tuid %s: Retrieval unsuccessful" % uid)
-                        article_complete = None
-                        article['article_paragraphs_with_keyw'] = None
+                masterDict['pubmed_query']['query_return'] = PubMedInteract(email, self.fetch_cache).search_via_query(query, mindate=last_run['last_run'], maxdate=self.run_date, datetype='edat', cache_ttl=search_ttl)
+                modified = PubMedInteract(email, self.fetch_cache).search_via_query(query, mindate=last_run['last_run'], maxdate=self.run_date, datetype='mdat', cache_ttl=search_ttl)
+                IdList = list(dict.fromkeys(masterDict['pubmed_query']['query_return']['IdList'] + modified['IdList']))
+                masterDict['pubmed_query']['query_return'].update(Count=str(len(IdList)), RetMax=str(len(IdList)), IdList=IdList)
             except:
-                log.critical("\tuid %s: Error when %s" % (uid, action))
-
-            if article_complete:
-                ## Extracting the full text
-                action = "extracting full text"
-                log.info("\tuid %s: %s" % (uid, action))
-                try:
-                    if '<?xml version="1.0"' in str(article_complete):
-                        # Parse the XML of the full text
-                        fulltext_etree = lxml.etree.fromstring(article_complete)
-                        # Remove unnecessary sections from full text
-                        LXMLops(fulltext_etree).remove_expendable()
-                        # Extract all text of the full text by paragraph
-                        all_paragraphs = LXMLops(fulltext_etree).extract_all_text()
-                        masterDict[uid]['n_fulltext_paragr'] = len(all_paragraphs)
-                    if '<!DOCTYPE html>' in str(article_complete):
-                        # Parse the HTML of the full text
-                        fulltext_soup = bs4.BeautifulSoup(article_complete, 'html.parser')
-                        # Remove unnecessary sections from full text
-                        html_divs = HTMLops().remove_expendable(fulltext_soup)
-                        # Extract all text of the full text by paragraph
-                        all_paragraphs = HTMLops().extract_all_text(html_divs)
-                        masterDict[uid]['n_fulltext_paragr'] = len(all_paragraphs)
-                except:
-                    log.critical("\tuid %s: Error when %s" % (uid, action))
-                    
-                ## PARAGRAPH FILTERING
-                ## Extracting those paragraphs that contain the keyword `gene` in its different forms
-                action = "extracting paragraphs with keyword `gene`"
-                log.info("\tuid %s: %s" % (uid, action))
-                try:
-                    paragraphs_with_keyw = ParagrOps().extract_gene_paragraphs(all_paragraphs, keywVariants_list)
-                    masterDict[uid]['article_paragraphs_with_keyw'] = paragraphs_with_keyw
-                except:
-                    log.critical("\tuid %s: Error when %s" % (uid, action))
+                raise Exception("Error when %s" % action)
+            for uid in IdList:
+                self.fetch_cache.discard('efetch', uid)  # Cached metadata of modified uids is outdated
+            delta = {'previous': last_run['results'], 'since': last_run['last_run']}
         else:
-            log.warning("\tuid %s: publication on PubMed but not on PubMedCentral" % uid)
-            masterDict[uid]['article_paragraphs_with_keyw'] = None
-
-    ## Updating output file
-    action = "updating JSON output file"
-    log.info("%s" % action)
-    MiscOps().write_to_json(output_fn+'.json', masterDict)
-
-
-    ### STEP 6. Extract and parse the fulltext of target publications
-    ## Extract those paragraphs that match any of the the gene names of a gene name database
-    action = "looping through masterDict items"
-    log.info("%s" % action)
-    for uid, article in masterDict.items():
-        if uid == 'pubmed_query':
-            continue
-        if article['article_paragraphs_with_keyw']:
-            
-            ## PARAGRAPH SELECTION
-            ## Identifying paragraphs that match any of the database names for both genes and toxins
-            action = "identifying paragraphs that match any of the database names for both genes and toxins"
-            log.info("\tuid %s: %s" % (uid, action))
+            ## Querying PubMed for user-supplied query
+            action = "querying PubMed for user-supplied query"
+            log.info("%s" % action)
             try:
-                result_paragraphs, found_genes, found_toxins = [], [], []
-                for paragr in article['article_paragraphs_with_keyw']:
-                    for toxin in toxinDB_list:
-                        if toxin.casefold() in paragr.casefold():
-                            for gene in geneProdDB_list:
-                                if gene.casefold() in paragr.casefold():
-                                    result_paragraphs.append(paragr)
-                                    found_toxins.append(toxin)
-                                    found_genes.append(gene)
-                if len(result_paragraphs) >= 1:
-                    masterDict[uid]['article_result_paragraphs'] = ParagrOps().remove_duplicate_paragraphs(result_paragraphs)  # Note: The same paragraph may have been found multiple times.
-                    masterDict[uid]['found_toxins'] = list(set(found_toxins))
-                    masterDict[uid]['found_genes'] = list(set(found_genes))
-                else:
-                    log.info("\tuid %s: no fitting paragraphs detected" % uid)
-                    masterDict[uid]['article_result_paragraphs'] = None
-                    masterDict[uid]['found_toxins'] = None
-                    masterDict[uid]['found_genes'] = None
+                masterDict['pubmed_query']['query_return'] = PubMedInteract(email, self.fetch_cache).search_via_query(query, cache_ttl=search_ttl)
+                masterDict['pubmed_query']['query_return']['IdList']
             except:
-                log.critical("\tuid %s: Error when %s" % (uid, action))
-                    
+                raise Exception("Error when %s" % action)
+        if args.delta:
+            delta['run_date'] = self.run_date
+        self.delta = delta
+        ## Generating run manifest
+        action = "generating run manifest"
+        log.info("%s" % action)
+        os.makedirs(args.outfolder, exist_ok=True)
+        self.output_fn = RunJournal.claim_stem(self.output_fn)
+        self.journal = RunJournal(self.output_fn)
+        self.journal.write_manifest(pubmed_query=masterDict['pubmed_query'], finished=False, uid_stages={}, delta=delta)
+        log.info("Number of uids matching the query found: %s" % len(masterDict['pubmed_query']['query_return']['IdList']))
+        log.info("Run manifest written to %s" % self.journal.manifest_fn)
+
+    def continue_run(self):
+        '''Continue the run given by --run, or else the most recent unfinished run in the output folder'''
+        output_fn = self.args.run
+        if output_fn:
+            output_fn = re.sub(r'\.manifest\.json$', '', output_fn)
+        else:
+            output_fn = RunJournal.find_resumable(self.args.outfolder, self.args.outfn_stem)
+            if not output_fn:
+                raise Exception("Error when looking up an unfinished run in %s; start one with the subcommand `search`" % self.args.outfolder)
+        self.load_run(output_fn)
+
+    def load_run(self, output_fn):
+        '''Restore the state of a run from its manifest and journal'''
+        masterDict = self.masterDict
+        action = "loading run %s" % output_fn
+        self.log.info("%s" % action)
+        self.output_fn = output_fn
+        self.journal = RunJournal(output_fn)
+        manifest = self.journal.load_manifest()
+        masterDict['pubmed_query'] = manifest['pubmed_query']
+        self.delta = manifest.get('delta', {})
+        for uid in masterDict['pubmed_query']['query_return']['IdList']:
+            masterDict[uid] = {}
+        self.uid_stages = self.journal.replay(masterDict)
+        self.log.info("Number of uids already processed: %s" % sum(1 for stage in self.uid_stages.values() if stage == 'match'))
+
+    def load_matcher(self):
+        '''Compile the dictionary matcher, or load it from the cache if the dictionaries are unchanged'''
+        action = "compiling the dictionary matcher"
+        self.log.info("%s" % action)
+        self.read_dictionaries()
+        matcher_fn = os.path.join(self.args.cachefolder, 'dictmatcher_%s.pickle' % self.dictionaries_hash)
+        return DictMatcher.load_or_build(matcher_fn, self.toxinDB_list, self.geneProdDB_list, self.rule)
+
+    def start_engine(self, matcher):
+        '''Start the worker processes for extraction and matching, if requested; they are forked before any threads of the pipeline run'''
+        if self.args.workers > 1:
+            action = "starting %s worker processes" % self.args.workers
+            self.log.info("%s" % action)
+            return WorkerPool(matcher, self.args.workers)
+        return LocalEngine(matcher)
+
+    def mine(self, fetch=True, match=True, engine=None, rate_share=1):
+        '''Fetch and filter the full texts of the run's uids and/or match their paragraphs against the dictionaries, journalling the results; an engine started by the caller (with the matcher it loaded) is reused, and a worker of a sharded run sends its share of the requests only'''
+        args, log, masterDict, uid_stages, metrics = self.args, self.log, self.masterDict, self.uid_stages, self.metrics
+        n_workers = args.workers
+        queue_size = args.queue_size
+
+        ### STEP 4. Preparing the mining pipeline
+        ## Setting up entries in masterDict in the order of the query uids
+        IdList = masterDict['pubmed_query']['query_return']['IdList']
+        for uid in IdList:
+            masterDict.setdefault(uid, {})
+            #masterDict[uid]['article_uid'] = uid
+        pipeline = []
+        fetcher, pmcid_cache, matcher, entrez_limiter = None, None, None, None
+        cached_uids, uncached_uids, fetched_uids, rematched_uids = [], [], [], []
+        if fetch:
+            Bio.Entrez.api_key = args.api_key
+            rate = (args.rate if args.rate else (10 if args.api_key else 3)) * rate_share  # NCBI limits: 3 requests per second, 10 with an API key
+            if rate_share < 1:
+                entrez_limiter = RateLimiter((10 if args.api_key else 3) * rate_share)  # Bio.Entrez keeps to the NCBI limit per process only
+            pending_uids = [uid for uid in IdList if uid_stages.get(uid) in (None, 'error')]  # Including the uids whose retrieval failed before
+            ## Checking which uids have their metadata in the cache
+            action = "checking the cache for metadata"
+            log.info("%s" % action)
+            for uid in pending_uids:
+                if self.fetch_cache.has('efetch', uid):
+                    cached_uids.append(uid)
+                else:
+                    uncached_uids.append(uid)
+            log.info("Number of uids with metadata in cache: %s of %s" % (len(cached_uids), len(pending_uids)))
+            pmcid_cache = PMCIDcache(os.path.join(args.cachefolder, 'pmid_pmcid_map.sqlite'), args.cache_ttl)
+            fetcher = FulltextFetcher(RateLimiter(rate), args.timeout, args.max_retries, self.fetch_cache, metrics)
+        if match:
+            ## Compiling the dictionary matcher, or loading it from the cache if the dictionaries are unchanged
+            if engine is None:
+                matcher = self.load_matcher()
+            ## Matching again the uids matched with other dictionaries or by another co-occurrence rule
+            if self.journal.manifest.get('matcher_hash') not in (None, self.matcher_hash):
+                rematched_uids = [uid for uid in IdList if uid_stages.get(uid) == 'match']
+                log.info("Number of uids matched again with the revised dictionaries or co-occurrence rule: %s" % len(rematched_uids))
+            self.journal.write_manifest(matcher_hash=self.matcher_hash)
+            if not fetch:
+                fetched_uids = [uid for uid in IdList if uid_stages.get(uid) == 'fulltext']
+                n_unfetched = sum(1 for uid in IdList if uid_stages.get(uid) not in ('fulltext', 'match'))
+                if n_unfetched:
+                    log.warning("%s uids have no full text yet and are skipped; run the subcommand `fetch` first" % n_unfetched)
+        ## Starting worker processes for extraction and matching, if requested
+        n_parse_threads = getattr(args, 'parse_threads', 1)
+        n_match_threads = getattr(args, 'match_threads', 1)
+        own_engine = engine is None
+        if own_engine:
+            engine = self.start_engine(matcher)
+        if n_workers > 1:
+            n_parse_threads = max(n_parse_threads, n_workers)  # Enough threads to keep all worker processes busy
+            n_match_threads = max(n_match_threads, n_workers)
+        ## Connecting the stages by bounded queues
+        if fetch:
+            n_pending = len(cached_uids) + len(uncached_uids) + sum(1 for stage in uid_stages.values() if stage == 'metadata' or (match and stage == 'fulltext'))
+        else:
+            n_pending = len(fetched_uids)
+        journal_queue = queue.Queue(queue_size)
+        stages = MiningStages(getattr(args, 'mail', None), masterDict, self.journal, journal_queue, pmcid_cache, self.fetch_cache, fetcher, engine, self.keywVariants_list, getattr(args, 'html_backend', None),
+                              metrics, metrics.counters['articles_processed'] + n_pending + len(rematched_uids), args.progress_every, 'match' if match else 'fulltext', entrez_limiter)  # Progress counts on from the shards a worker mined before
+        if fetch:
+            pipeline += [PipelineStage('metadata', stages.retrieve_metadata, 1, queue.Queue(queue_size), metrics=metrics),
+                         PipelineStage('pmcid', stages.resolve_pmcids, 1, queue.Queue(queue_size), metrics=metrics),  # Entrez requests are rate-limited per process by Bio.Entrez
+                         PipelineStage('fulltext', stages.fetch_fulltext, args.threads, queue.Queue(queue_size), metrics=metrics),
+                         PipelineStage('filter', stages.extract_fulltext, n_parse_threads, queue.Queue(queue_size), metrics=metrics)]
+        if match:
+            pipeline += [PipelineStage('match', stages.match_dictionaries, n_match_threads, queue.Queue(queue_size), metrics=metrics)]
+        for upstream, downstream in zip(pipeline, pipeline[1:]):
+            upstream.connect(downstream)
+        writer = PipelineStage('writer', stages.write_journal, 1, journal_queue, metrics=metrics)
+        stage_by_name = {stage.name: stage for stage in pipeline}
+
+
+        ### STEP 5. Running the pipeline: metadata -> PMCID -> full text -> paragraph filter -> dictionary match -> journal
+        action = "running the mining pipeline"
+        if fetch:
+            log.info("%s (%s download threads, %s requests per second)" % (action, args.threads, rate))
+        else:
+            log.info("%s (dictionary match only)" % action)
+        for stage in pipeline + [writer]:
+            stage.start()
+        ## Feeding uids that have reached an earlier stage into the next stage
+        for uid in IdList:
+            if fetch and uid_stages.get(uid) == 'metadata':
+                stage_by_name['fulltext'].in_queue.put(uid)
+            elif match and (uid_stages.get(uid) == 'fulltext' or uid in rematched_uids):
+                stage_by_name['match'].in_queue.put(uid)
+        ## Feeding pages of pending uids into the pipeline
+        if fetch:
+            batch_size = args.batch_size
+            for start in range(0, len(cached_uids), batch_size):
+                pipeline[0].in_queue.put((None, cached_uids[start:start+batch_size]))
+            for retstart in range(0, len(uncached_uids), batch_size):
+                pipeline[0].in_queue.put((retstart, uncached_uids[retstart:retstart+batch_size]))
+        pipeline[0].finish()
+        for stage in pipeline:
+            stage.join()
+        writer.finish()
+        writer.join()
+        if own_engine:
+            engine.close()
+        if pmcid_cache:
+            pmcid_cache.close()
+
+
+        ### STEP 6. Updating manifest
+        action = "updating manifest"
+        log.info("%s" % action)
+        for offset, record in self.journal.iter_records():
+            uid_stages[record['uid']] = record['stage']
+        self.journal.write_manifest(uid_stages=uid_stages)
+        n_failed = sum(1 for uid in IdList if uid_stages.get(uid) == 'error')
+        if n_failed:
+            log.warning("%s uids could not be retrieved; run the subcommand `fetch` or `run --resume` to retry them" % n_failed)
+
+    def ingest(self):
+        '''Mine local archives of full texts instead of PubMed: extract, filter and match them in worker processes and journal the articles'''
+        args, log, masterDict, metrics = self.args, self.log, self.masterDict, self.metrics
+
+        ### STEP 3. Setting up the run and the set of wanted PMIDs/PMCIDs
+        archive_fns = ArchiveIngester.find_archives(args.archives)
+        ids = None
+        if args.run:
+            ## Ingesting the uids of a run started by the subcommand `search`
+            self.load_run(re.sub(r'\.manifest\.json$', '', args.run))
+            ids = set(masterDict['pubmed_query']['query_return']['IdList'])
+        else:
+            masterDict['pubmed_query'] = {'query_string': 'archives: %s' % ' '.join(archive_fns), 'query_return': {'Count': '0', 'IdList': []}}
+            os.makedirs(args.outfolder, exist_ok=True)
+            self.output_fn = RunJournal.claim_stem(self.output_fn)
+            self.journal = RunJournal(self.output_fn)
+            self.journal.write_manifest(pubmed_query=masterDict['pubmed_query'], finished=False, uid_stages={}, delta={})
+        if args.ids_fname:
+            with open(args.ids_fname) as file:
+                ids = (ids or set()) | {line.strip() for line in file if line.strip()}
+        IdList = masterDict['pubmed_query']['query_return']['IdList']
+        log.info("Number of archives to ingest: %s (%s)" % (len(archive_fns), 'all articles' if ids is None else '%s wanted PMIDs/PMCIDs' % len(ids)))
+
+        ### STEP 4. Compiling the dictionary matcher, or loading it from the cache if the dictionaries are unchanged
+        matcher = self.load_matcher()
+        self.journal.write_manifest(matcher_hash=self.matcher_hash)
+
+        ### STEP 5. Ingesting the archives: archive members -> full text -> paragraph filter -> dictionary match -> journal
+        action = "ingesting archives"
+        log.info("%s (%s worker processes)" % (action, args.workers))
+        known_uids = set(IdList)
+        n_archives = 0
+        ingester = ArchiveIngester(matcher, self.keywVariants_list, ids)
+        for uid, article in ingester.ingest(archive_fns, args.workers, args.queue_size):
+            if uid is None:
+                n_archives += 1
+                log.debug("\tarchive %s of %s ingested: %s" % (n_archives, len(archive_fns), article))
+                continue
+            log.debug("\tuid %s: %s" % (uid, "ingested from %s" % article['article_source']))
+            if uid not in known_uids:
+                known_uids.add(uid)
+                IdList.append(uid)
+            masterDict[uid] = {}
+            for stage in RunJournal.stages:
+                data = self.journal.stage_data(stage, article)
+                if stage == 'metadata':
+                    masterDict[uid].update(data)  # Only the metadata is kept in memory, for ordering the output
+                self.journal.record(uid, stage, data)
+            self.uid_stages[uid] = 'match'
+            n_processed = metrics.count('articles_processed')
+            if article.get('n_fulltext_paragr'):
+                metrics.count('articles_with_fulltext')
+            if article.get('article_result_paragraphs'):
+                metrics.count('articles_with_hits')
+            if args.progress_every and n_processed % args.progress_every == 0:
+                log.info("processed %s articles of %s of %s archives: %s with hits; %.1f articles per second"
+                         % (n_processed, n_archives, len(archive_fns), metrics.counters['articles_with_hits'], n_processed / (time.time() - metrics.started)))
+        log.info("Number of articles ingested: %s, of which with hits: %s" % (metrics.counters['articles_processed'], metrics.counters['articles_with_hits']))
+        if ids is not None and len(ids) > metrics.counters['articles_processed']:
+            log.warning("%s of the wanted PMIDs/PMCIDs were not found in the archives" % (len(ids) - metrics.counters['articles_processed']))
+
+        ### STEP 6. Updating manifest
+        action = "updating manifest"
+        log.info("%s" % action)
+        masterDict['pubmed_query']['query_return'].update(Count=str(len(IdList)), IdList=IdList)
+        self.journal.write_manifest(pubmed_query=masterDict['pubmed_query'], uid_stages=self.uid_stages)
+
+    def shard(self):
+        '''Split the uids of a run that are not matched yet into the shards of a work queue, from which workers on any number of hosts lease them'''
+        args, log = self.args, self.log
+
+        ### STEP 3. Loading the run
+        self.continue_run()
+
+        ### STEP 4. Writing the work queue
+        action = "writing work queue"
+        log.info("%s" % action)
+        IdList = self.masterDict['pubmed_query']['query_return']['IdList']
+        pending_uids = [uid for uid in IdList if self.uid_stages.get(uid) != 'match']
+        shards = [pending_uids[start:start+args.shard_size] for start in range(0, len(pending_uids), args.shard_size)]
+        queue_fn = self.output_fn + '.queue.sqlite'
+        WorkQueue.create(queue_fn, shards, args.lease, args.max_attempts, args.rate).close()
+        self.journal.write_manifest(work_queue=queue_fn)
+        log.info("Number of shards: %s, of up to %s uids each" % (len(shards), args.shard_size))
+        log.info("Work queue written to %s" % queue_fn)
+
+    def work(self):
+        '''Lease shards from the work queue of a run until none is left, mining each into a journal of its own; shards leased by crashed workers are reclaimed when their lease expires'''
+        args, log = self.args, self.log
+
+        ### STEP 3. Opening the work queue of the run
+        run_fn = re.sub(r'\.manifest\.json$', '', args.run) if args.run else RunJournal.find_resumable(args.outfolder, args.outfn_stem)
+        if not run_fn or not os.path.isfile(run_fn + '.queue.sqlite'):
+            raise Exception("Error when looking up the work queue of %s; create it with the subcommand `shard`" % (run_fn or 'an unfinished run in ' + args.outfolder))
+        work_queue = WorkQueue(run_fn + '.queue.sqlite')
+        lease_seconds = work_queue.settings()[0]
+        args.rate = work_queue.rate() or args.rate  # The request rate of all workers together, if given to `shard`
+        query_string = RunJournal(run_fn).load_manifest()['pubmed_query']['query_string']
+        owner = '%s_%s' % (socket.gethostname(), os.getpid())
+        shards_folder = run_fn + '.shards'
+        os.makedirs(shards_folder, exist_ok=True)
+
+        ## Starting the worker processes once for all shards, before the first heartbeat thread runs, so that they are not forked from a multithreaded process
+        engine = self.start_engine(self.load_matcher())
+
+        ### STEP 4-6. Mining the shards; each lease is renewed by a heartbeat while its shard is mined
+        n_shards = 0
+        while True:
+            claimed = work_queue.claim(owner)
+            if claimed is None:
+                next_expiry = work_queue.next_expiry()
+                if next_expiry is None:
+                    break
+                ## Waiting for the shards leased by other workers, in case their leases expire
+                log.debug("waiting for shards leased by other workers")
+                time.sleep(min(max(next_expiry - time.time(), 1), lease_seconds / 3))
+                continue
+            shard, attempt, uids = claimed
+            n_active_workers = max(1, work_queue.n_active_workers())
+            action = "mining shard %s (%s uids, attempt %s)" % (shard, len(uids), attempt)
+            log.info("%s, with 1/%s of the request rate of all workers" % (action, n_active_workers))
+            shard_fn = os.path.join(shards_folder, 'shard_%05d_%d' % (shard, attempt))  # Every lease writes a journal of its own, so that a worker that lost its lease cannot corrupt the journal of its successor
+            self.masterDict = {'pubmed_query': {'query_string': query_string, 'query_return': {'Count': str(len(uids)), 'IdList': uids}}}
+            self.uid_stages = {}
+            self.journal = RunJournal(shard_fn)
+            self.journal.write_manifest(pubmed_query=self.masterDict['pubmed_query'], finished=False, uid_stages={}, delta={}, shard=shard)
+            failed = False
+            with work_queue.lease(shard, owner, attempt) as lost:
+                try:
+                    self.mine(engine=engine, rate_share=1/n_active_workers)
+                except:
+                    log.critical("\tshard %s: Error when %s" % (shard, action))
+                    failed = True
+            self.journal.close()
+            if failed:
+                work_queue.release(shard, owner, attempt)
+                continue
+            self.journal.write_manifest(finished=all(self.uid_stages.get(uid) == 'match' for uid in uids))
+            if lost.is_set() or not work_queue.complete(shard, owner, attempt, shard_fn, self.matcher_hash):
+                log.warning("\tshard %s: lease lost to another worker; the journal %s is discarded" % (shard, self.journal.journal_fn))
+                continue
+            n_shards += 1
+        log.info("Number of shards mined by this worker: %s; shards by status: %s" % (n_shards, work_queue.counts()))
+        engine.close()
+        work_queue.close()
+        self.journal = None
+        self.output_fn = os.path.join(shards_folder, 'worker_%s' % owner)  # For the metrics of this worker
+
+    def merge(self):
+        '''Append the journals of the shards mined by the workers to the journal of the run, whose results are then written as those of any run'''
+        log, masterDict = self.log, self.masterDict
+
+        ### STEP 3. Loading the run and its work queue
+        self.continue_run()
+        uid_stages = self.uid_stages
+        if not os.path.isfile(self.output_fn + '.queue.sqlite'):
+            raise Exception("Error when looking up the work queue of %s; create it with the subcommand `shard`" % self.output_fn)
+        work_queue = WorkQueue(self.output_fn + '.queue.sqlite')
+
+        ### STEP 4-5. Appending the journals of the mined shards, in shard order
+        action = "merging the journals of the mined shards"
+        log.info("%s" % action)
+        matcher_hashes = {self.journal.manifest.get('matcher_hash')} - {None}
+        merged = []
+        for shard, shard_fn, matcher_hash in work_queue.done_shards():
+            log.debug("\tshard %s: merging %s" % (shard, shard_fn))
+            for offset, record in RunJournal(shard_fn).iter_records():
+                uid = record['uid']
+                self.journal.record(uid, record['stage'], record['data'])
+                if record['stage'] == 'metadata':
+                    masterDict.setdefault(uid, {}).update(record['data'])  # Only the metadata is kept in memory, for ordering the output
+                uid_stages[uid] = record['stage']
+            matcher_hashes.add(matcher_hash)
+            merged.append(shard)
+        work_queue.mark_merged(merged)  # Shards merged again after a crash at this point only repeat identical records
+        counts = work_queue.counts()
+        work_queue.close()
+        log.info("Number of shards merged: %s" % len(merged))
+        n_unfinished = counts.get('pending', 0) + counts.get('leased', 0)
+        if n_unfinished:
+            log.warning("%s of %s shards are not mined yet; merge again once they are" % (n_unfinished, sum(counts.values())))
+
+        ### STEP 6. Updating manifest
+        action = "updating manifest"
+        log.info("%s" % action)
+        self.journal.write_manifest(uid_stages=uid_stages)
+        if len(matcher_hashes) > 1:
+            log.warning("the shards were matched against %s different versions of the dictionaries or co-occurrence rules; match the run again with `match --run`" % len(matcher_hashes))
+            self.journal.write_manifest(matcher_hash='mixed')  # Matches no dictionaries, so that the next `match` matches all uids again
+        elif matcher_hashes:
+            self.journal.write_manifest(matcher_hash=matcher_hashes.pop())
+
+    def write_results(self):
+        '''Merge the journal of the run into the JSON output file, ordered by date of publication'''
+        args, log, metrics, journal, delta = self.args, self.log, self.metrics, self.journal, self.delta
+        output_fn = self.output_fn
+
+        ### STEP 7. Ordering articles by date of publication, with most recent publication first
+        action = "ordering articles by date of publication, with most recent publication first"
+        log.info("%s" % action)
+        tmpDict = dict(self.masterDict)  # Must copy masterDict; otherwise pop in tmpDict will also delete in masterDict
+        query_entry = tmpDict.pop('pubmed_query')
+        previous = None
+        if delta.get('previous'):
+            ## Merging the articles added or modified since the last run into its results
+            action = "merging with the results of the last run %s" % delta['previous']
+            log.info("%s" % action)
+            previous = ResultStore.read_results(delta['previous'])
+            previous_query = previous.pop('pubmed_query')
+            query_entry = copy.deepcopy(query_entry)
+            IdList = list(dict.fromkeys(previous_query['query_return']['IdList'] + query_entry['query_return']['IdList']))
+            tmpDict = {uid: tmpDict[uid] if uid in tmpDict else previous[uid] for uid in IdList}
+            query_entry['query_return'].update(Count=str(len(IdList)), RetMax=str(len(IdList)), IdList=IdList)
+        ordered_uids = [uid for uid, article in sorted(tmpDict.items(), key=lambda item: item[1].get('article_publdate_str', ''), reverse=True)]
+
+        ## Merging the journal into the date-ordered JSON output file and/or result store
+        action = "generating output files"
+        log.info("%s" % action)
+        with metrics.timer('results_write'):
+            results_fn = self.write_outputs(query_entry, journal.iter_articles(ordered_uids, previous))
+
+        ## Building an inverted index of the paragraphs with keyword, if requested
+        if args.build_index:
+            action = "building paragraph index"
+            log.info("%s" % action)
+            ParagraphIndex.build(query_entry, journal.iter_articles(ordered_uids, previous)).save(output_fn+'.index.pickle')
+
+        ## Grouping near-duplicate result paragraphs across articles, if requested
+        if args.near_dup_threshold:
+            action = "grouping near-duplicate result paragraphs across articles"
+            log.info("%s" % action)
+            finder = DuplicateFinder(args.near_dup_threshold)
+            for uid, article in journal.iter_articles(ordered_uids, previous):
+                for index, paragr in enumerate(article.get('article_result_paragraphs') or []):
+                    finder.add(uid, index, paragr)
+            duplicate_groups = finder.groups()
+            log.info("found %s groups of near-duplicate paragraphs" % len(duplicate_groups))
+            with open(output_fn+'.duplicates.json', "w") as json_file:
+                json.dump(duplicate_groups, json_file)
+        IdList = self.masterDict['pubmed_query']['query_return']['IdList']
+        journal.write_manifest(finished=all(self.uid_stages.get(uid) == 'match' for uid in IdList))
+        if 'run_date' in delta:
+            self.delta_state.update(query_entry['query_string'], delta['run_date'], results_fn)
+            self.delta_state.save()
+
+    def close(self):
+        '''Close the journal and the cache and write the metrics of the run'''
+        if self.journal:
+            self.journal.close()
+        if self.fetch_cache:
+            self.fetch_cache.close()
+
+        ## Writing the metrics of the run
+        action = "writing run metrics"
+        self.log.info("%s" % action)
+        metrics_fn = self.output_fn if self.command == 'run' else self.output_fn + '.' + self.command  # Subcommands continuing a run do not overwrite each other's metrics
+        os.makedirs(self.args.outfolder, exist_ok=True)
+        self.metrics.write_json(metrics_fn+'.metrics.json')
+        if self.args.prometheus_textfile:
+            self.metrics.write_prometheus(self.args.prometheus_textfile)
+        self.metrics.write_profiles(metrics_fn)
+
+
+def main(args):
+    '''Perform the steps of the subcommand: `search` starts a run, `fetch` and `match` continue it, `run` does all three, `ingest` mines local archives instead, `shard`, `worker` and `merge` mine a run on several hosts and `report` summarizes the results'''
+    if args.command == 'report':
+        log = set_up_logger(args.verbose)
+        results_fn = args.results_fname or MiscOps().latest_results(args.outfolder, args.outfn_stem)
+        if not results_fn:
+            raise Exception("Error when looking up results in %s" % args.outfolder)
+        report_fn = args.report_fname or re.sub(r'\.(json|sqlite)$', '', results_fn) + '.report.tsv'
+        action = "writing report of %s" % results_fn
+        log.info("%s" % action)
+        log.info("Number of articles with hits: %s" % MiscOps().write_report(results_fn, report_fn))
+        return
+    run = MiningRun(args)
+    if args.command in ('run', 'match') and args.from_index:
+        run.match_index()
+    elif args.command == 'ingest':
+        run.ingest()
+        run.write_results()
+    elif args.command == 'shard':
+        run.shard()
+    elif args.command == 'worker':
+        run.work()
+    elif args.command == 'merge':
+        run.merge()
+        run.write_results()
+    else:
+        if args.command in ('run', 'search'):
+            run.start_run(resume=getattr(args, 'resume', False))
         else:
-            masterDict[uid]['article_result_paragraphs'] = None
-            masterDict[uid]['found_toxins'] = None
-            masterDict[uid]['found_genes'] = None
-
-    ## Updating output file
-    action = "updating JSON output file"
-    log.info("%s" % action)
-    MiscOps().write_to_json(output_fn+'.json', masterDict)
-
-
-    ### STEP 7. Ordering articles by date of publication, with most recent publication first
-    action = "ordering articles by date of publication, with most recent publication first"
-    log.info("%s" % action)
-
-    handleDict = {}
-    tmpDict = dict(masterDict)  # Must copy masterDict; otherwise pop in tmpDict will also delete in masterDict
-    handleDict['pubmed_query'] = tmpDict.pop('pubmed_query')
-    handleDict.update(collections.OrderedDict(sorted(tmpDict.items(), key=lambda item: item[1]['article_publdate_str'], reverse=True)))
-    masterDict = handleDict
-
-    ## Updating output file
-    action = "updating JSON output file"
-    log.info("%s" % action)
-    MiscOps().write_to_json(output_fn+'.json', masterDict)
+            run.continue_run()
+        if args.command != 'search':
+            run.mine(fetch=args.command != 'match', match=args.command != 'fetch')
+        if args.command in ('run', 'match'):
+            run.write_results()
+    run.close()
     
-#-----------------------------------------------------------------#
-# MAIN
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Author|Version: '+__version__)#description="  --  ".join([__author__+' <'+__email__+'>', __info__, __version__]))
-    parser.add_argument("--query", "-q", type=str, required=True, 
-                        help="Query string to query NCBI PubMed via Entrez")
-    parser.add_argument("--mail", "-m", type=str, required=True,
+def parse_args(argv=None):
+    '''Parse the command line arguments; without a subcommand, all steps are run (subcommand `run`)'''
+    commands = ['run', 'search', 'fetch', 'match', 'ingest', 'shard', 'worker', 'merge', 'report']
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] not in commands + ['-h', '--help']:
+        argv = ['run'] + argv
+
+    ## Arguments shared by all subcommands
+    output_args = argparse.ArgumentParser(add_help=False)
+    output_args.add_argument("--outfn_stem", "-s", type=str, required=False,
+                        default="litMiningPubmed_Results_",
+                        help="Stem of the output file")
+    output_args.add_argument("--outfolder", "-o", type=str, required=False,
+                        default="./results/",
+                        help="Name of the output folder")
+    output_args.add_argument("--verbose", "-v", action="store_true", required=False,
+                        default=False, help="(Optional) Enable verbose logging, including per-uid messages")
+
+    ## Arguments of the steps of a run
+    run_args = argparse.ArgumentParser(add_help=False)
+    run_args.add_argument("--cachefolder", "-c", type=str, required=False,
+                        default="./cache/",
+                        help="(Optional) Name of the folder holding cached lookups between runs")
+    run_args.add_argument("--progress_every", type=int, required=False,
+                        default=100,
+                        help="(Optional) Log aggregate progress every this many articles; per-uid messages are only logged with --verbose")
+    run_args.add_argument("--prometheus_textfile", type=str, required=False,
+                        default=None,
+                        help="(Optional) Path to which to write the run metrics in the Prometheus text format (e.g., for the node exporter textfile collector)")
+    run_args.add_argument("--profile", type=str, required=False,
+                        default=None,
+                        help="(Optional) Comma-separated timers to run under cProfile (e.g., `stage_filter,match`); written to <output>.<timer>.pstats")
+
+    ## Arguments of the steps that query NCBI
+    entrez_args = argparse.ArgumentParser(add_help=False)
+    entrez_args.add_argument("--mail", "-m", type=str, required=False,
                         help="Your email address (needed for querying NCBI PubMed via Entrez)")
-    parser.add_argument("--keywVariants_list", "-k", type=list, required=False, 
+    entrez_args.add_argument("--api_key", "-a", type=str, required=False,
+                        default=None,
+                        help="(Optional) NCBI API key; raises the permitted request rate")
+    entrez_args.add_argument("--cache_ttl", type=float, required=False,
+                        default=30,
+                        help="(Optional) Days after which cached metadata, full texts and missing PubMedCentral copies are fetched again (0: never)")
+    entrez_args.add_argument("--cache_size", type=float, required=False,
+                        default=2048,
+                        help="(Optional) Maximum size in MB of the cache of fetched payloads")
+
+    ## Arguments of the search step
+    search_args = argparse.ArgumentParser(add_help=False)
+    search_args.add_argument("--query", "-q", type=str, required=False,
+                        help="Query string to query NCBI PubMed via Entrez")
+    search_args.add_argument("--delta", action="store_true", required=False,
+                        default=False,
+                        help="(Optional) Mine only uids added or modified since the last delta run of the same query and merge them into its results")
+    search_args.add_argument("--search_cache_ttl", type=float, required=False,
+                        default=0,
+                        help="(Optional) Hours during which the uids of an earlier search of the same query are reused instead of searching PubMed again, e.g. to repeat a run offline (0: always search)")
+
+    ## Arguments of the fetch and match steps
+    pipeline_args = argparse.ArgumentParser(add_help=False)
+    pipeline_args.add_argument("--keywVariants_list", "-k", type=list, required=False,
                         default=[' gene ', ' gene,', ' gene;', ' gene.'], 
                         help="(Optional) List of keyword variants")
-    parser.add_argument("--toxinDB_fname", "-x", type=str, required=False, 
+    pipeline_args.add_argument("--workers", "-w", type=int, required=False,
+                        default=1,
+                        help="(Optional) Number of worker processes for full text extraction and dictionary matching")
+    pipeline_args.add_argument("--queue_size", type=int, required=False,
+                        default=64,
+                        help="(Optional) Maximum number of items waiting between two pipeline stages")
+
+    ## Arguments of the fetch step
+    fetch_args = argparse.ArgumentParser(add_help=False)
+    fetch_args.add_argument("--batch_size", "-b", type=int, required=False,
+                        default=200,
+                        help="(Optional) Number of records retrieved per efetch or elink request")
+    fetch_args.add_argument("--rate", "-r", type=float, required=False,
+                        default=None,
+                        help="(Optional) Maximum number of full text requests per second (default: 3, or 10 with an API key)")
+    fetch_args.add_argument("--threads", "-t", type=int, required=False,
+                        default=8,
+                        help="(Optional) Number of concurrent full text downloads")
+    fetch_args.add_argument("--parse_threads", type=int, required=False,
+                        default=2,
+                        help="(Optional) Number of threads extracting and filtering full text paragraphs")
+    fetch_args.add_argument("--timeout", type=float, required=False,
+                        default=30,
+                        help="(Optional) Timeout in seconds per full text request")
+    fetch_args.add_argument("--max_retries", type=int, required=False,
+                        default=3,
+                        help="(Optional) Number of retries per full text request on timeouts or server errors")
+    fetch_args.add_argument("--html_backend", type=str, required=False,
+                        default="lxml", choices=["lxml", "bs4", "check"],
+                        help="(Optional) Parser for PubReader full texts; `lxml` hands pages with block elements inside paragraphs to `bs4`, `check` parses with both and warns where they differ")
+
+    ## Arguments of the match step
+    match_args = argparse.ArgumentParser(add_help=False)
+    match_args.add_argument("--toxinDB_fname", "-x", type=str, required=False,
                         default="/home/mgruenst/tmp/databases/mycotoxin_names_2022_07_26.txt",
                         help="(Optional) Path to toxin name database file")
-    parser.add_argument("--geneProdDB_fname", "-g", type=str, required=False, 
+    match_args.add_argument("--geneProdDB_fname", "-g", type=str, required=False,
                         default="/home/mgruenst/tmp/databases/Trichoderma_genomes_GeneList_2022_07_27.txt",
                         help="(Optional) Path to gene/product database file")
-    parser.add_argument("--geneProdExcl_fname", "-e", type=str, required=False, 
+    match_args.add_argument("--geneProdExcl_fname", "-e", type=str, required=False,
                         default="/home/mgruenst/tmp/databases/Trichoderma_genomes_GeneList_Exclusions_2022_07_27.txt",
                         help="(Optional) Path to file containing an list of gene/product names to be excluded")
-    parser.add_argument("--outfn_stem", "-s", type=str, required=False, 
-                        default="litMiningPubmed_Results_",
-                        help="Stem of the output file")
-    parser.add_argument("--outfolder", "-o", type=str, required=False, 
-                        default="./results/",
-                        help="Name of the output folder")
-    parser.add_argument("--verbose", "-v", action="store_true", required=False, 
-                        default=True, help="(Optional) Enable verbose logging")
-    args = parser.parse_args()
+    match_args.add_argument("--match_threads", type=int, required=False,
+                        default=1,
+                        help="(Optional) Number of threads matching paragraphs against the dictionaries")
+    match_args.add_argument("--cooccurrence", type=str, required=False,
+                        default="substring", choices=CooccurrenceRule.windows,
+                        help="(Optional) Rule by which a paragraph is a hit: a toxin and a gene name anywhere in it, also within words (`substring`), as whole words anywhere (`paragraph`), within --window_size sentences (`sentence`) or within --window_size tokens (`tokens`)")
+    match_args.add_argument("--window_size", type=int, required=False,
+                        default=None,
+                        help="(Optional) Number of sentences between a toxin and a gene name for --cooccurrence sentence (default: 0, the same sentence), or of tokens for --cooccurrence tokens (default: 10)")
+    match_args.add_argument("--from_index", type=str, required=False,
+                        default=None,
+                        help="(Optional) Path to a paragraph index file; match the dictionaries against its paragraphs instead of mining PubMed")
+
+    ## Arguments of the steps that write the results
+    results_args = argparse.ArgumentParser(add_help=False)
+    results_args.add_argument("--near_dup_threshold", type=float, required=False,
+                        default=None,
+                        help="(Optional) Group result paragraphs across articles whose estimated similarity reaches this threshold (e.g., 0.8) into a duplicates file")
+    results_args.add_argument("--build_index", action="store_true", required=False,
+                        default=False,
+                        help="(Optional) Build an inverted index of the paragraphs with keyword, for re-matching revised dictionaries with --from_index")
+    results_args.add_argument("--results_format", type=str, required=False,
+                        default="both", choices=["json", "sqlite", "both"],
+                        help="(Optional) Format of the results: a JSON file, a SQLite result store with tables of articles, paragraphs and hits, or both")
+
+    ## Arguments of the steps that continue a run
+    continue_args = argparse.ArgumentParser(add_help=False)
+    continue_args.add_argument("--run", type=str, required=False,
+                        default=None,
+                        help="(Optional) Output stem (or manifest file) of the run to continue; by default, the most recent unfinished run in the output folder")
+
+    parser = argparse.ArgumentParser(description='Author|Version: '+__version__)#description="  --  ".join([__author__+' <'+__email__+'>', __info__, __version__]))
+    subparsers = parser.add_subparsers(dest='command', metavar='{%s}' % ','.join(commands))
+    run_parser = subparsers.add_parser('run', parents=[output_args, run_args, entrez_args, search_args, pipeline_args, fetch_args, match_args, results_args],
+                          help="Search PubMed, fetch the full texts and match them against the dictionaries (default)")
+    run_parser.add_argument("--resume", action="store_true", required=False,
+                        default=False,
+                        help="(Optional) Resume the most recent unfinished run of the same query, skipping finished uids")
+    subparsers.add_parser('search', parents=[output_args, run_args, entrez_args, search_args],
+                          help="Search PubMed and write the manifest of a new run")
+    subparsers.add_parser('fetch', parents=[output_args, run_args, entrez_args, pipeline_args, fetch_args, continue_args],
+                          help="Fetch and filter the full texts of a run, journalling the paragraphs with keyword")
+    subparsers.add_parser('match', parents=[output_args, run_args, pipeline_args, match_args, results_args, continue_args],
+                          help="Match the journalled paragraphs of a run (or a paragraph index) against the dictionaries and write the results")
+    ingest_parser = subparsers.add_parser('ingest', parents=[output_args, run_args, pipeline_args, match_args, results_args],
+                          help="Mine local archives (tar.gz or XML files in the BioC or PMC Open Access JATS format) instead of fetching full texts from PubMed Central")
+    ingest_parser.add_argument("--archives", type=str, nargs='+', required=True,
+                        help="Archives or folders of archives: BioC or JATS (.nxml) XML files, as such, gzipped or in tar(.gz) files")
+    ingest_parser.add_argument("--ids_fname", type=str, required=False,
+                        default=None,
+                        help="(Optional) Path to a file of PMIDs and/or PMCIDs (one per line) to ingest; by default, all articles of the archives")
+    ingest_parser.add_argument("--run", type=str, required=False,
+                        default=None,
+                        help="(Optional) Output stem (or manifest file) of a run started by the subcommand `search`; only its uids are ingested, into that run")
+    shard_parser = subparsers.add_parser('shard', parents=[output_args, run_args, continue_args],
+                          help="Split the uids of a run into the shards of a work queue (a SQLite file next to the manifest), for mining by workers on several hosts")
+    shard_parser.add_argument("--shard_size", type=int, required=False,
+                        default=500,
+                        help="(Optional) Number of uids per shard")
+    shard_parser.add_argument("--lease", type=float, required=False,
+                        default=600,
+                        help="(Optional) Seconds after which the shard of a worker that stopped renewing its lease is leased to another worker")
+    shard_parser.add_argument("--max_attempts", type=int, required=False,
+                        default=3,
+                        help="(Optional) Maximum number of leases per shard, after which a failing shard is given up")
+    shard_parser.add_argument("--rate", "-r", type=float, required=False,
+                        default=None,
+                        help="(Optional) Maximum number of full text requests per second of all workers together, divided among the active workers (default: 3, or 10 with an API key)")
+    subparsers.add_parser('worker', parents=[output_args, run_args, entrez_args, pipeline_args, fetch_args, match_args, continue_args],
+                          help="Lease shards from the work queue of a run and fetch and match their uids, until all shards are mined; start any number of workers on hosts sharing the output folder")
+    subparsers.add_parser('merge', parents=[output_args, run_args, results_args, continue_args],
+                          help="Merge the shards mined by the workers into the journal of the run and write its results")
+    report_parser = subparsers.add_parser('report', parents=[output_args],
+                          help="Summarize the articles with hits of a results file in a table")
+    report_parser.add_argument("--results_fname", "-i", type=str, required=False,
+                        default=None,
+                        help="(Optional) Path to the results file (JSON or SQLite); by default, the most recent results in the output folder")
+    report_parser.add_argument("--report_fname", type=str, required=False,
+                        default=None,
+                        help="(Optional) Path to the report file (default: the results file with extension .report.tsv)")
+    args = parser.parse_args(argv)
     #if bool(args.query) ^ bool(args.mail):
     #    parser.error("--query and --mail must be given together")
-    main(args)
+    if args.command == 'run' and not args.from_index and not (args.query and args.mail):
+        parser.error("the following arguments are required: --query/-q, --mail/-m (unless --from_index is given)")
+    if args.command == 'search' and not (args.query and args.mail):
+        parser.error("the following arguments are required: --query/-q, --mail/-m")
+    if args.command in ('fetch', 'worker') and not args.mail:
+        parser.error("the following arguments are required: --mail/-m")
+    return args
+
+#-----------------------------------------------------------------#
+# MAIN
+
+if __name__ == "__main__":
+    main(parse_args())
 
 #-----------------------------------------------------------------#
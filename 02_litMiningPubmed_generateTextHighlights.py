@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+__version__ = 'm.gruenstaeudl@fu-berlin.de|2022-08-04T22:09:36 CEST'
+
+#-----------------------------------------------------------------#
+## IMPORTS
+import argparse
+import coloredlogs
+import functools
+import glob
+import html
+import json
+import logging
+import multiprocessing
+import os
+import re
+import subprocess
+
+
+#-----------------------------------------------------------------#
+# INFO
+#__info__ = 'Highlighting of the genes, toxins and keywords found by full text literature mining on PubMed'
+
+#-----------------------------------------------------------------#
+# CLASSES AND FUNCTIONS
+class HighlightOps:
+
+    categories = ['gene', 'toxin', 'keyw']  # Where a name is in more than one category, the first one wins
+
+    def __init__(self, keywords=('gene',)):
+        self.keywords = keywords
+
+    @functools.lru_cache(maxsize=1024)
+    def compile_names(self, genes, toxins):
+        '''Compile the names of an article into a single case-insensitive pattern; longer names come first, so that the longest name wins at any position'''
+        category_of = {}
+        for category, names in zip(self.categories, (genes, toxins)):
+            for name in names:
+                category_of.setdefault(name.casefold(), category)
+        alternatives = [re.escape(name) for name in sorted(category_of, key=len, reverse=True)]
+        # Keywords are matched case-sensitively, between a space and a space or punctuation (cf. the keyword variants of the mining script)
+        alternatives += [r'(?-i:(?<= )%s(?=[ ,;.]))' % re.escape(keyw) for keyw in self.keywords]
+        return re.compile('|'.join(alternatives), flags=re.IGNORECASE), category_of
+
+    def find_spans(self, text, genes, toxins):
+        '''Find the non-overlapping (start, end, category) spans of all genes, toxins and keywords in a single pass over the text'''
+        pattern, category_of = self.compile_names(tuple(sorted(genes or [])), tuple(sorted(toxins or [])))
+        return [(match.start(), match.end(), category_of.get(match.group().casefold(), 'keyw')) for match in pattern.finditer(text)]
+
+    def join_spans(self, paragraphs, paragraph_spans, separator):
+        '''Shift the spans stored by the mining script for each result paragraph to the fused text, without searching it'''
+        spans, offset = [], 0
+        for paragr, spans_of_paragr in zip(paragraphs, paragraph_spans):
+            spans.extend((offset+start, offset+end, category) for start, end, category in spans_of_paragr)
+            offset += len(paragr) + len(separator)
+        return spans
+
+    def highlight(self, text, spans, escape, mark):
+        '''Assemble the escaped text, wrapping each span by `mark`; every character is escaped exactly once'''
+        pieces, position = [], 0
+        for start, end, category in spans:
+            pieces.append(escape(text[position:start]))
+            pieces.append(mark(escape(text[start:end]), category))
+            position = end
+        pieces.append(escape(text[position:]))
+        return ''.join(pieces)
+
+class LatexEscapes(dict):
+
+    def __missing__(self, code):
+        '''Look up the LaTeX representation of a character the first time it occurs'''
+        from pylatexenc import latexencode  # Only needed for LaTeX reports
+        char = chr(code)
+        if char == 'Ⅱ':
+            latex = 'II'
+        else:
+            latex = latexencode.unicode_to_latex(char)
+            if latex.startswith('\\') and latex[-1].isalpha():
+                latex += '{}'  # Terminate the macro, so that it is not continued by the following letters
+        self[code] = latex
+        return latex
+
+class LatexReport:
+
+    extension = '.tex'
+    colors = {'gene': 'blue!30', 'toxin': 'red!30', 'keyw': 'OliveGreen!30'}
+    escapes = LatexEscapes()
+
+    def escape(self, text):
+        return text.translate(self.escapes)
+
+    def mark(self, escaped, category):
+        return '\\colorbox{%s}{%s}' % (self.colors[category], escaped)
+
+    def header(self):
+        return '\n'.join(['\\documentclass{article}',
+                          '\\usepackage[T1]{fontenc}',
+                          '\\usepackage[utf8]{inputenc}',
+                          '\\usepackage{lmodern}',
+                          '\\usepackage{textcomp}',
+                          '\\usepackage[tmargin=2cm,lmargin=2cm,bmargin=2cm,rmargin=2cm]{geometry}',
+                          '\\usepackage{helvet}',
+                          '\\usepackage[rgb,dvipsnames]{xcolor}',
+                          '\\renewcommand{\\familydefault}{\\sfdefault}',
+                          '\\begin{document}',
+                          '\\section{Results of literature mining}', ''])
+
+    def article(self, title, info_lines, main_text):
+        return '\\subsection{%s}\n%s\n\n%s\n\n' % (self.escape(title), '\n\n'.join(self.escape(line) for line in info_lines), main_text)
+
+    def footer(self):
+        return '\\end{document}\n'
+
+class HTMLReport:
+
+    extension = '.html'
+    colors = {'gene': '#b3b3ff', 'toxin': '#ffb3b3', 'keyw': '#c6e0a8'}
+
+    def escape(self, text):
+        return html.escape(text, quote=False)
+
+    def mark(self, escaped, category):
+        return '<mark class="%s">%s</mark>' % (category, escaped)
+
+    def header(self):
+        style = ' '.join('mark.%s {background: %s;}' % item for item in self.colors.items())
+        return ('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>Results of literature mining</title>\n'
+                '<style>body {font-family: sans-serif; max-width: 60em; margin: 2em auto;} %s</style>\n'
+                '</head>\n<body>\n<h1>Results of literature mining</h1>\n' % style)
+
+    def article(self, title, info_lines, main_text):
+        paragraphs = ''.join('<p>%s</p>\n' % paragr for paragr in main_text.split('\n\n'))
+        return '<h2>%s</h2>\n%s%s' % (self.escape(title), ''.join('<p>%s</p>\n' % self.escape(line) for line in info_lines), paragraphs)
+
+    def footer(self):
+        return '</body>\n</html>\n'
+
+def is_results_file(fn):
+    '''Tell results files from the other JSON and SQLite files the mining script writes to the output folder (metrics, manifests, duplicates, delta state, work queues)'''
+    return fn.endswith(('.json', '.sqlite')) and not re.search(r'(\.(metrics|manifest|duplicates|queue)\.(json|sqlite)|delta_state\.json)$', fn)
+
+def report_name(results_fn, args):
+    '''Name of the report of a results file; the JSON file and the result store of a run share it'''
+    return os.path.join(args.outfolder or os.path.dirname(results_fn), re.sub(r'\.(json|sqlite)$', '', os.path.basename(results_fn)) + (LatexReport.extension if args.format == 'latex' else HTMLReport.extension))
+
+@functools.lru_cache(maxsize=1)
+def mining_script():
+    '''Import the mining script as a module, for its reader of result stores'''
+    import importlib.util  # Only needed for result stores
+    import sys
+    spec = importlib.util.spec_from_file_location('litMiningPubmed_conductMining', os.path.join(os.path.dirname(os.path.abspath(__file__)), '01_litMiningPubmed_conductMining.py'))
+    if spec.name not in sys.modules:
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[spec.name]
+
+def iter_results(results_fn):
+    '''Yield (uid, article) of the articles with hits of a results file; result stores (.sqlite) are read one article at a time, by the ResultStore of the mining script'''
+    if not results_fn.endswith('.sqlite'):
+        with open(results_fn, 'r') as file:
+            masterDict = json.load(file)
+        masterDict.pop('pubmed_query', None)
+        yield from masterDict.items()
+        return
+    store = mining_script().ResultStore(results_fn)
+    yield from store.iter_articles(hits_only=True)
+    store.close()
+
+def write_report(results_fn, report_fn, report_format, keywords):
+    '''Write the highlighted result paragraphs of all articles with hits in a results file; returns the number of articles'''
+    report = LatexReport() if report_format == 'latex' else HTMLReport()
+    highlighter = HighlightOps(tuple(keywords))
+    n_articles = 0
+    tmp_fn = report_fn + '.tmp'
+    with open(tmp_fn, 'w') as report_file:
+        report_file.write(report.header())
+        for uid, article in iter_results(results_fn):
+            if article.get('article_result_paragraphs'):
+                info_lines = ['Year: %s | PubMed ID: %s | PubMedCentral ID: %s' % ((article.get('article_publdate') or {}).get('Year'), article.get('article_pmid'), article.get('article_pmcid')),  # Ingested articles may lack a date
+                              'Keywords: %s' % ', '.join(article.get('article_keywords') or []),
+                              'MeSH: %s' % ', '.join(article.get('article_mesh') or [])]
+                # Fuse all paragraphs into single string
+                main_text = '\n\n'.join(article['article_result_paragraphs'])
+                if article.get('article_result_spans') is not None:
+                    spans = highlighter.join_spans(article['article_result_paragraphs'], article['article_result_spans'], '\n\n')
+                else:
+                    spans = highlighter.find_spans(main_text, article['found_genes'], article['found_toxins'])  # Results files written before the spans were stored
+                report_file.write(report.article(article['article_title'], info_lines,
+                                                 highlighter.highlight(main_text, spans, report.escape, report.mark)))
+                n_articles += 1
+        report_file.write(report.footer())
+    os.replace(tmp_fn, report_fn)
+    return n_articles
+
+def process_file(task):
+    '''Write the report of one results file, optionally compiling it to PDF; runs in a worker process'''
+    results_fn, args = task
+    report_fn = report_name(results_fn, args)
+    n_articles = write_report(results_fn, report_fn, args.format, args.keywords)
+    if args.pdf and args.format == 'latex':
+        subprocess.run(["pdflatex", "-interaction=nonstopmode", "-output-directory", os.path.dirname(report_fn) or '.', report_fn],
+                       stderr=subprocess.DEVNULL,
+                       stdout=subprocess.DEVNULL)
+    return report_fn, n_articles
+
+
+def main(args):
+
+    ### STEP 1. Getting variables
+    results_fns, skipped_fns = {}, []
+    for pattern in args.infiles:
+        for results_fn in sorted(glob.glob(pattern)) or [pattern]:
+            if not is_results_file(results_fn):
+                skipped_fns.append(results_fn)
+                continue
+            # One report per run: the result store is preferred to the JSON file with the same results
+            report_fn = report_name(results_fn, args)
+            if report_fn not in results_fns or results_fn.endswith('.sqlite'):
+                results_fns[report_fn] = results_fn
+    results_fns = list(results_fns.values())
+    if args.outfolder:
+        os.makedirs(args.outfolder, exist_ok=True)
+
+    ### STEP 2. Set up logger
+    log = logging.getLogger(__name__)
+    if args.verbose:
+        coloredlogs.install(fmt='%(asctime)s [%(levelname)s] %(message)s', level=logging.DEBUG, logger=log)
+    else:
+        coloredlogs.install(fmt='%(asctime)s [%(levelname)s] %(message)s', level=logging.INFO, logger=log)
+
+    if skipped_fns:
+        log.info("skipping %s files that are not results files, e.g. %s" % (len(skipped_fns), skipped_fns[0]))
+
+    ### STEP 3. Writing the reports, one results file per worker process
+    action = "writing %s reports of %s results files" % (args.format, len(results_fns))
+    log.info("%s" % action)
+    tasks = [(results_fn, args) for results_fn in results_fns]
+    if args.workers > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(min(args.workers, len(tasks))) as pool:
+            for report_fn, n_articles in pool.imap(process_file, tasks):
+                log.info("%s: %s articles with hits" % (report_fn, n_articles))
+    else:
+        for task in tasks:
+            report_fn, n_articles = process_file(task)
+            log.info("%s: %s articles with hits" % (report_fn, n_articles))
+
+
+def parse_args(argv=None):
+    '''Parse the command line arguments'''
+    parser = argparse.ArgumentParser(description='Author|Version: '+__version__)
+    parser.add_argument("infiles", type=str, nargs='+',
+                        help="Results files of the mining script, JSON or SQLite (or glob patterns thereof)")
+    parser.add_argument("--format", "-f", type=str, required=False,
+                        default="latex", choices=["latex", "html"],
+                        help="(Optional) Format of the reports")
+    parser.add_argument("--outfolder", "-o", type=str, required=False,
+                        default=None,
+                        help="(Optional) Name of the output folder (default: the folder of each results file)")
+    parser.add_argument("--keywords", "-k", type=str, nargs='+', required=False,
+                        default=['gene'],
+                        help="(Optional) Keywords to highlight in results files without stored spans; otherwise, the spans found by the mining script are highlighted")
+    parser.add_argument("--workers", "-w", type=int, required=False,
+                        default=os.cpu_count() or 1,
+                        help="(Optional) Number of worker processes, each writing the reports of different results files")
+    parser.add_argument("--pdf", action="store_true", required=False,
+                        default=False,
+                        help="(Optional) Compile the LaTeX reports to PDF with pdflatex")
+    parser.add_argument("--verbose", "-v", action="store_true", required=False,
+                        default=False, help="(Optional) Enable verbose logging")
+    return parser.parse_args(argv)
+
+#-----------------------------------------------------------------#
+# MAIN
+
+if __name__ == "__main__":
+    main(parse_args())
+
+#-----------------------------------------------------------------#
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+'''Local stand-in for the NCBI E-utilities, BioC and PubReader services, serving a synthetic corpus'''
+
+#-----------------------------------------------------------------#
+## IMPORTS
+import argparse
+import http.server
+import json
+import random
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+#-----------------------------------------------------------------#
+# CLASSES AND FUNCTIONS
+
+class SyntheticCorpus:
+
+    vocabulary = ('the of and in a to was were with for by is that on as from this protein cluster expression '
+                  'synthesis pathway strain culture deletion mutant transcription regulation biosynthetic '
+                  'production isolate medium growth analysis sequence domain encoded putative').split()
+    months = ['Jan', 'Mar', 'Jul', 'Dec']
+
+    def __init__(self, n_articles, n_names, seed=1):
+        '''Generate dictionaries of toxin and gene names and a corpus of articles mentioning them'''
+        rnd = random.Random(seed)
+        n_toxins = max(1, n_names // 10)
+        self.toxins = self.make_names(rnd, n_toxins, 'toxin')
+        self.genes = self.make_names(rnd, n_names - n_toxins, 'gene')
+        self.articles = []
+        for i in range(n_articles):
+            paragraphs = []
+            for j in range(rnd.randint(8, 30)):
+                words = [rnd.choice(self.vocabulary) for _ in range(rnd.randint(40, 160))]
+                if rnd.random() < 0.5:
+                    words.insert(rnd.randrange(len(words)), rnd.choice(self.genes))
+                if rnd.random() < 0.4:
+                    words.insert(rnd.randrange(len(words)), rnd.choice(self.toxins))
+                if rnd.random() < 0.6:
+                    words.insert(rnd.randrange(len(words)), rnd.choice(['gene', 'gene,', 'gene;']))
+                paragraphs.append(' '.join(words) + '.')
+            self.articles.append({'pmid': str(30000000 + i),
+                                  'pmcid': 'PMC%d' % (7000000 + i) if i % 5 != 4 else None,  # Every fifth article has no PubMedCentral copy
+                                  'format': 'bioc' if i % 3 else 'pubreader',  # Every third full text is only available as PubReader HTML
+                                  'title': 'Article %d on toxins and their genes' % i,
+                                  'year': 2000 + (i * 7) % 22,
+                                  'month': self.months[i % 4],
+                                  'edat': '2020/01/%02d' % (1 + i % 28),
+                                  'paragraphs': paragraphs})
+        self.by_pmid = {article['pmid']: article for article in self.articles}
+        self.by_pmcid = {article['pmcid']: article for article in self.articles if article['pmcid']}
+
+    @staticmethod
+    def make_names(rnd, n_names, kind):
+        '''Generate unique pseudo names that resemble toxin names (e.g., `kazorotoxin`) or gene names (e.g., `kzrB12`)'''
+        letters = 'abcdefghijklmnopqrstuvwxyz'
+        names = set()
+        while len(names) < n_names:
+            if kind == 'toxin':
+                names.add(''.join(rnd.choice(letters) for _ in range(rnd.randint(4, 9))) + rnd.choice(['toxin', 'mycin', 'enol', 'in']))
+            else:
+                names.add(''.join(rnd.choice(letters) for _ in range(3)) + rnd.choice(letters).upper() + str(rnd.randint(1, 99)))
+        return sorted(names)
+
+    def write_dictionaries(self, toxin_fn, gene_fn, excl_fn):
+        '''Write the dictionaries in the format of the toxin, gene/product and exclusion files'''
+        with open(toxin_fn, "w") as outfile:
+            outfile.write('\n'.join(self.toxins) + '\n')
+        with open(gene_fn, "w") as outfile:
+            outfile.write('\n'.join(self.genes) + '\n')
+        with open(excl_fn, "w") as outfile:
+            outfile.write('# Names excluded from the gene/product list\n' + '\n'.join(self.genes[:max(1, len(self.genes) // 100)]) + '\n')
+
+class Responses:
+
+    @staticmethod
+    def escape(text):
+        return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+    @staticmethod
+    def esearch(uids, retstart, retmax, webenv=None):
+        history = '<QueryKey>1</QueryKey><WebEnv>%s</WebEnv>' % webenv if webenv else ''
+        return ('<?xml version="1.0" encoding="UTF-8" ?>\n<!DOCTYPE eSearchResult PUBLIC "-//NLM//DTD esearch 20060628//EN" "https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20060628/esearch.dtd">\n'
+                '<eSearchResult><Count>%d</Count><RetMax>%d</RetMax><RetStart>%d</RetStart>%s<IdList>%s</IdList><TranslationSet/><QueryTranslation>benchmark</QueryTranslation></eSearchResult>'
+                % (len(uids), len(uids[retstart:retstart+retmax]), retstart, history, ''.join('<Id>%s</Id>' % uid for uid in uids[retstart:retstart+retmax])))
+
+    @staticmethod
+    def epost(webenv):
+        return ('<?xml version="1.0" encoding="UTF-8" ?>\n<!DOCTYPE ePostResult PUBLIC "-//NLM//DTD epost 20090526//EN" "https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20090526/epost.dtd">\n'
+                '<ePostResult><QueryKey>1</QueryKey><WebEnv>%s</WebEnv></ePostResult>' % webenv)
+
+    @staticmethod
+    def efetch(articles):
+        out = ['<?xml version="1.0" ?>\n<!DOCTYPE PubmedArticleSet PUBLIC "-//NLM//DTD PubMedArticle, 1st January 2019//EN" "https://dtd.nlm.nih.gov/ncbi/pubmed/out/pubmed_190101.dtd">\n<PubmedArticleSet>']
+        for article in articles:
+            out.append('<PubmedArticle><MedlineCitation Status="MEDLINE" Owner="NLM"><PMID Version="1">%s</PMID><Article PubModel="Print"><Journal><JournalIssue CitedMedium="Internet">'
+                       '<PubDate><Year>%d</Year><Month>%s</Month></PubDate></JournalIssue><Title>Journal</Title></Journal><ArticleTitle>%s</ArticleTitle><AuthorList/><Language>eng</Language>'
+                       '<PublicationTypeList><PublicationType UI="D016428">Journal Article</PublicationType></PublicationTypeList></Article><MedlineJournalInfo><MedlineTA>J</MedlineTA><NlmUniqueID>1</NlmUniqueID></MedlineJournalInfo>'
+                       '<MeshHeadingList><MeshHeading><DescriptorName UI="D009183" MajorTopicYN="N">Mycotoxins</DescriptorName></MeshHeading></MeshHeadingList>'
+                       '<KeywordList Owner="NOTNLM"><Keyword MajorTopicYN="N">toxin</Keyword><Keyword MajorTopicYN="N">gene</Keyword></KeywordList></MedlineCitation>'
+                       '<PubmedData><PublicationStatus>ppublish</PublicationStatus></PubmedData></PubmedArticle>'
+                       % (article['pmid'], article['year'], article['month'], Responses.escape(article['title'])))
+        out.append('</PubmedArticleSet>')
+        return '\n'.join(out)
+
+    @staticmethod
+    def elink(uids, by_pmid):
+        linksets = []
+        for uid in uids:
+            article = by_pmid.get(uid)
+            linksetdb = ''
+            if article and article['pmcid']:
+                linksetdb = '<LinkSetDb><DbTo>pmc</DbTo><LinkName>pubmed_pmc</LinkName><Link><Id>%s</Id></Link></LinkSetDb>' % article['pmcid'][3:]
+            linksets.append('<LinkSet><DbFrom>pubmed</DbFrom><IdList><Id>%s</Id></IdList>%s</LinkSet>' % (uid, linksetdb))
+        return ('<?xml version="1.0" encoding="UTF-8" ?>\n<!DOCTYPE eLinkResult PUBLIC "-//NLM//DTD elink 20101123//EN" "https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20101123/elink.dtd">\n'
+                '<eLinkResult>%s</eLinkResult>' % ''.join(linksets))
+
+    @staticmethod
+    def bioc(article):
+        out = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?><!DOCTYPE collection SYSTEM "BioC.dtd"><collection><source>PMC</source><date>20220101</date><key>pmc.key</key><document><id>%s</id>' % article['pmcid'][3:]]
+        def passage(section_type, passage_type, text):
+            out.append('<passage><infon key="section_type">%s</infon><infon key="type">%s</infon><offset>0</offset><text>%s</text></passage>' % (section_type, passage_type, Responses.escape(text)))
+        passage('TITLE', 'front', article['title'])
+        for num, paragr in enumerate(article['paragraphs']):
+            if num % 6 == 0:
+                passage('RESULTS', 'title_2', 'Section %d' % num)
+            passage('INTRO' if num < 2 else 'RESULTS', 'paragraph', paragr)
+        passage('FIG', 'fig_caption', article['paragraphs'][0])
+        passage('TABLE', 'table', article['paragraphs'][-1])
+        passage('REF', 'ref', 'Reference about a gene')
+        passage('ACK_FUND', 'paragraph', 'We thank the gene sequencing facility.')
+        out.append('</document></collection>')
+        return ''.join(out)
+
+    @staticmethod
+    def pubreader(article):
+        out = ['<!DOCTYPE html><html><head><title>%s</title></head><body><div class="header"><p>Navigation gene</p></div>' % Responses.escape(article['title']),
+               '<article data-type="main"><div class="fm-sec"><p>Front matter</p></div><div class="tsec sec" id="sec1"><h2>Results</h2>']
+        for paragr in article['paragraphs']:
+            out.append('<p>%s</p>' % Responses.escape(paragr))
+        out.append('</div><div class="tsec sec" id="ack-1"><p>We thank the gene sequencing facility.</p></div>'
+                   '<div class="tsec sec" id="ref-list-1"><p>Reference about a gene</p></div><div id="fn-group-1"><p>Footnote</p></div></article></body></html>')
+        return ''.join(out)
+
+class MockNCBIHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    corpus = None
+    latency = 0.0
+    error_rate = 0.0
+    rng = random.Random(1)  # Draws the injected errors reproducibly
+    webenvs = {}
+    counts = {}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, code, body, content_type='text/xml'):
+        body = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.handle_request(urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.handle_request(urllib.parse.parse_qs(self.rfile.read(length).decode('utf-8')))
+
+    def handle_request(self, params):
+        '''Dispatch a request by endpoint, after the injected latency and with the injected error rate'''
+        params = {key.lower(): value for key, value in params.items()}
+        path = urllib.parse.urlparse(self.path).path
+        if path == '/_stats':
+            return self.send(200, json.dumps(self.counts), 'application/json')
+        endpoint = path.rsplit('/', 1)[-1] if '/eutils/' in path else ('bioc' if 'BioC_xml' in path else 'pubreader')
+        with self.lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            inject_error = self.error_rate and self.rng.random() < self.error_rate
+            if inject_error:
+                self.counts['injected_errors'] = self.counts.get('injected_errors', 0) + 1
+        if inject_error:
+            return self.send(503, 'Service unavailable', 'text/plain')
+        corpus = self.corpus
+        if endpoint == 'esearch.fcgi':
+            uids = [article['pmid'] for article in corpus.articles]
+            if 'mindate' in params:
+                uids = [article['pmid'] for article in corpus.articles if params['mindate'][0] <= article['edat'] <= params.get('maxdate', ['9999/99/99'])[0]]
+            webenv = None
+            if params.get('usehistory', ['n'])[0] == 'y':
+                webenv = self.store_webenv(uids)
+            return self.send(200, Responses.esearch(uids, int(params.get('retstart', ['0'])[0]), int(params.get('retmax', ['20'])[0]), webenv))
+        if endpoint == 'epost.fcgi':
+            # Like the history server, keep a posted set sorted by descending uid instead of in the posted order
+            posted_uids = sorted(set(','.join(params.get('id', [])).split(',')), key=int, reverse=True)
+            return self.send(200, Responses.epost(self.store_webenv(posted_uids)))
+        if endpoint == 'efetch.fcgi':
+            if 'webenv' in params:
+                retstart = int(params.get('retstart', ['0'])[0])
+                uids = self.webenvs[params['webenv'][0]][retstart:retstart+int(params.get('retmax', ['10000'])[0])]
+            else:
+                uids = ','.join(params.get('id', [])).split(',')
+            if params.get('rettype', [''])[0] == 'uilist':
+                return self.send(200, ''.join(uid + '\n' for uid in uids), 'text/plain')
+            return self.send(200, Responses.efetch([corpus.by_pmid[uid] for uid in uids if uid in corpus.by_pmid]))
+        if endpoint == 'elink.fcgi':
+            return self.send(200, Responses.elink([uid for value in params.get('id', []) for uid in value.split(',')], corpus.by_pmid))
+        if endpoint == 'bioc':
+            article = corpus.by_pmcid.get(path.split('BioC_xml/')[1].split('/')[0])
+            if article and article['format'] == 'bioc':
+                return self.send(200, Responses.bioc(article))
+            return self.send(404, 'No result can be found.', 'text/plain')
+        if '/pmc/articles/' in path:
+            article = corpus.by_pmcid.get(path.split('/pmc/articles/')[1].split('/')[0])
+            if article:
+                return self.send(200, Responses.pubreader(article), 'text/html')
+        self.send(404, 'Not found', 'text/plain')
+
+    def store_webenv(self, uids):
+        with self.lock:
+            webenv = 'MCID_%d' % len(self.webenvs)
+            self.webenvs[webenv] = uids
+        return webenv
+
+def start_server(corpus, latency=0.0, error_rate=0.0, port=0, seed=1):
+    '''Serve the corpus on localhost in a background thread; returns the server'''
+    MockNCBIHandler.corpus = corpus
+    MockNCBIHandler.rng = random.Random(seed)
+    MockNCBIHandler.latency = latency
+    MockNCBIHandler.error_rate = error_rate
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), MockNCBIHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def redirect_urlopen(port):
+    '''Redirect requests to the NCBI hosts, by Bio.Entrez and by urllib, to the local server'''
+    import Bio.Entrez
+    urlopen = urllib.request.urlopen
+    base_url = 'http://127.0.0.1:%d' % port
+    def rewrite(url):
+        for prefix in ('https://eutils.ncbi.nlm.nih.gov', 'https://www.ncbi.nlm.nih.gov'):
+            if url.startswith(prefix):
+                return base_url + url[len(prefix):]
+        return url
+    def local_urlopen(request, *args, **kwargs):
+        if isinstance(request, str):
+            request = rewrite(request)
+        else:
+            request.full_url = rewrite(request.full_url)
+        return urlopen(request, *args, **kwargs)
+    urllib.request.urlopen = local_urlopen
+    Bio.Entrez.urlopen = local_urlopen
+
+#-----------------------------------------------------------------#
+# MAIN
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve a synthetic corpus in place of the NCBI services')
+    parser.add_argument("--articles", "-n", type=int, required=False,
+                        default=100, help="(Optional) Number of articles in the corpus")
+    parser.add_argument("--names", type=int, required=False,
+                        default=1000, help="(Optional) Number of toxin and gene names in the dictionaries")
+    parser.add_argument("--seed", type=int, required=False,
+                        default=1, help="(Optional) Seed of the corpus generator")
+    parser.add_argument("--latency", type=float, required=False,
+                        default=0.0, help="(Optional) Delay in seconds added to every response")
+    parser.add_argument("--error_rate", type=float, required=False,
+                        default=0.0, help="(Optional) Fraction of requests answered with HTTP 503")
+    parser.add_argument("--port", type=int, required=False,
+                        default=0, help="(Optional) Port to listen on; a free port by default")
+    args = parser.parse_args()
+    server = start_server(SyntheticCorpus(args.articles, args.names, args.seed), args.latency, args.error_rate, args.port, args.seed)
+    print(server.server_address[1], flush=True)  # Tells the benchmark runner where to connect
+    try:
+        sys.stdin.read()  # Serve until the runner closes stdin
+    finally:
+        server.shutdown()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+'''Run the mining script end to end against the local NCBI stand-in and report wall time, per-stage throughput (from the run metrics) and peak RSS as JSON'''
+
+#-----------------------------------------------------------------#
+## IMPORTS
+import argparse
+import datetime
+import glob
+import importlib.util
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import mock_ncbi
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT_FN = os.path.join(os.path.dirname(BENCHMARK_DIR), '01_litMiningPubmed_conductMining.py')
+
+#-----------------------------------------------------------------#
+# CLASSES AND FUNCTIONS
+
+def load_mining_script():
+    '''Import the mining script as a module; it is registered in sys.modules so that worker processes can unpickle its functions'''
+    spec = importlib.util.spec_from_file_location('litMiningPubmed_conductMining', SCRIPT_FN)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def run_case(case):
+    '''Run one benchmark case in this process and return its measurements'''
+    mining = load_mining_script()
+    mock_ncbi.redirect_urlopen(case['port'])
+    workdir = case['workdir']
+    argv = ['--query', 'benchmark', '--mail', 'benchmark@example.org',
+            '--toxinDB_fname', os.path.join(workdir, 'toxins.txt'),
+            '--geneProdDB_fname', os.path.join(workdir, 'genes.txt'),
+            '--geneProdExcl_fname', os.path.join(workdir, 'excluded.txt'),
+            '--outfolder', os.path.join(workdir, 'output') + os.sep,
+            '--cachefolder', os.path.join(workdir, 'cache') + os.sep] + case['mining_args']
+    args = mining.parse_args(argv)
+    start = time.perf_counter()
+    mining.main(args)
+    wall = time.perf_counter() - start
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    output_fn = glob.glob(os.path.join(workdir, 'output', '*.jsonl'))[0][:-len('.jsonl')]
+    with open(output_fn + '.json', "r") as json_file:
+        output = json.load(json_file)
+    output.pop('pubmed_query')
+    with open(output_fn + '.metrics.json', "r") as json_file:
+        metrics = json.load(json_file)
+    stages = {}
+    for name, timing in metrics['timings'].items():
+        if name.startswith('stage_'):
+            stages[name[len('stage_'):]] = {'items': timing['count'],
+                                            'busy_s': timing['sum_s'],
+                                            'active_s': timing['active_s'],
+                                            'items_per_s': round(timing['count'] / timing['active_s'], 2) if timing['active_s'] else None}
+    return {'wall_s': round(wall, 3),
+            'articles_per_s': round(case['articles'] / wall, 2),
+            'peak_rss_mb': round(peak_rss_kb / 1024, 1),  # ru_maxrss is in kilobytes on Linux
+            'articles_with_fulltext': sum(1 for article in output.values() if 'n_fulltext_paragr' in article),
+            'articles_with_hits': sum(1 for article in output.values() if article.get('article_result_paragraphs')),
+            'stages': stages,
+            'timings': {name: {key: timing[key] for key in ('count', 'sum_s', 'mean_s', 'max_s')} for name, timing in metrics['timings'].items() if not name.startswith('stage_')},
+            'counters': metrics['counters']}
+
+def benchmark(n_articles, n_names, settings, label):
+    '''Serve a synthetic corpus from a separate process and run the mining script against it in another'''
+    with tempfile.TemporaryDirectory(prefix='litMining_benchmark_') as workdir:
+        corpus = mock_ncbi.SyntheticCorpus(0, n_names, settings['seed'])
+        corpus.write_dictionaries(os.path.join(workdir, 'toxins.txt'), os.path.join(workdir, 'genes.txt'), os.path.join(workdir, 'excluded.txt'))
+        server = subprocess.Popen([sys.executable, os.path.join(BENCHMARK_DIR, 'mock_ncbi.py'),
+                                   '--articles', str(n_articles), '--names', str(n_names), '--seed', str(settings['seed']),
+                                   '--latency', str(settings['latency']), '--error_rate', str(settings['error_rate'])],
+                                  stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        try:
+            port = int(server.stdout.readline())
+            case = {'articles': n_articles, 'port': port, 'workdir': workdir, 'mining_args': settings['mining_args']}
+            with open(os.path.join(workdir, 'mining.log'), "w") as log_file:
+                result = subprocess.run([sys.executable, os.path.abspath(__file__), '--case', json.dumps(case)],
+                                        stdout=subprocess.PIPE, stderr=log_file, text=True)
+            if result.returncode != 0:
+                with open(os.path.join(workdir, 'mining.log'), "r") as log_file:
+                    sys.stderr.write(log_file.read()[-5000:])
+                raise RuntimeError("benchmark case with %s articles and %s names failed" % (n_articles, n_names))
+            measurements = json.loads(result.stdout.strip().splitlines()[-1])
+            with urllib.request.urlopen('http://127.0.0.1:%d/_stats' % port) as response:
+                measurements['requests'] = json.load(response)
+        finally:
+            server.stdin.close()
+            server.wait()
+    return dict({'label': label, 'articles': n_articles, 'names': n_names}, **measurements)
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(SCRIPT_FN), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+#-----------------------------------------------------------------#
+# MAIN
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the mining script against a local stand-in for the NCBI services')
+    parser.add_argument("--articles", "-n", type=int, nargs='+', required=False,
+                        default=[100, 1000, 10000], help="(Optional) Corpus sizes to benchmark")
+    parser.add_argument("--names", type=int, nargs='+', required=False,
+                        default=[1000, 10000, 100000], help="(Optional) Dictionary sizes (toxin and gene names) to benchmark")
+    parser.add_argument("--latency", type=float, required=False,
+                        default=0.0, help="(Optional) Delay in seconds added to every response of the stand-in")
+    parser.add_argument("--error_rate", type=float, required=False,
+                        default=0.0, help="(Optional) Fraction of requests the stand-in answers with HTTP 503")
+    parser.add_argument("--seed", type=int, required=False,
+                        default=1, help="(Optional) Seed of the corpus generator and of the injected errors")
+    parser.add_argument("--label", type=str, required=False,
+                        default=None, help="(Optional) Label stored with the results, e.g. a branch name")
+    parser.add_argument("--output", "-o", type=str, required=False,
+                        default=None, help="(Optional) Path to the JSON results file; printed to stdout by default")
+    parser.add_argument("--case", type=str, required=False,
+                        default=None, help=argparse.SUPPRESS)  # Internal: run a single case in this process
+    args, mining_args = parser.parse_known_args()  # Unknown arguments (e.g., --workers 4) are passed on to the mining script
+
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case))))
+        sys.exit(0)
+
+    mining_args = ['--rate', '1000'] + mining_args  # No NCBI request limit applies to the stand-in, unless overridden
+    settings = {'seed': args.seed, 'latency': args.latency, 'error_rate': args.error_rate, 'mining_args': mining_args}
+    results = {'benchmark': 'litMiningPubmed_conductMining',
+               'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+               'git_commit': git_commit(),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'cpus': os.cpu_count(),
+               'settings': settings,
+               'cases': []}
+    for n_articles, n_names in itertools.product(args.articles, args.names):
+        case_result = benchmark(n_articles, n_names, settings, args.label)
+        print("%s articles, %s names: %.1f s, %.1f articles/s, %.0f MB peak RSS"
+              % (n_articles, n_names, case_result['wall_s'], case_result['articles_per_s'], case_result['peak_rss_mb']), file=sys.stderr)
+        results['cases'].append(case_result)
+    if args.output:
+        with open(args.output, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
@@ -0,0 +1,36 @@
+'''Shared fixtures of the tests of the mining script'''
+import importlib.util
+import os
+import sys
+
+import urllib.request
+
+import Bio.Entrez
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT_FN = os.path.join(os.path.dirname(TESTS_DIR), '01_litMiningPubmed_conductMining.py')
+sys.path.insert(0, os.path.join(os.path.dirname(TESTS_DIR), 'benchmarks'))  # The stand-in for the NCBI services
+import mock_ncbi
+
+
+@pytest.fixture(scope='session')
+def mining():
+    '''The mining script, imported as a module; registered in sys.modules so that worker processes can unpickle its functions'''
+    spec = importlib.util.spec_from_file_location('litMiningPubmed_conductMining', SCRIPT_FN)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def ncbi():
+    '''A synthetic corpus served in place of the NCBI services, for the duration of one test'''
+    urlopens = urllib.request.urlopen, Bio.Entrez.urlopen
+    corpus = mock_ncbi.SyntheticCorpus(60, 200, 1)
+    server = mock_ncbi.start_server(corpus)
+    mock_ncbi.redirect_urlopen(server.server_address[1])
+    yield corpus
+    urllib.request.urlopen, Bio.Entrez.urlopen = urlopens
+    server.shutdown()
@@ -0,0 +1,69 @@
+'''The co-occurrence rules of toxin and gene names: sentence splitting, whole-word hits and the size of the windows'''
+import re
+
+import pytest
+
+KEYWORDS = [' gene ', ' gene,', ' gene.', ' genes ']
+
+
+@pytest.mark.parametrize('text, sentences', [
+    ('See Fig. 2 for the gene.', [0, 0, 0, 0, 0, 0]),
+    ('Toxins, e.g. The aflatoxins, are made.', [0, 0, 0, 0, 0, 0, 0]),
+    ('As shown by Smith et al. The gene is known.', [0, 0, 0, 0, 0, 0, 0, 0, 0, 0]),
+    ('Version 2.0 of the gene', [0, 0, 0, 0, 0, 0]),
+    ('The gene is here. The toxin is there.', [0, 0, 0, 0, 1, 1, 1, 1]),
+    ('Is it? Yes! 2 genes.', [0, 0, 1, 2, 2]),
+    ('It ends with "the gene." Then a toxin.', [0, 0, 0, 0, 0, 1, 1, 1]),
+    ('The toxin is made. tri5 follows in lower case.', [0, 0, 0, 0, 0, 0, 0, 0, 0]),
+])
+def test_tokenize_sentences(mining, text, sentences):
+    starts, ends, token_sentences, keyword_spans = mining.CooccurrenceRule('sentence', 0, KEYWORDS).tokenize(text)
+    assert token_sentences == sentences
+    assert [text[start:end] for start, end in zip(starts, ends)] == re.findall(r'\w+', text)
+
+
+@pytest.mark.parametrize('text, keywords', [
+    ('The gene, the gene. The genes.', ['gene', 'gene', 'genes']),  # Found as word tokens, whatever the punctuation of the variant
+    ('No keyword in engineered genetics', []),
+])
+def test_tokenize_keywords(mining, text, keywords):
+    keyword_spans = mining.CooccurrenceRule('sentence', 0, KEYWORDS).tokenize(text)[3]
+    assert [text[start:end] for start, end, kind in keyword_spans] == keywords
+
+
+@pytest.mark.parametrize('window, window_size, text, expected', [
+    # Substring: anywhere, also within words
+    ('substring', None, 'Aflatoxins are made by tri5.', ({'aflatoxin'}, {'tri5'})),
+    ('substring', None, 'Aflatoxin only.', None),
+    # Paragraph: whole words anywhere
+    ('paragraph', None, 'Aflatoxins are made by tri5.', None),
+    ('paragraph', None, 'Aflatoxin is made. Much later, tri5 is found.', ({'aflatoxin'}, {'tri5'})),
+    ('paragraph', None, 'Aflatoxin is made by tri5s.', None),
+    # Tokens: at most window_size tokens between the hits
+    ('tokens', 0, 'aflatoxin tri5', ({'aflatoxin'}, {'tri5'})),
+    ('tokens', 0, 'aflatoxin by tri5', None),
+    ('tokens', 2, 'tri5 makes some aflatoxin', ({'aflatoxin'}, {'tri5'})),
+    ('tokens', 2, 'tri5 makes some more aflatoxin', None),
+    ('tokens', 1, 'The T-2 toxin of tri5', ({'T-2 toxin'}, {'tri5'})),  # A name of several tokens counts from its last token
+    ('tokens', 1, 'tri5 and the T-2 toxin', None),
+    # Sentence: within window_size sentences of each other
+    ('sentence', 0, 'Aflatoxin, see Fig. 2, needs tri5.', ({'aflatoxin'}, {'tri5'})),
+    ('sentence', 0, 'Toxins, e.g. The aflatoxin, need tri5.', ({'aflatoxin'}, {'tri5'})),
+    ('sentence', 0, 'Aflatoxin is made. Tri5 is a gene.', None),
+    ('sentence', 1, 'Aflatoxin is made. Tri5 is a gene.', ({'aflatoxin'}, {'tri5'})),
+    ('sentence', 1, 'Aflatoxin is made. Then more. Tri5 is a gene.', None),
+    ('sentence', 2, 'Aflatoxin is made. Then more. Tri5 is a gene.', ({'aflatoxin'}, {'tri5'})),
+])
+def test_evaluate(mining, window, window_size, text, expected):
+    rule = mining.CooccurrenceRule(window, window_size, KEYWORDS)
+    matcher = mining.DictMatcher(['aflatoxin', 'T-2 toxin'], ['tri5'], rule)
+    result = rule.evaluate(text, matcher.find_spans(text))
+    assert (result[:2] if result else None) == expected
+
+
+def test_evaluate_spans(mining):
+    rule = mining.CooccurrenceRule('sentence', 0, KEYWORDS)
+    matcher = mining.DictMatcher(['aflatoxin'], ['tri5'], rule)
+    text = 'The gene tri5 makes aflatoxin. Aflatoxin alone.'
+    toxins, genes, spans = rule.evaluate(text, matcher.find_spans(text))
+    assert [(text[start:end], kind) for start, end, kind in spans] == [('gene', 'keyw'), ('tri5', 'gene'), ('aflatoxin', 'toxin')]  # Not the hit outside the window
@@ -0,0 +1,37 @@
+'''Re-matching the paragraph index of a delta run gives the same results as the run itself, including the articles of earlier runs'''
+import glob
+import json
+import os
+
+
+def mining_args(workdir, *args):
+    return list(args) + ['--toxinDB_fname', os.path.join(workdir, 'toxins.txt'),
+                         '--geneProdDB_fname', os.path.join(workdir, 'genes.txt'),
+                         '--geneProdExcl_fname', os.path.join(workdir, 'excluded.txt'),
+                         '--outfolder', os.path.join(workdir, 'output') + os.sep,
+                         '--cachefolder', os.path.join(workdir, 'cache') + os.sep]
+
+
+def test_delta_index_holds_earlier_articles(mining, ncbi, tmp_path):
+    workdir = str(tmp_path)
+    ncbi.write_dictionaries(os.path.join(workdir, 'toxins.txt'), os.path.join(workdir, 'genes.txt'), os.path.join(workdir, 'excluded.txt'))
+    state_fn = os.path.join(workdir, 'output', 'litMiningPubmed_Results_delta_state.json')
+    for _ in range(2):  # The second run finds no new uids, so all of its articles come from the first
+        mining.main(mining.parse_args(mining_args(workdir, 'run', '--query', 'benchmark', '--mail', 'test@example.org', '--rate', '1000', '--delta', '--build_index')))
+    with open(state_fn, "r") as json_file:
+        results_fn = json.load(json_file)['benchmark']['results']
+    with open(results_fn, "r") as json_file:
+        results = json.load(json_file)
+    results.pop('pubmed_query')
+    assert sum(1 for article in results.values() if article.get('article_result_paragraphs'))
+
+    index_fn = results_fn[:-len('.json')] + '.index.pickle'
+    mining.main(mining.parse_args(mining_args(workdir, 'match', '--from_index', index_fn, '--outfn_stem', 'rematch_')))
+    rematch_fn, = glob.glob(os.path.join(workdir, 'output', 'rematch_*[0-9].json'))
+    with open(rematch_fn, "r") as json_file:
+        rematched = json.load(json_file)
+    rematched.pop('pubmed_query')
+    assert list(rematched) == list(results)
+    for uid, article in results.items():
+        for field in ('article_paragraphs_with_keyw', 'article_result_paragraphs', 'found_toxins', 'found_genes'):
+            assert rematched[uid].get(field) == article.get(field), (uid, field)
@@ -0,0 +1,59 @@
+'''Parity of the Aho-Corasick DictMatcher with the nested case-folded toxin by gene loop it replaced, on generated dictionaries and paragraphs'''
+import random
+
+import pytest
+
+ALPHABET = 'abcisß' + 'İıSK'  # Case folding changes the length of ß (ss) and İ (i̇)
+WORDS = ['gene', 'toxin', 'Strasse', 'STRASSE', 'straße', 'İstanbul', 'istanbul', 'Kelvin']
+
+
+def baseline(mining, toxinDB_list, geneProdDB_list, paragraphs):
+    '''The matching loop of the original mining script'''
+    result_paragraphs, found_genes, found_toxins = [], [], []
+    for paragr in paragraphs:
+        for toxin in toxinDB_list:
+            if toxin.casefold() in paragr.casefold():
+                for gene in geneProdDB_list:
+                    if gene.casefold() in paragr.casefold():
+                        result_paragraphs.append(paragr)
+                        found_toxins.append(toxin)
+                        found_genes.append(gene)
+    if not result_paragraphs:
+        return None, None, None
+    return mining.ParagrOps().remove_duplicate_paragraphs(result_paragraphs), sorted(set(found_toxins)), sorted(set(found_genes))
+
+
+def generate(seed):
+    rng = random.Random(seed)
+    def name():
+        return ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(2, 4)))
+    toxinDB_list = list(dict.fromkeys(name() for _ in range(30))) + ['STRASSE']
+    geneProdDB_list = list(dict.fromkeys(name() for _ in range(30))) + ['İstanbul', 'kelvin']
+    paragraphs = []
+    for _ in range(200):
+        words = [rng.choice(WORDS * 8 + toxinDB_list + geneProdDB_list) for _ in range(rng.randint(1, 6))]
+        words = [rng.choice([word, word.upper(), word.lower(), word.title()]) for word in words]  # 'ß'.upper() is 'SS'
+        paragraphs.append(' '.join(words))
+    paragraphs += paragraphs[:10]  # Repeated paragraphs
+    return toxinDB_list, geneProdDB_list, paragraphs
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_matcher_equals_baseline_loop(mining, seed):
+    toxinDB_list, geneProdDB_list, paragraphs = generate(seed)
+    matcher = mining.DictMatcher(toxinDB_list, geneProdDB_list)
+    for start in range(0, len(paragraphs), 10):  # Articles of ten paragraphs each
+        article = paragraphs[start:start+10]
+        result_paragraphs, found_toxins, found_genes, result_spans = matcher.match_paragraphs(article)
+        if result_paragraphs:
+            result = (mining.ParagrOps().remove_duplicate_results(result_paragraphs, result_spans)[0], sorted(found_toxins), sorted(found_genes))
+        else:
+            result = (None, None, None)
+        assert result == baseline(mining, toxinDB_list, geneProdDB_list, article)
+
+
+def test_spans_of_length_changing_case_folds(mining):
+    matcher = mining.DictMatcher(['STRASSE'], ['İstanbul'])
+    paragr = 'Die Straße nach İstanbul'
+    spans = matcher.find_spans(paragr)
+    assert sorted((paragr[start:end], kind) for start, end, kind, name in spans) == [('Straße', 'toxin'), ('İstanbul', 'gene')]
@@ -0,0 +1,66 @@
+'''Uids whose retrieval failed are journalled under the stage `error` and retried by a later `fetch`, which gives the results of a run without failures'''
+import glob
+import json
+import os
+
+import urllib.error
+
+import Bio.Entrez
+
+
+def output_args(workdir, outfolder):
+    return ['--outfolder', os.path.join(workdir, outfolder) + os.sep, '--cachefolder', os.path.join(workdir, outfolder, 'cache') + os.sep]
+
+
+def dictionary_args(workdir):
+    return ['--toxinDB_fname', os.path.join(workdir, 'toxins.txt'),
+            '--geneProdDB_fname', os.path.join(workdir, 'genes.txt'),
+            '--geneProdExcl_fname', os.path.join(workdir, 'excluded.txt')]
+
+
+def read_results(workdir, outfolder):
+    results_fn, = glob.glob(os.path.join(workdir, outfolder, '*[0-9].json'))
+    with open(results_fn, "r") as json_file:
+        results = json.load(json_file)
+    results.pop('pubmed_query')
+    return results
+
+
+def failing(func, n_failures, fails=lambda *args, **kwargs: True):
+    '''Wrap a function so that its first calls for which `fails` holds raise a temporary error'''
+    calls = []
+    def wrapper(*args, **kwargs):
+        if fails(*args, **kwargs) and len(calls) < n_failures:
+            calls.append(args)
+            raise urllib.error.URLError('injected failure')
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def test_failed_retrievals_are_retried(mining, ncbi, tmp_path, monkeypatch):
+    workdir = str(tmp_path)
+    ncbi.write_dictionaries(os.path.join(workdir, 'toxins.txt'), os.path.join(workdir, 'genes.txt'), os.path.join(workdir, 'excluded.txt'))
+    query_args = ['--query', 'benchmark', '--mail', 'test@example.org']
+    fetch_args = ['--mail', 'test@example.org', '--rate', '1000', '--batch_size', '10']
+    mining.main(mining.parse_args(['run'] + query_args + fetch_args[2:] + dictionary_args(workdir) + output_args(workdir, 'clean')))
+
+    mining.main(mining.parse_args(['search'] + query_args + output_args(workdir, 'retried')))
+    ## Failing the metadata of one page, the PMCIDs of another and both downloads of some full texts
+    failed_pmcids = {article['pmcid'] for article in ncbi.articles[::5] if article['pmcid']}
+    monkeypatch.setattr(Bio.Entrez, 'efetch', failing(Bio.Entrez.efetch, 1))
+    monkeypatch.setattr(Bio.Entrez, 'elink', failing(Bio.Entrez.elink, 1))
+    monkeypatch.setattr(mining.FulltextFetcher, 'fetch_url', failing(mining.FulltextFetcher.fetch_url, 2*len(failed_pmcids),
+                                                                     lambda self, request: any(pmcid in str(getattr(request, 'full_url', request)) for pmcid in failed_pmcids)))
+    mining.main(mining.parse_args(['fetch'] + fetch_args + output_args(workdir, 'retried')))
+    manifest_fn, = glob.glob(os.path.join(workdir, 'retried', '*.manifest.json'))
+    with open(manifest_fn, "r") as json_file:
+        uid_stages = json.load(json_file)['uid_stages']
+    assert sum(1 for stage in uid_stages.values() if stage == 'error') > 20  # Two pages and some of the full texts
+
+    monkeypatch.undo()
+    mining.main(mining.parse_args(['fetch'] + fetch_args + output_args(workdir, 'retried')))
+    mining.main(mining.parse_args(['match'] + dictionary_args(workdir) + output_args(workdir, 'retried')))
+    with open(manifest_fn, "r") as json_file:
+        manifest = json.load(json_file)
+    assert manifest['finished'] and set(manifest['uid_stages'].values()) == {'match'}
+    assert read_results(workdir, 'retried') == read_results(workdir, 'clean')
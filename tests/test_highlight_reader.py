@@ -0,0 +1,36 @@
+'''The highlighter reads the articles with hits of a result store just as of the JSON output'''
+import importlib.util
+import json
+import os
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+HIGHLIGHT_FN = os.path.join(os.path.dirname(TESTS_DIR), '02_litMiningPubmed_generateTextHighlights.py')
+
+ARTICLES = {
+    '101': {'article_pmid': '101', 'article_pmcid': 'PMC101', 'article_title': 'Plastid genes', 'article_publdate_str': '2020-01-01', 'n_fulltext_paragr': 3,
+            'article_paragraphs_with_keyw': ['The gene matK.', 'The gene rbcL.', 'The gene matK.'], 'article_result_paragraphs': ['The gene matK.', 'A toxin.'],
+            'found_toxins': ['toxin'], 'found_genes': ['matK']},
+    '102': {'article_pmid': '102', 'article_pmcid': 'PMC102', 'article_title': 'No hits', 'article_publdate_str': '2021-01-01', 'n_fulltext_paragr': 1,
+            'article_paragraphs_with_keyw': ['The gene ycf1.'], 'article_result_paragraphs': [], 'found_toxins': [], 'found_genes': []},
+    '103': {'article_pmid': '103', 'article_pmcid': None, 'article_title': 'Not on PubMedCentral', 'article_publdate_str': '2022-01-01', 'n_fulltext_paragr': None,
+            'article_paragraphs_with_keyw': None, 'article_result_paragraphs': None, 'found_toxins': None, 'found_genes': None},
+}
+
+
+def test_store_reads_like_json(mining, tmp_path):
+    spec = importlib.util.spec_from_file_location('litMiningPubmed_generateTextHighlights', HIGHLIGHT_FN)
+    highlight = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(highlight)
+    assert highlight.mining_script() is mining
+    json_fn = str(tmp_path / 'results.json')
+    with open(json_fn, 'w') as json_file:
+        json.dump(dict(ARTICLES, pubmed_query='gene'), json_file)
+    store_fn = str(tmp_path / 'results.sqlite')
+    store = mining.ResultStore.create(store_fn, 'gene')
+    for position, (uid, article) in enumerate(ARTICLES.items()):
+        store.add(position, uid, article)
+    store.finish()
+    store.close()
+    from_store = list(highlight.iter_results(store_fn))
+    assert [uid for uid, article in from_store] == ['101']
+    assert from_store == [(uid, article) for uid, article in highlight.iter_results(json_fn) if article['article_result_paragraphs']]
@@ -0,0 +1,27 @@
+'''Parity of the PubReader paragraphs extracted via lxml with those of the BeautifulSoup reference backend, on stored sample pages'''
+import glob
+import os
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_FNS = sorted(glob.glob(os.path.join(TESTS_DIR, 'pubreader_samples', '*.html')))
+
+
+@pytest.mark.parametrize('sample_fn', SAMPLE_FNS, ids=os.path.basename)
+def test_lxml_paragraphs_equal_bs4(mining, sample_fn):
+    with open(sample_fn, 'r') as sample_file:
+        html = sample_file.read()
+    reference = mining.HTMLops().extract_all_text_bs4(html)
+    assert reference
+    paragraphs = mining.HTMLops().extract_all_text_lxml(html)
+    assert paragraphs is None or paragraphs == reference
+    n_fulltext_paragr, paragraphs_with_keyw, backends_differ, timings = mining.MiningStages.extract_paragraphs(html, 'check', [' gene '])
+    assert n_fulltext_paragr == len(reference) and not backends_differ
+
+
+@pytest.mark.parametrize('sample_name, handled_by_lxml', [('PMC_plain.html', True), ('PMC_scripts.html', True), ('PMC_blocks.html', False)])
+def test_lxml_hands_over_block_paragraphs(mining, sample_name, handled_by_lxml):
+    with open(os.path.join(TESTS_DIR, 'pubreader_samples', sample_name), 'r') as sample_file:
+        html = sample_file.read()
+    assert (mining.HTMLops().extract_all_text_lxml(html) is not None) == handled_by_lxml
@@ -0,0 +1,39 @@
+'''Parity of the paragraphs extracted from a BioC document on the fetch path with those extracted from a local archive on the ingest path'''
+import pytest
+
+PARAGRAPHS = [('TITLE', 'front', 'A gene cluster for the synthesis of a toxin'),
+              ('INTRO', 'paragraph', 'The gene tox1 encodes a toxin.'),
+              ('RESULTS', 'title_2', 'RESULTS'),
+              ('RESULTS', 'paragraph', 'RESULTS'),  # Main text equal to a header
+              ('RESULTS', 'paragraph', 'Deletion of the gene abolished toxin synthesis.'),
+              ('RESULTS', 'paragraph', 'Deletion of the gene abolished toxin synthesis.'),  # Repeated main text
+              ('DISCUSS', 'paragraph', 'INTRO'),  # Main text equal to an earlier header
+              ('FIG', 'fig_caption', 'Figure of the gene cluster.'),
+              ('REF', 'ref', 'Reference about a gene'),
+              ('ACK_FUND', 'paragraph', 'We thank the gene sequencing facility.')]
+
+
+def bioc_collection(n_documents):
+    passages = ''.join('<passage><infon key="section_type">%s</infon><infon key="type">%s</infon><offset>0</offset><text>%s</text></passage>' % passage for passage in PARAGRAPHS)
+    documents = ''.join('<document><id>%d</id>%s</document>' % (num, passages) for num in range(n_documents))
+    return ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?><!DOCTYPE collection SYSTEM "BioC.dtd">'
+            '<collection><source>PMC</source><date>20220101</date><key>pmc.key</key>%s</collection>' % documents).encode('utf-8')
+
+
+@pytest.mark.parametrize('n_documents', [1, 3])
+def test_ingest_paragraphs_equal_fetch(mining, n_documents):
+    fetched = list(mining.LXMLops().iter_all_text(bioc_collection(1)))
+    assert fetched.count('Deletion of the gene abolished toxin synthesis.') == 2 and fetched.count('RESULTS') == 3
+    documents = list(mining.LXMLops().iter_documents(bioc_collection(n_documents)))
+    assert len(documents) == n_documents
+    for front, paragraphs in documents:
+        assert paragraphs == fetched
+
+
+def test_ingest_keyword_paragraphs_equal_fetch(mining):
+    keywVariants_list = [' gene ', ' gene.']
+    n_fulltext_paragr, paragraphs_with_keyw, backends_differ, timings = mining.MiningStages.extract_paragraphs(bioc_collection(1), 'lxml', keywVariants_list)
+    ingester = mining.ArchiveIngester(mining.DictMatcher(['toxin'], ['tox1']), keywVariants_list)
+    (article, all_paragraphs), = ingester.iter_documents(bioc_collection(1))
+    assert len(all_paragraphs) == n_fulltext_paragr
+    assert mining.ParagrOps().extract_gene_paragraphs(all_paragraphs, keywVariants_list) == paragraphs_with_keyw
@@ -0,0 +1,86 @@
+'''Leases of the work queue of a sharded run: claims, expiry and reclaim by another worker, attempts and lost leases'''
+import os
+
+import pytest
+
+
+@pytest.fixture
+def clock(mining, monkeypatch):
+    '''A settable clock in place of time.time of the work queue'''
+    now = [1000.0]
+    monkeypatch.setattr(mining.time, 'time', lambda: now[0])
+    return now
+
+
+def create_queue(mining, tmp_path, n_shards=2, lease_seconds=60, max_attempts=2):
+    shards = [['%d' % (10*num + uid) for uid in range(3)] for num in range(n_shards)]
+    return mining.WorkQueue.create(os.path.join(str(tmp_path), 'run.queue.sqlite'), shards, lease_seconds, max_attempts, 6)
+
+
+def test_claim_leases_each_shard_once(mining, tmp_path, clock):
+    work_queue = create_queue(mining, tmp_path)
+    assert work_queue.claim('a') == (0, 1, ['0', '1', '2'])
+    assert work_queue.claim('b') == (1, 1, ['10', '11', '12'])
+    assert work_queue.claim('c') is None
+    assert work_queue.counts() == {'leased': 2}
+    assert work_queue.n_active_workers() == 2
+    assert work_queue.rate() == 6
+
+
+def test_expired_lease_is_reclaimed_by_another_worker(mining, tmp_path, clock):
+    work_queue = create_queue(mining, tmp_path, n_shards=1)
+    assert work_queue.claim('a') == (0, 1, ['0', '1', '2'])
+    clock[0] += 30
+    assert work_queue.renew(0, 'a', 1)  # Extends the lease by 60 s from now
+    clock[0] += 50
+    assert work_queue.claim('b') is None
+    assert work_queue.n_active_workers() == 1
+    clock[0] += 20
+    assert work_queue.n_active_workers() == 0
+    assert work_queue.claim('b') == (0, 2, ['0', '1', '2'])
+    ## The earlier owner can neither renew nor complete the shard
+    assert not work_queue.renew(0, 'a', 1)
+    assert not work_queue.complete(0, 'a', 1, 'shard_00000_1', 'hash')
+    assert work_queue.renew(0, 'b', 2)
+    assert work_queue.complete(0, 'b', 2, 'shard_00000_2', 'hash')
+    assert work_queue.done_shards() == [(0, 'shard_00000_2', 'hash')]
+
+
+def test_release_returns_shard_to_queue(mining, tmp_path, clock):
+    work_queue = create_queue(mining, tmp_path, n_shards=1)
+    work_queue.claim('a')
+    work_queue.release(0, 'a', 1)
+    assert work_queue.counts() == {'pending': 1}
+    assert work_queue.claim('b') == (0, 2, ['0', '1', '2'])
+
+
+def test_shards_are_given_up_after_max_attempts(mining, tmp_path, clock):
+    work_queue = create_queue(mining, tmp_path, n_shards=2, max_attempts=2)
+    assert work_queue.claim('a')[:2] == (0, 1)
+    assert work_queue.claim('b')[:2] == (1, 1)
+    assert work_queue.next_expiry() == clock[0] + 60
+    clock[0] += 61
+    assert work_queue.claim('c')[:2] == (0, 2)
+    assert work_queue.claim('d')[:2] == (1, 2)
+    assert work_queue.complete(1, 'd', 2, 'shard_00001_2', 'hash')
+    ## Shard 0 is on its last attempt, so other workers do not wait for its lease to expire, nor claim it once it has
+    assert work_queue.next_expiry() is None
+    clock[0] += 61
+    assert work_queue.claim('e') is None
+    assert work_queue.next_expiry() is None
+    assert work_queue.counts() == {'leased': 1, 'done': 1}
+
+
+def test_lost_lease_discards_journal(mining, tmp_path, clock):
+    work_queue = create_queue(mining, tmp_path, n_shards=1, lease_seconds=0.3)
+    work_queue.claim('a')
+    clock[0] += 1
+    work_queue.claim('b')
+    ## The heartbeat of the earlier owner notices that its lease is lost
+    with work_queue.lease(0, 'a', 1) as lost:
+        assert lost.wait(5)
+    assert not work_queue.complete(0, 'a', 1, 'shard_00000_1', 'hash')
+    assert work_queue.complete(0, 'b', 2, 'shard_00000_2', 'hash')
+    assert work_queue.done_shards() == [(0, 'shard_00000_2', 'hash')]
+    work_queue.mark_merged([0])
+    assert work_queue.done_shards() == [] and work_queue.counts() == {'merged': 1}